@@ -7,7 +7,13 @@ Telegram Bot для управления парковкой и задачами
 """
 
 import asyncio
+import hashlib
+import inspect
+import json
 import logging
+import queue
+import tempfile
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime, timedelta
 from typing import Optional, List, Tuple, Any, Dict
 from io import BytesIO
@@ -16,7 +22,7 @@ from aiogram.types import FSInputFile
 
 import pytz
 from aiogram import Bot, Dispatcher, types, F, Router
-from aiogram.filters import Command, CommandStart
+from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -30,10 +36,15 @@ from aiogram.types import (
     BufferedInputFile
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, delete, func, exists, case, and_
+from sqlalchemy.orm import aliased, contains_eager, joinedload, selectinload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import config
-from database import init_db, SessionLocal, get_db_context
+from database import (
+    init_db, engine, read_engine, SessionLocal, ReadOnlySessionLocal, get_db_context, get_pool_checkedout
+)
 from models import (
     User, Role as RoleModel, RoleRequest,
     Parking, Task, Break, ParkingQueue
@@ -41,25 +52,34 @@ from models import (
 from vehicle_validator import VehicleNumberValidator
 from utils import (
     Emoji, STATUS_NAMES, TASK_STATUS_EMOJI, PRIORITY_NAMES,
+    ROLE_DISPLAY_NAMES, ROLE_DISPLAY_NAMES_WITH_EMOJI,
     ensure_timezone_aware, get_timezone_aware_now, format_duration,
-    get_priority_name, moscow_tz
+    get_priority_name, moscow_tz, format_dt, format_hm_dmy
 )
 from keyboards import (
     get_main_menu_keyboard, get_cancel_keyboard, get_vehicle_type_keyboard,
-    get_role_selection_keyboard, get_switch_role_keyboard,
+    get_role_selection_keyboard, get_switch_role_keyboard, REQUESTABLE_ROLES,
     get_break_menu_keyboard, get_break_confirmation_keyboard,
     get_task_actions_keyboard, get_operator_reports_keyboard,
     get_report_period_keyboard, get_statuses_menu_keyboard,
     get_stuck_tasks_management_keyboard,
-    get_stuck_task_detail_keyboard
+    get_stuck_task_detail_keyboard, BACK_TO_SWITCH_ROLE_MARKUP,
+    GATE_CONFIRMATION_MARKUP, GATE_RETRY_CONFIRMATION_MARKUP, GATE_OCCUPIED_ACTIONS_MARKUP,
+    TRANSFER_GATE_CONFIRMATION_MARKUP, BACK_TO_BREAK_MENU_MARKUP, ABK_SELECTION_MARKUP,
+    CLEAR_POOL_ACTIONS_MARKUP, CLEAR_POOL_MARKUP, BACK_TO_REPORTS_MARKUP, BACK_TO_STATUSES_MARKUP,
+    STATUS_TASKS_MARKUP, STATUS_PARKING_MARKUP, STATUS_QUEUE_MARKUP, STUCK_SUMMARY_MARKUP
 )
 from services import (
-    get_user, get_or_create_user, get_user_roles, get_user_main_role,
+    get_user, get_or_create_user, get_user_roles, get_user_main_role, get_driver_role,
     add_to_parking_queue, get_queue_position, get_queue_stats,
     process_parking_departure, get_free_parking_spot,
     validate_vehicle_number, validate_vehicle_number_with_explanation,
-    normalize_vehicle_number, get_active_transfer_drivers,
-    get_task_from_pool, generate_excel_report
+    normalize_vehicle_number, get_active_transfer_drivers, get_active_transfer_driver_ids,
+    get_task_from_pool, take_task_from_pool, TASK_SUMMARY_OPTIONS, TASK_LIST_OPTIONS,
+    stream_parking_report_rows, generate_excel_report,
+    get_admin_telegram_ids, get_operators, invalidate_role_rosters_cache, invalidate_user_cache,
+    get_cached_user,
+    get_active_parking_with_task, get_task_with_active_parking, claim_task_for_driver
 )
 
 import os
@@ -71,42 +91,88 @@ from services import (
     get_queue_for_current_shift
 )
 from image_service import ImageService
-from aiogram.types import FSInputFile
 
 # В начале файла после импортов добавим константу для пути к изображениям
 GATES_IMAGES_PATH = Path("gates_images")  # Папка с изображениями ворот
 
-async def get_gate_image_path(gate_number: int) -> Optional[Path]:
-    """
-    Получение пути к изображению ворот по номеру
+# Набор файлов статичен: папка сканируется один раз, дальше поиск идет только по памяти
+_GATE_IMAGE_FILES: Optional[Dict[str, Path]] = None  # имя файла -> путь
+_GATE_IMAGE_PATHS: Dict[int, Optional[Path]] = {}
+GATE_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
 
-    Args:
-        gate_number: Номер ворот
 
-    Returns:
-        Path к изображению или None, если файл не найден
-    """
-    # Проверяем различные форматы файлов
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+def _scan_gate_images() -> Dict[str, Path]:
+    """Однократный обход папки с изображениями ворот (блокирующий, вызывается в отдельном потоке)"""
+    if not GATES_IMAGES_PATH.is_dir():
+        return {}
+    return {path.name: path for path in GATES_IMAGES_PATH.iterdir() if path.is_file()}
+
+
+async def load_gate_images_index():
+    """Сканирование папки GATES_IMAGES_PATH и сброс найденных путей"""
+    global _GATE_IMAGE_FILES
+    _GATE_IMAGE_FILES = await asyncio.to_thread(_scan_gate_images)
+    _GATE_IMAGE_PATHS.clear()
+
 
-    for ext in image_extensions:
-        image_path = GATES_IMAGES_PATH / f"{gate_number}{ext}"
-        if image_path.exists():
+def _resolve_gate_image(gate_number: int) -> Optional[Path]:
+    """Поиск изображения ворот среди просканированных файлов"""
+    # Проверяем различные форматы файлов
+    for ext in GATE_IMAGE_EXTENSIONS:
+        image_path = _GATE_IMAGE_FILES.get(f"{gate_number}{ext}")
+        if image_path:
             return image_path
 
     # Проверяем с ведущим нулем для номеров 1-9 (01.jpg, 02.jpg и т.д.)
     if gate_number < 10:
-        for ext in image_extensions:
-            image_path = GATES_IMAGES_PATH / f"0{gate_number}{ext}"
-            if image_path.exists():
+        for ext in GATE_IMAGE_EXTENSIONS:
+            image_path = _GATE_IMAGE_FILES.get(f"0{gate_number}{ext}")
+            if image_path:
                 return image_path
 
     return None
+
+
+def get_gate_image_path(gate_number: int) -> Optional[Path]:
+    """
+    Получение пути к изображению ворот по номеру (без обращения к диску,
+    индекс строится при запуске в load_gate_images_index)
+
+    Args:
+        gate_number: Номер ворот
+
+    Returns:
+        Path к изображению или None, если файл не найден
+    """
+    global _GATE_IMAGE_FILES
+    if _GATE_IMAGE_FILES is None:
+        _GATE_IMAGE_FILES = _scan_gate_images()
+    if gate_number not in _GATE_IMAGE_PATHS:
+        _GATE_IMAGE_PATHS[gate_number] = _resolve_gate_image(gate_number)
+    return _GATE_IMAGE_PATHS[gate_number]
+
 # ==================== НАСТРОЙКА ЛОГИРОВАНИЯ ====================
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Обработчики пишут в консоль и файл в отдельном потоке QueueListener,
+# а в event loop остается только постановка записи в очередь
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_output_handlers: List[logging.Handler] = [logging.StreamHandler()]
+if config.LOG_FILE:
+    _log_output_handlers.append(RotatingFileHandler(
+        config.LOG_FILE,
+        maxBytes=config.LOG_MAX_BYTES,
+        backupCount=config.LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    ))
+for _handler in _log_output_handlers:
+    _handler.setFormatter(_log_formatter)
+
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_queue_handler = QueueHandler(_log_queue)
+# В очередь кладется только текст сообщения, полный формат применяют обработчики слушателя
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = QueueListener(_log_queue, *_log_output_handlers, respect_handler_level=True)
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
+log_listener.start()
 logger = logging.getLogger(__name__)
 
 # ==================== ИНИЦИАЛИЗАЦИЯ БОТА ====================
@@ -118,22 +184,183 @@ dp.include_router(router)
 
 
 # ==================== ДЕКОРАТОР ДЛЯ УПРАВЛЕНИЯ СЕССИЯМИ БД ====================
-def with_db(func):
-    """Декоратор для автоматического управления сессией БД"""
+def with_db(func=None, *, readonly: bool = False):
+    """
+    Декоратор для автоматического управления сессией БД
+
+    @with_db(readonly=True) выдает сессию только для чтения (реплика или отдельный пул),
+    такие обработчики не должны изменять данные.
+    """
+    if func is None:
+        return lambda f: with_db(f, readonly=readonly)
+
+    session_factory = ReadOnlySessionLocal if readonly else SessionLocal
+    pool_size = config.DB_READ_POOL_SIZE if readonly else config.DB_POOL_SIZE
+
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        db = SessionLocal()
-        try:
-            result = await func(*args, db=db, **kwargs)
-            return result
-        except Exception as e:
-            logger.error(f"Ошибка в {func.__name__}: {e}", exc_info=True)
-            raise
-        finally:
-            db.close()
+        # Сессия закрывается (соединение возвращается в пул) при выходе из блока
+        async with session_factory() as db:
+            try:
+                return await func(*args, db=db, **kwargs)
+            except Exception as e:
+                logger.error("Ошибка в %s: %s", func.__name__, e, exc_info=True)
+                raise
+            finally:
+                # Все соединения пула заняты: запросы скоро начнут ждать pool_timeout
+                if get_pool_checkedout(readonly) >= pool_size:
+                    logger.warning("Пул соединений БД исчерпан: выдано %s (pool_size=%s, readonly=%s)",
+                                   get_pool_checkedout(readonly), pool_size, readonly)
     return wrapper
 
 
+TRANSFER_DRIVER_ONLY_TEXT = f"{Emoji.ERROR} Эта функция доступна только водителям перегона."
+
+
+def require_role(role: str, denied_text: str, *, not_on_shift_text: Optional[str] = None):
+    """
+    Ранний отказ по закэшированному пользователю, до открытия сессии БД в @with_db
+
+    Если пользователя нет в кэше get_user, обработчик вызывается как обычно
+    и сам выполняет те же проверки по данным из БД.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(message: Message, *args, **kwargs):
+            user = get_cached_user(message.from_user.id)
+            if user is not None:
+                if not user.has_role(role):
+                    await message.answer(denied_text)
+                    return
+                if not_on_shift_text and not user.is_on_shift:
+                    await message.answer(not_on_shift_text)
+                    return
+            return await func(message, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ==================== КНОПКИ МЕНЮ ====================
+# Обработчики кнопок меню по точному тексту: текст -> (обработчик, принимает ли state)
+TEXT_HANDLERS: Dict[str, Tuple[Any, bool]] = {}
+
+
+def menu_button(text: str):
+    """
+    Регистрация обработчика кнопки меню с точным текстом
+
+    Вне состояний FSM сообщение находится поиском в TEXT_HANDLERS (dispatch_menu_button)
+    без перебора фильтров всех обработчиков. В состояниях FSM работает обычная регистрация
+    router.message, поэтому порядок относительно обработчиков состояний не меняется.
+    """
+    def decorator(func):
+        TEXT_HANDLERS[text] = (func, "state" in inspect.signature(func).parameters)
+        return router.message(F.text == text)(func)
+    return decorator
+
+
+@router.message(StateFilter(None), F.text.in_(TEXT_HANDLERS))
+async def dispatch_menu_button(message: Message, state: FSMContext):
+    """Маршрутизация нажатий кнопок меню вне состояний FSM"""
+    handler, accepts_state = TEXT_HANDLERS[message.text]
+    if accepts_state:
+        return await handler(message, state=state)
+    return await handler(message)
+
+
+# ==================== ШАБЛОНЫ СООБЩЕНИЙ ====================
+# Длинные повторяющиеся сообщения собираются один раз, в обработчиках подставляются только значения
+GATE_OCCUPIED_DRIVER_TMPL = (
+    f"{Emoji.WARNING} ВОРОТА ЗАНЯТЫ!\n\n"
+    "📋 Информация:\n"
+    "🆔 Задача: #{task_id}\n"
+    "🚪 Ворота: #{gate} заняты другим ТС\n"
+    "👤 Ваш статус: Ожидайте нового назначения\n\n"
+    "Оператор уже уведомлен и назначит новую задачу."
+).format
+
+GATE_OCCUPIED_OPERATOR_TMPL = (
+    f"{Emoji.GATE_OCCUPIED} СРОЧНО! ВОРОТА #{{gate}} ЗАНЯТЫ!\n\n"
+    "📋 Детали проблемы:\n"
+    "🆔 Задача: #{task_id}\n"
+    "👤 Водитель: {first_name} {last_name}\n"
+    "🚗 ТС: {vehicle}\n"
+    "📍 Место: #{spot}\n"
+    "🚪 Назначенные ворота: #{gate}\n\n"
+    "🔧 НЕОБХОДИМЫЕ ДЕЙСТВИЯ:\n"
+    "1. Проверить, кто сейчас занимает ворота #{gate}\n"
+    "2. Связаться с водителем, который там находится\n"
+    "3. Освободить ворота или назначить другие ворота\n"
+    "4. Создать новую задачу для водителя {first_name}"
+).format
+
+# Выбор АБК оператором: название и список доступных ворот
+# Номера ворот, доступные в каждом АБК (у АБК-1 ворота 60-65 недоступны)
+ABK1_GATES = frozenset(range(1, 60)) | frozenset(range(66, 84))
+ABK2_GATES = frozenset(range(1, 11))
+ABK_GATES = {"ABK1": ABK1_GATES, "ABK2": ABK2_GATES}
+
+# Номер ворот -> тип АБК; ворота 1-10 есть в обоих зданиях, при совпадении выбирается АБК-1
+GATE_TO_ABK = {gate: "ABK2" for gate in ABK2_GATES}
+GATE_TO_ABK.update((gate, "ABK1") for gate in ABK1_GATES)
+
+# Тип АБК -> (название, доступные ворота одной строкой)
+ABK_INFO = {
+    "ABK1": ("АБК-1", "1-59, 66-83"),
+    "ABK2": ("АБК-2", "1-10"),
+}
+
+# Ответ на ввод ворот другого АБК при переназначении зависшей задачи
+STUCK_GATE_ERRORS = {
+    "ABK1": (
+        f"{Emoji.ERROR} Для этой задачи доступны ворота АБК-1:\n"
+        f"• с 1 по 59\n"
+        f"• с 66 по 83\n"
+        f"Ворота с 60 по 65 недоступны для использования."
+    ),
+    "ABK2": f"{Emoji.ERROR} Для этой задачи доступны только ворота АБК-2 с 1 по 10.",
+}
+
+# Зависшую задачу нельзя вернуть в работу, пока у ТС есть другая активная (ux_task_parking_active)
+ACTIVE_TASK_CONFLICT_TEXT = (
+    f"{Emoji.WARNING} У этого ТС уже есть активная задача.\n\n"
+    f"Зависшую задачу #{{task_id}} нельзя вернуть в работу, пока активная не завершена или не закрыта."
+)
+
+# Ответ на ввод ворот, не входящих в выбранный АБК
+ABK_GATE_ERRORS = {
+    "ABK1": (
+        f"{Emoji.ERROR} Для АБК-1 доступны ворота:\n"
+        f"• с 1 по 59\n"
+        f"• с 66 по 83\n"
+        f"Ворота с 60 по 65 недоступны для использования."
+    ),
+    "ABK2": f"{Emoji.ERROR} Для АБК-2 доступны только ворота с 1 по 10.",
+}
+
+_ABK_GATE_TEXTS = {
+    "ABK1": ("АБК-1", "• с 1 по 59\n• с 66 по 83\n❌ Ворота с 60 по 65 НЕДОСТУПНЫ\n\n"),
+    "ABK2": ("АБК-2", "• с 1 по 10\n\n"),
+}
+# Тип АБК -> (название, ворота, готовая подсказка без данных о ТС)
+ABK_GATE_PROMPTS = {
+    abk_type: (abk_name, gates, f"🏢 Выбран {abk_name}\n\n📋 Доступные ворота:\n{gates}Введите номер ворот:")
+    for abk_type, (abk_name, gates) in _ABK_GATE_TEXTS.items()
+}
+
+ABK_SELECTED_TMPL = (
+    "🏢 Выбран {abk_name}\n\n"
+    "📋 Информация о ТС:\n"
+    "📍 Место: #{spot}\n"
+    "🚗 Номер: {vehicle}\n"
+    "👤 Водитель: {driver}\n"
+    "📝 Тип: {type_mark}\n\n"
+    "📋 Доступные ворота для {abk_name}:\n"
+    "{gates}"
+    "Введите номер ворот:"
+).format
+
+
 # ==================== СОСТОЯНИЯ FSM ====================
 class DriverStates(StatesGroup):
     waiting_for_vehicle_number = State()
@@ -170,24 +397,32 @@ class DriverTransferStates(StatesGroup):
 # ==================== ОБРАБОТЧИК КОМАНДЫ /START ====================
 @router.message(CommandStart())
 @with_db
-async def cmd_start(message: Message, db: Session):
+async def cmd_start(message: Message, db: AsyncSession):
     """Обработчик команды /start"""
+    # /start служит и для обновления меню после выдачи ролей, поэтому читаем пользователя из БД
+    invalidate_user_cache(message.from_user.id)
     user = await get_or_create_user(db, message)
 
     # Проверка наличия роли DRIVER
     roles_list = get_user_roles(user)
+    driver_role_added = False
     if not roles_list:
-        driver_role = db.query(RoleModel).filter(RoleModel.name == "DRIVER").first()
+        driver_role = await get_driver_role(db)
         if driver_role:
             user.roles.append(driver_role)
-            db.commit()
             roles_list = ["DRIVER"]
-            logger.info(f"✅ Пользователю {user.telegram_id} добавлена роль DRIVER")
+            driver_role_added = True
 
     # Установка текущей роли
-    if not user.current_role:
+    current_role_set = not user.current_role
+    if current_role_set:
         user.current_role = "DRIVER"
-        db.commit()
+
+    # Роль и текущая роль сохраняются одним коммитом
+    if driver_role_added or current_role_set:
+        await db.commit()
+    if driver_role_added:
+        logger.info("✅ Пользователю %s добавлена роль DRIVER", user.telegram_id)
 
     name = f"{user.first_name} {user.last_name}".strip() or "Пользователь"
 
@@ -201,6 +436,132 @@ async def cmd_start(message: Message, db: Session):
         reply_markup=get_main_menu_keyboard(user)
     )
 
+# Кэш file_id уже загруженных в Telegram изображений: (тип папки, номер) -> file_id
+_GATE_FILE_ID_CACHE: Dict[Tuple[str, int], str] = {}
+
+
+def _get_cached_gate_photo(folder_type: str, number: int):
+    """
+    Получение изображения для отправки: file_id из кэша или файл с диска
+
+    Returns:
+        file_id, FSInputFile или None, если изображение не найдено
+    """
+    file_id = _GATE_FILE_ID_CACHE.get((folder_type, number))
+    if file_id:
+        return file_id
+
+    # Путь берется из индекса ImageService, файл уже найден при сканировании папки,
+    # поэтому повторный stat() в потоке событий не нужен
+    image_path = ImageService.get_image_path(folder_type, number)
+    if image_path:
+        return FSInputFile(image_path)
+    return None
+
+
+def _remember_gate_photo(folder_type: str, number: int, sent: Message):
+    """Сохранение file_id после первой загрузки, повторные отправки идут без загрузки файла"""
+    if sent and getattr(sent, "photo", None):
+        file_id = sent.photo[-1].file_id
+        if _GATE_FILE_ID_CACHE.get((folder_type, number)) != file_id:
+            _GATE_FILE_ID_CACHE[(folder_type, number)] = file_id
+            # Запись на диск в пуле потоков, чтобы не блокировать обработку сообщений
+            asyncio.get_running_loop().run_in_executor(
+                None, _save_gate_file_ids, {f"{k[0]}:{k[1]}": v for k, v in _GATE_FILE_ID_CACHE.items()}
+            )
+
+
+def _forget_gate_photo(folder_type: str, number: int):
+    """Удаление file_id из кэша (например, если Telegram его больше не принимает)"""
+    _GATE_FILE_ID_CACHE.pop((folder_type, number), None)
+
+
+# Файл с file_id изображений, чтобы после перезапуска не загружать их в Telegram заново
+GATE_FILE_IDS_FILE = Path("gate_file_ids.json")
+# Отпечаток папки с изображениями, для которого сохранены file_id
+_gate_images_fingerprint: Optional[str] = None
+
+
+def _compute_gate_images_fingerprint() -> str:
+    """Отпечаток набора изображений (путь, размер, время изменения всех файлов)"""
+    entries = []
+    for path in GATES_IMAGES_PATH.rglob("*"):
+        if path.is_file():
+            stat = path.stat()
+            entries.append((path.relative_to(GATES_IMAGES_PATH).as_posix(), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(sorted(entries)).encode("utf-8")).hexdigest()
+
+
+def _load_gate_file_ids():
+    """
+    Загрузка сохраненных file_id при запуске бота
+
+    Если изображения на диске заменили или добавили, сохраненные file_id
+    указывают на старые картинки и не используются.
+    """
+    global _gate_images_fingerprint
+    _gate_images_fingerprint = _compute_gate_images_fingerprint()
+    if not GATE_FILE_IDS_FILE.exists():
+        return
+    try:
+        stored = json.loads(GATE_FILE_IDS_FILE.read_text(encoding="utf-8"))
+        if stored.get("fingerprint") != _gate_images_fingerprint:
+            logger.info("Изображения ворот изменились, сохраненные file_id сброшены")
+            return
+        for key, file_id in stored["file_ids"].items():
+            folder_type, number = key.rsplit(":", 1)
+            _GATE_FILE_ID_CACHE[(folder_type, int(number))] = file_id
+        logger.info("Загружено %s file_id изображений", len(stored["file_ids"]))
+    except Exception as e:
+        logger.error("Ошибка загрузки %s: %s", GATE_FILE_IDS_FILE, e)
+
+
+def _save_gate_file_ids(snapshot: Dict[str, str]):
+    """Атомарная запись file_id на диск (выполняется в отдельном потоке)"""
+    global _gate_images_fingerprint
+    try:
+        if _gate_images_fingerprint is None:
+            _gate_images_fingerprint = _compute_gate_images_fingerprint()
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=GATE_FILE_IDS_FILE.parent, suffix=".tmp", delete=False
+        ) as tmp:
+            json.dump({"fingerprint": _gate_images_fingerprint, "file_ids": snapshot}, tmp, ensure_ascii=False)
+        os.replace(tmp.name, GATE_FILE_IDS_FILE)
+    except Exception as e:
+        logger.error("Ошибка сохранения %s: %s", GATE_FILE_IDS_FILE, e)
+
+
+# Ключ кэша file_id для изображений из папки GATES_IMAGES_PATH
+GATES_FOLDER_KEY = "GATES"
+
+
+async def answer_with_gate_photo(message: Message, gate_number: int, image_path: Optional[Path],
+                                 text: str, reply_markup=None):
+    """
+    Ответ с изображением ворот из GATES_IMAGES_PATH (повторно по file_id без загрузки файла)
+
+    Если изображения нет или отправка не удалась, отправляется только текст.
+    """
+    if image_path:
+        photo = _GATE_FILE_ID_CACHE.get((GATES_FOLDER_KEY, gate_number)) or FSInputFile(image_path)
+        try:
+            sent = await message.answer_photo(
+                photo=photo,
+                caption=text,
+                reply_markup=reply_markup
+            )
+            _remember_gate_photo(GATES_FOLDER_KEY, gate_number, sent)
+            return
+        except Exception as e:
+            logger.error("Ошибка при отправке изображения ворот: %s", e)
+            _forget_gate_photo(GATES_FOLDER_KEY, gate_number)
+
+    await message.answer(
+        text,
+        reply_markup=reply_markup
+    )
+
+
 async def send_gate_image(message: Message, folder_type: str, number: int, caption: str = None):
     """
     Отправка изображения ворот или парковки
@@ -212,15 +573,15 @@ async def send_gate_image(message: Message, folder_type: str, number: int, capti
         caption: Подпись к изображению
     """
     try:
-        image_path = ImageService.get_image_path(folder_type, number)
+        photo = _get_cached_gate_photo(folder_type, number)
 
-        if image_path and image_path.exists():
-            photo = FSInputFile(image_path)
-            await message.answer_photo(
+        if photo:
+            sent = await message.answer_photo(
                 photo=photo,
                 caption=caption
             )
-            logger.info(f"✅ Отправлено изображение {folder_type}/{number}")
+            _remember_gate_photo(folder_type, number, sent)
+            logger.info("✅ Отправлено изображение %s/%s", folder_type, number)
             return True
         else:
             # Если изображение не найдено, отправляем сообщение об этом
@@ -228,14 +589,15 @@ async def send_gate_image(message: Message, folder_type: str, number: int, capti
                 f"⚠️ Изображение для {folder_type} #{number} не найдено.\n"
                 f"Но вы можете продолжить работу."
             )
-            logger.warning(f"Изображение не найдено: {folder_type}/{number}")
+            logger.warning("Изображение не найдено: %s/%s", folder_type, number)
             return False
 
     except Exception as e:
-        logger.error(f"Ошибка при отправке изображения: {e}")
+        logger.error("Ошибка при отправке изображения: %s", e)
+        _forget_gate_photo(folder_type, number)
         return False
 
-async def send_task_with_image(telegram_id: int, building_type: str, gate_number: int, caption: str):
+async def send_task_with_image(telegram_id: int, building_type: str, gate_number: int, caption: str) -> bool:
     """
     Отправка задачи с изображением ворот
 
@@ -244,43 +606,173 @@ async def send_task_with_image(telegram_id: int, building_type: str, gate_number
         building_type: Тип здания ("ABK1", "ABK2")
         gate_number: Номер ворот
         caption: Текст сообщения
+
+    Returns:
+        True, если получатель получил задачу (с изображением или хотя бы текстом)
     """
     try:
-        from image_service import ImageService
-        from aiogram.types import FSInputFile
+        photo = _get_cached_gate_photo(building_type, gate_number)
 
-        image_path = ImageService.get_image_path(building_type, gate_number)
-
-        if image_path and image_path.exists():
-            photo = FSInputFile(image_path)
-            await bot.send_photo(
+        if photo:
+            sent = await bot.send_photo(
                 chat_id=telegram_id,
                 photo=photo,
                 caption=caption
             )
-            logger.info(f"✅ Отправлено изображение {building_type}/{gate_number} пользователю {telegram_id}")
+            _remember_gate_photo(building_type, gate_number, sent)
+            logger.info("✅ Отправлено изображение %s/%s пользователю %s", building_type, gate_number, telegram_id)
+            return True
         else:
             # Если нет изображения, отправляем только текст
             await bot.send_message(
                 chat_id=telegram_id,
                 text=caption + f"\n\n⚠️ Изображение для ворот #{gate_number} не найдено."
             )
-            logger.warning(f"Изображение не найдено: {building_type}/{gate_number}")
+            logger.warning("Изображение не найдено: %s/%s", building_type, gate_number)
+            return True
 
     except Exception as e:
-        logger.error(f"Ошибка отправки задачи с изображением: {e}")
+        logger.error("Ошибка отправки задачи с изображением: %s", e)
+        _forget_gate_photo(building_type, gate_number)
         # Пробуем отправить хотя бы текст
         try:
             await bot.send_message(telegram_id, caption)
+            return True
         except Exception as e2:
-            logger.error(f"Не удалось отправить даже текст: {e2}")
+            logger.error("Не удалось отправить даже текст: %s", e2)
+            return False
+
+
+async def broadcast_task_with_image(chat_ids: List[int], building_type: str, gate_number: int, caption: str) -> int:
+    """
+    Параллельная рассылка задачи с изображением ворот нескольким водителям
+
+    Первому получателю изображение отправляется отдельно: файл загружается один раз,
+    остальным уходит уже сохраненный file_id. Темп отправки ограничивает _broadcast_limiter.
+
+    Returns:
+        Количество водителей, получивших задачу
+    """
+    if not chat_ids:
+        return 0
+
+    async def _send(chat_id: int) -> bool:
+        async with _broadcast_limiter:
+            return await send_task_with_image(chat_id, building_type, gate_number, caption)
+
+    first, *rest = chat_ids
+    delivered = int(await _send(first))
+    results = await asyncio.gather(*(_send(chat_id) for chat_id in rest))
+    return delivered + sum(results)
+
+
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+# Побочная работа (уведомления), результат которой не нужен для ответа пользователю
+BACKGROUND_TASKS_LIMIT = 50
+_background_semaphore = asyncio.Semaphore(BACKGROUND_TASKS_LIMIT)
+_background_tasks: set = set()
+
+
+def run_in_background(coro):
+    """
+    Запуск корутины в фоне, не дожидаясь ее завершения
+
+    Одновременно выполняется не более BACKGROUND_TASKS_LIMIT задач, остальные ждут.
+    Ссылки на задачи хранятся до завершения, чтобы их не удалил сборщик мусора.
+    """
+    async def _runner():
+        async with _background_semaphore:
+            await coro
+
+    task = asyncio.create_task(_runner())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# ==================== МАССОВЫЕ УВЕДОМЛЕНИЯ ====================
+class AsyncRateLimiter:
+    """Ограничитель частоты вызовов: не более rate запусков в секунду, равномерно"""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self._lock:
+            loop_time = asyncio.get_running_loop().time()
+            if self._next_slot > loop_time:
+                await asyncio.sleep(self._next_slot - loop_time)
+                loop_time = self._next_slot
+            self._next_slot = loop_time + self._interval
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+# Telegram допускает ~30 сообщений в секунду на бота, оставляем запас
+BROADCAST_RATE_LIMIT = 25
+_broadcast_limiter = AsyncRateLimiter(BROADCAST_RATE_LIMIT)
+
+
+async def broadcast_message(chat_ids: List[int], text: str, **kwargs) -> int:
+    """
+    Параллельная рассылка одного сообщения нескольким получателям
+
+    Ошибка доставки одному получателю не прерывает рассылку, а только логируется.
+
+    Args:
+        chat_ids: Telegram ID получателей
+        text: Текст сообщения
+
+    Returns:
+        Количество успешно доставленных сообщений
+    """
+    async def _send(chat_id: int):
+        async with _broadcast_limiter:
+            return await bot.send_message(chat_id, text, **kwargs)
+
+    results = await asyncio.gather(*(_send(chat_id) for chat_id in chat_ids), return_exceptions=True)
+    delivered = 0
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.error("Ошибка массового уведомления %s: %s", chat_id, result)
+        else:
+            delivered += 1
+    return delivered
+
+
+async def _send_notification(chat_id: int, text: str, error_log: str):
+    """Отправка уведомления с учетом лимита Telegram; ошибка только логируется"""
+    try:
+        async with _broadcast_limiter:
+            await bot.send_message(chat_id, text)
+    except Exception as e:
+        logger.error(error_log, e)
+
+
+def notify_in_background(chat_id: int, text: str, error_log: str = "Ошибка уведомления: %s"):
+    """Уведомление в фоне: обработчик отвечает пользователю, не дожидаясь отправки"""
+    run_in_background(_send_notification(chat_id, text, error_log))
+
+
+async def _broadcast_pool_task(operator_chat_id: int, task_id: int, chat_ids: List[int],
+                               building_type: str, gate_number: int, caption: str):
+    """Рассылка новой задачи пула водителям и отчет оператору о числе уведомленных"""
+    notified_count = await broadcast_task_with_image(chat_ids, building_type, gate_number, caption)
+    await _send_notification(
+        operator_chat_id,
+        f"📣 Задача #{task_id}: уведомлено {notified_count} из {len(chat_ids)} водителей перегона",
+        "Ошибка отчета о рассылке: %s"
+    )
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ СМЕНЫ РОЛИ ====================
 @router.message(F.text.contains("Сменить роль"))
 @router.message(F.text.contains("Переключить роль"))
 @with_db
-async def process_switch_role(message: Message, db: Session):
+async def process_switch_role(message: Message, db: AsyncSession):
     """Процесс переключения между ролями"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -296,7 +788,7 @@ async def process_switch_role(message: Message, db: Session):
         )
         return
 
-    current_role = get_user_main_role(user)
+    current_role = get_user_main_role(user, user_roles)
 
     await message.answer(
         f"{Emoji.SWITCH} Переключение роли\n"
@@ -308,7 +800,7 @@ async def process_switch_role(message: Message, db: Session):
 
 @router.callback_query(F.data.startswith("switch_role_"))
 @with_db
-async def process_switch_role_selection(callback: CallbackQuery, db: Session):
+async def process_switch_role_selection(callback: CallbackQuery, db: AsyncSession):
     """Обработка выбора роли для переключения"""
     role_str = callback.data.replace("switch_role_", "")
     user = await get_user(db, callback.from_user.id)
@@ -317,24 +809,15 @@ async def process_switch_role_selection(callback: CallbackQuery, db: Session):
         await callback.message.edit_text(f"{Emoji.ERROR} Пользователь не найден.")
         return
 
-    user_roles = get_user_roles(user)
-    if role_str not in user_roles:
+    if not user.has_role(role_str):
         await callback.message.edit_text(f"{Emoji.ERROR} У вас нет этой роли.")
         return
 
     # Сохраняем выбранную роль
     user.current_role = role_str
-    db.commit()
+    await db.commit()
 
-    role_names = {
-        "DRIVER": "Водитель",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "OPERATOR": "Оператор",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-
-    role_name = role_names.get(role_str, role_str)
+    role_name = ROLE_DISPLAY_NAMES.get(role_str, role_str)
 
     # Пытаемся отредактировать сообщение
     try:
@@ -353,48 +836,34 @@ async def process_switch_role_selection(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data == "show_requestable_roles")
 @with_db
-async def process_show_requestable_roles(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_show_requestable_roles(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Показать доступные для запроса роли"""
     user = await get_user(db, callback.from_user.id)
     if not user:
         await callback.message.edit_text("❌ Пользователь не найден.")
         return
 
-    user_roles = get_user_roles(user)
-
     # Проверка активного запроса
-    active_request = db.query(RoleRequest).filter(
+    active_request = await db.scalar(select(RoleRequest).where(
         RoleRequest.user_id == user.id,
         RoleRequest.status == "ожидает"
-    ).first()
+    ).limit(1))
 
     if active_request:
-        role_names = {
-            "OPERATOR": "Оператор",
-            "DRIVER_TRANSFER": "Водитель перегона",
-            "ADMIN": "Администратор",
-            "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-        }
         await callback.message.edit_text(
             f"ℹ️ У вас уже есть активный запрос на роль "
-            f"'{role_names.get(active_request.requested_role, active_request.requested_role)}'.\n"
-            f"⏰ Дата запроса: {active_request.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"'{ROLE_DISPLAY_NAMES.get(active_request.requested_role, active_request.requested_role)}'.\n"
+            f"⏰ Дата запроса: {format_dt(active_request.created_at)}\n\n"
             f"Ожидайте решения администратора.",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_switch_role"
-            ).as_markup()
+            reply_markup=BACK_TO_SWITCH_ROLE_MARKUP
         )
         return
 
-    role_keyboard = get_role_selection_keyboard(user_roles)
+    role_keyboard = get_role_selection_keyboard(user.role_set)
     if not role_keyboard:
         await callback.message.edit_text(
             "✅ У вас уже есть все доступные роли!",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_switch_role"
-            ).as_markup()
+            reply_markup=BACK_TO_SWITCH_ROLE_MARKUP
         )
         return
 
@@ -406,7 +875,7 @@ async def process_show_requestable_roles(callback: CallbackQuery, state: FSMCont
 
 @router.callback_query(F.data == "back_to_switch_role")
 @with_db
-async def process_back_to_switch_role(callback: CallbackQuery, db: Session):
+async def process_back_to_switch_role(callback: CallbackQuery, db: AsyncSession):
     """Возврат в меню смены роли"""
     user = await get_user(db, callback.from_user.id)
     if not user:
@@ -414,7 +883,7 @@ async def process_back_to_switch_role(callback: CallbackQuery, db: Session):
         return
 
     user_roles = get_user_roles(user)
-    current_role = get_user_main_role(user)
+    current_role = get_user_main_role(user, user_roles)
 
     await callback.message.edit_text(
         f"{Emoji.SWITCH} Переключение роли\n"
@@ -425,9 +894,9 @@ async def process_back_to_switch_role(callback: CallbackQuery, db: Session):
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ ВОДИТЕЛЕЙ ====================
-@router.message(F.text == f"{Emoji.TASK} Мои задачи")
+@menu_button(f"{Emoji.TASK} Мои задачи")
 @with_db
-async def process_my_tasks(message: Message, db: Session):
+async def process_my_tasks(message: Message, db: AsyncSession):
     """Просмотр своих задач для водителя"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -435,19 +904,19 @@ async def process_my_tasks(message: Message, db: Session):
         return
 
     # Находим активную парковку
-    active_parking = db.query(Parking).filter(
+    active_parking = await db.scalar(select(Parking).where(
         Parking.user_id == user.id,
         Parking.departure_time == None
-    ).first()
+    ).limit(1))
 
     if not active_parking:
         await message.answer(f"{Emoji.INFO} Вы не припаркованы.")
         return
 
     # Ищем задачи, связанные с ТС водителя
-    tasks = db.query(Task).filter(
+    tasks = (await db.scalars(select(Task).where(
         Task.parking_id == active_parking.id
-    ).order_by(Task.created_at.desc()).all()
+    ).order_by(Task.created_at.desc()))).all()
 
     if not tasks:
         await message.answer(
@@ -457,42 +926,45 @@ async def process_my_tasks(message: Message, db: Session):
         )
         return
 
-    response = f"{Emoji.TASK} ЗАДАЧИ ДЛЯ ВАШЕГО ТС:\n\n"
-    response += f"📍 Место #{active_parking.spot_number}\n"
-    response += f"🚗 ТС: {active_parking.vehicle_number}\n\n"
+    parts = [
+        f"{Emoji.TASK} ЗАДАЧИ ДЛЯ ВАШЕГО ТС:\n\n",
+        f"📍 Место #{active_parking.spot_number}\n",
+        f"🚗 ТС: {active_parking.vehicle_number}\n\n",
+    ]
 
-    for task in tasks:
-        status_emoji = TASK_STATUS_EMOJI.get(task.status, "❓")
-        status_text = STATUS_NAMES.get(task.status, task.status)
+    status_emoji_get = TASK_STATUS_EMOJI.get
+    status_name_get = STATUS_NAMES.get
+    separator = f"{'─' * 30}\n"
+    now = get_timezone_aware_now()
 
-        response += (
-            f"{status_emoji} Задача #{task.id}\n"
+    for task in tasks:
+        parts.append(
+            f"{status_emoji_get(task.status, '❓')} Задача #{task.id}\n"
             f"🚪 Ворота: #{task.gate_number}\n"
-            f"📌 Статус: {status_text}\n"
+            f"📌 Статус: {status_name_get(task.status, task.status)}\n"
         )
 
         if task.status == "PENDING":
-            response += f"⏰ Ожидает выполнения\n"
+            parts.append("⏰ Ожидает выполнения\n")
         elif task.status == "IN_PROGRESS" and task.started_at:
             started = ensure_timezone_aware(task.started_at)
-            duration = get_timezone_aware_now() - started
-            minutes = int(duration.total_seconds() / 60)
-            response += f"⏰ В работе: {minutes} мин\n"
+            minutes = int((now - started).total_seconds() / 60)
+            parts.append(f"⏰ В работе: {minutes} мин\n")
         elif task.status == "COMPLETED" and task.completed_at:
             completed = ensure_timezone_aware(task.completed_at)
-            response += f"✅ Выполнена: {completed.strftime('%H:%M %d.%m.%Y')}\n"
+            parts.append(f"✅ Выполнена: {format_hm_dmy(completed)}\n")
         elif task.status == "STUCK":
-            response += f"⚠️ Причина: {task.stuck_reason or 'Не указана'}\n"
+            parts.append(f"⚠️ Причина: {task.stuck_reason or 'Не указана'}\n")
 
-        response += f"{'─' * 30}\n"
+        parts.append(separator)
 
-    await message.answer(response[:4000])
+    await message.answer("".join(parts)[:4000])
 
 
 # ==================== ОБРАБОТЧИКИ ЗАПРОСА РОЛИ ====================
 @router.message(F.text.contains("Запросить роль"))
 @with_db
-async def process_role_request_start(message: Message, state: FSMContext, db: Session):
+async def process_role_request_start(message: Message, state: FSMContext, db: AsyncSession):
     """Начало процесса запроса новой роли"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -500,29 +972,22 @@ async def process_role_request_start(message: Message, state: FSMContext, db: Se
         return
 
     # Проверка активного запроса
-    active_request = db.query(RoleRequest).filter(
+    active_request = await db.scalar(select(RoleRequest).where(
         RoleRequest.user_id == user.id,
         RoleRequest.status == "ожидает"
-    ).first()
+    ).limit(1))
 
     if active_request:
-        role_names = {
-            "OPERATOR": "Оператор",
-            "DRIVER_TRANSFER": "Водитель перегона",
-            "ADMIN": "Администратор",
-            "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-        }
         await message.answer(
             f"ℹ️ У вас уже есть активный запрос на роль "
-            f"'{role_names.get(active_request.requested_role, active_request.requested_role)}'.\n"
-            f"⏰ Дата запроса: {active_request.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+            f"'{ROLE_DISPLAY_NAMES.get(active_request.requested_role, active_request.requested_role)}'.\n"
+            f"⏰ Дата запроса: {format_dt(active_request.created_at)}\n"
             f"📋 Статус: {active_request.status}\n\n"
             f"Ожидайте решения администратора."
         )
         return
 
-    user_roles = get_user_roles(user)
-    if not get_role_selection_keyboard(user_roles):
+    if REQUESTABLE_ROLES.keys() <= user.role_set:
         await message.answer("✅ У вас уже есть все доступные роли!")
         return
 
@@ -538,7 +1003,7 @@ async def process_role_request_start(message: Message, state: FSMContext, db: Se
 
 @router.message(RequestStates.waiting_for_full_name)
 @with_db
-async def process_full_name(message: Message, state: FSMContext, db: Session):
+async def process_full_name(message: Message, state: FSMContext, db: AsyncSession):
     """Шаг 2: Обработка ввода имени и фамилии"""
     if message.text == f"{Emoji.CANCEL} Отмена":
         await state.clear()
@@ -573,7 +1038,7 @@ async def process_full_name(message: Message, state: FSMContext, db: Session):
 
 @router.message(RequestStates.waiting_for_position)
 @with_db
-async def process_position(message: Message, state: FSMContext, db: Session):
+async def process_position(message: Message, state: FSMContext, db: AsyncSession):
     """Шаг 3: Обработка ввода должности"""
     position = message.text.strip()
     if len(position) < 2:
@@ -583,9 +1048,8 @@ async def process_position(message: Message, state: FSMContext, db: Session):
     await state.update_data(position=position)
 
     user = await get_user(db, message.from_user.id)
-    user_roles = get_user_roles(user)
 
-    role_keyboard = get_role_selection_keyboard(user_roles)
+    role_keyboard = get_role_selection_keyboard(user.role_set)
     if not role_keyboard:
         await message.answer("❌ У вас уже есть все доступные роли.")
         await state.clear()
@@ -602,7 +1066,7 @@ async def process_position(message: Message, state: FSMContext, db: Session):
 
 @router.callback_query(F.data.startswith("request_role_"))
 @with_db
-async def process_request_role_final(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_request_role_final(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Финальная обработка запроса роли"""
     role_str = callback.data.replace("request_role_", "")
     user = await get_user(db, callback.from_user.id)
@@ -611,31 +1075,22 @@ async def process_request_role_final(callback: CallbackQuery, state: FSMContext,
         await callback.message.edit_text("❌ Пользователь не найден.")
         return
 
-    user_roles = get_user_roles(user)
-    role_names = {
-        "DRIVER": "Водитель",
-        "OPERATOR": "Оператор",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-
     # Спецобработка для роли DRIVER (только для админов)
     if role_str == "DRIVER":
-        if "ADMIN" not in user_roles:
+        if not user.has_role("ADMIN"):
             await callback.message.edit_text("❌ Только администраторы могут запросить роль Водитель.")
             return
 
-        if role_str in user_roles:
-            await callback.message.edit_text(f"❌ У вас уже есть роль '{role_names[role_str]}'.")
+        if user.has_role(role_str):
+            await callback.message.edit_text(f"❌ У вас уже есть роль '{ROLE_DISPLAY_NAMES[role_str]}'.")
             await state.clear()
             return
 
-        role_model = db.query(RoleModel).filter(RoleModel.name == role_str).first()
+        role_model = await db.scalar(select(RoleModel).where(RoleModel.name == role_str).limit(1))
         if role_model:
             user.roles.append(role_model)
-            db.commit()
-            await callback.message.edit_text(f"✅ Роль '{role_names[role_str]}' успешно добавлена!")
+            await db.commit()
+            await callback.message.edit_text(f"✅ Роль '{ROLE_DISPLAY_NAMES[role_str]}' успешно добавлена!")
             await callback.message.answer(
                 "Теперь вы можете переключиться на роль Водитель.",
                 reply_markup=get_main_menu_keyboard(user)
@@ -648,11 +1103,13 @@ async def process_request_role_final(callback: CallbackQuery, state: FSMContext,
     last_name = data.get('last_name', '')
     position = data.get('position', '')
 
-    if role_str in user_roles:
-        await callback.message.edit_text(f"❌ У вас уже есть роль '{role_names.get(role_str, role_str)}'.")
+    if user.has_role(role_str):
+        await callback.message.edit_text(f"❌ У вас уже есть роль '{ROLE_DISPLAY_NAMES.get(role_str, role_str)}'.")
         await state.clear()
         return
 
+    now = get_timezone_aware_now()
+
     # Создание запроса
     role_request = RoleRequest(
         user_id=user.id,
@@ -661,80 +1118,75 @@ async def process_request_role_final(callback: CallbackQuery, state: FSMContext,
         last_name=last_name,
         position=position,
         status="ожидает",
-        created_at=get_timezone_aware_now()
+        created_at=now
     )
     db.add(role_request)
-    db.commit()
+    await db.commit()
 
-    role_name = role_names.get(role_str, role_str)
+    role_name = ROLE_DISPLAY_NAMES.get(role_str, role_str)
+    requested_at = format_dt(now)
     await callback.message.edit_text(
         f"✅ Запрос на роль '{role_name}' успешно отправлен!\n\n"
         f"📋 Ваши данные:\n"
         f"👤 Имя: {first_name} {last_name}\n"
         f"💼 Должность: {position}\n"
         f"📝 Запрошенная роль: {role_name}\n"
-        f"⏰ Дата запроса: {get_timezone_aware_now().strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"⏰ Дата запроса: {requested_at}\n\n"
         f"Ожидайте решения администратора."
     )
 
-    # Уведомление всех администраторов
-    admins = db.query(User).filter(
-        User.roles.any(RoleModel.name == "ADMIN")
-    ).all()
+    await state.clear()
 
-    for admin in admins:
-        try:
-            await bot.send_message(
-                admin.telegram_id,
-                f"🆕 Новый запрос на роль!\n\n"
-                f"📋 Информация:\n"
-                f"👤 Пользователь: {first_name} {last_name}\n"
-                f"💼 Должность: {position}\n"
-                f"📝 Запрошенная роль: {role_name}\n"
-                f"🆔 Telegram ID: {user.telegram_id}\n"
-                f"👤 Username: @{user.username or 'нет'}\n"
-                f"⏰ Время запроса: {get_timezone_aware_now().strftime('%d.%m.%Y %H:%M')}\n\n"
-                f"Для обработки перейдите в меню '{Emoji.SETTINGS} Выдать роли'."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления администратора {admin.telegram_id}: {e}")
+    # Уведомление всех администраторов (параллельно)
+    admin_ids = await get_admin_telegram_ids(db)
 
-    await state.clear()
+    admin_text = (
+        f"🆕 Новый запрос на роль!\n\n"
+        f"📋 Информация:\n"
+        f"👤 Пользователь: {first_name} {last_name}\n"
+        f"💼 Должность: {position}\n"
+        f"📝 Запрошенная роль: {role_name}\n"
+        f"🆔 Telegram ID: {user.telegram_id}\n"
+        f"👤 Username: @{user.username or 'нет'}\n"
+        f"⏰ Время запроса: {requested_at}\n\n"
+        f"Для обработки перейдите в меню '{Emoji.SETTINGS} Выдать роли'."
+    )
+    await broadcast_message(admin_ids, admin_text)
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ ПРИБЫТИЯ/УБЫТИЯ ====================
-@router.message(F.text == f"{Emoji.ARRIVAL} Прибытие")
+@menu_button(f"{Emoji.ARRIVAL} Прибытие")
 @with_db
-async def process_arrival(message: Message, state: FSMContext, db: Session):
+async def process_arrival(message: Message, state: FSMContext, db: AsyncSession):
     """Процесс регистрации прибытия ТС"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    if "DRIVER" not in get_user_roles(user):
+    if not user.has_role("DRIVER"):
         await message.answer(f"{Emoji.ERROR} Эта функция доступна только водителям.")
         return
 
     # Проверка активной парковки
-    active_parking = db.query(Parking).filter(
+    active_parking = await db.scalar(select(Parking).where(
         Parking.user_id == user.id,
         Parking.departure_time == None
-    ).first()
+    ).limit(1))
 
     if active_parking:
         await message.answer(
             f"{Emoji.WARNING} Вы уже припаркованы на месте #{active_parking.spot_number}.\n"
-            f"⏰ Время прибытия: {active_parking.arrival_time.strftime('%H:%M %d.%m.%Y')}",
+            f"⏰ Время прибытия: {format_hm_dmy(active_parking.arrival_time)}",
             reply_markup=get_main_menu_keyboard(user)
         )
         return
 
     # Проверка, не в очереди ли уже
-    in_queue = db.query(ParkingQueue).filter(
+    in_queue = await db.scalar(select(ParkingQueue).where(
         ParkingQueue.user_id == user.id,
         ParkingQueue.status.in_(["waiting", "notified"])
-    ).first()
+    ).limit(1))
 
     if in_queue:
         position = await get_queue_position(db, user.id)
@@ -761,7 +1213,7 @@ async def process_arrival(message: Message, state: FSMContext, db: Session):
 
 @router.message(DriverStates.waiting_for_vehicle_number)
 @with_db
-async def process_vehicle_number(message: Message, state: FSMContext, db: Session):
+async def process_vehicle_number(message: Message, state: FSMContext, db: AsyncSession):
     """Обработка введенного номера ТС"""
     if message.text == f"{Emoji.CANCEL} Отмена":
         await state.clear()
@@ -771,7 +1223,7 @@ async def process_vehicle_number(message: Message, state: FSMContext, db: Sessio
 
     vehicle_number = message.text.upper().strip()
 
-    if not await validate_vehicle_number(vehicle_number):
+    if not validate_vehicle_number(vehicle_number):
         valid_info = VehicleNumberValidator.get_valid_letters_info()
         examples = VehicleNumberValidator.get_examples()
         await message.answer(
@@ -789,7 +1241,7 @@ async def process_vehicle_number(message: Message, state: FSMContext, db: Sessio
 
 @router.callback_query(F.data.startswith("vehicle_"))
 @with_db
-async def process_vehicle_type(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_vehicle_type(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка выбора типа ТС"""
     vehicle_type = callback.data.replace("vehicle_", "")
     if vehicle_type not in ["non_hitch", "hitch"]:
@@ -815,7 +1267,7 @@ async def process_vehicle_type(callback: CallbackQuery, state: FSMContext, db: S
             arrival_time=get_timezone_aware_now()
         )
         db.add(parking)
-        db.commit()
+        await db.commit()
 
         # Отправляем изображение парковочного места
         await send_gate_image(
@@ -827,7 +1279,7 @@ async def process_vehicle_type(callback: CallbackQuery, state: FSMContext, db: S
             f"📍 Место: #{spot_number}\n"
             f"🚗 ТС: {vehicle_number}\n"
             f"📝 Тип: {'Перецепной' if is_hitch else 'Не перецепной'}\n"
-            f"⏰ Время: {parking.arrival_time.strftime('%H:%M %d.%m.%Y')}\n\n"
+            f"⏰ Время: {format_hm_dmy(parking.arrival_time)}\n\n"
             f"Для убытия используйте кнопку '{Emoji.DEPARTURE} Убытие'"
         )
     else:
@@ -857,30 +1309,23 @@ async def process_vehicle_type(callback: CallbackQuery, state: FSMContext, db: S
     )
     await state.clear()
 
-@router.message(F.text == f"{Emoji.DEPARTURE} Убытие")
+@menu_button(f"{Emoji.DEPARTURE} Убытие")
 @with_db
-async def process_departure(message: Message, db: Session):
+async def process_departure(message: Message, db: AsyncSession):
     """Обработка убытия ТС с парковки"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    active_parking = db.query(Parking).filter(
-        Parking.user_id == user.id,
-        Parking.departure_time == None
-    ).first()
+    # Активная парковка и ее незавершенная задача (один запрос)
+    active_parking, active_task = await get_active_parking_with_task(db, user.id)
 
     if not active_parking:
         await message.answer(f"{Emoji.ERROR} Вы не припаркованы.")
         return
 
     # Проверка активных задач
-    active_task = db.query(Task).filter(
-        Task.parking_id == active_parking.id,
-        Task.status.in_(["PENDING", "IN_PROGRESS"])
-    ).first()
-
     if active_task:
         await message.answer(
             f"{Emoji.WARNING} У вас есть активное задание #{active_task.id}!\n"
@@ -894,41 +1339,59 @@ async def process_departure(message: Message, db: Session):
 
     # Фиксируем убытие
     active_parking.departure_time = get_timezone_aware_now()
-    db.commit()
+    await db.commit()
 
     await message.answer(
         f"{Emoji.SUCCESS} Убытие зафиксировано!\n\n"
         f"📋 Информация:\n"
         f"📍 Место #{freed_spot} освобождено\n"
         f"🚗 ТС: {active_parking.vehicle_number}\n"
-        f"⏰ Время убытия: {active_parking.departure_time.strftime('%H:%M %d.%m.%Y')}",
+        f"⏰ Время убытия: {format_hm_dmy(active_parking.departure_time)}",
         reply_markup=get_main_menu_keyboard(user)
     )
 
-    # Обрабатываем очередь - отправляем уведомление следующему
-    next_in_queue = await process_parking_departure(db, freed_spot, bot)
+    # Обрабатываем очередь в фоне - уведомление следующему не задерживает ответ водителю
+    run_in_background(notify_next_in_queue(freed_spot))
 
-    if next_in_queue:
-        logger.info(f"✅ Уведомление отправлено следующему в очереди (ID: {next_in_queue.user_id})")
-    else:
-        logger.info(f"ℹ️ Очередь пуста, место #{freed_spot} свободно")
+
+async def notify_next_in_queue(freed_spot: int):
+    """Уведомление следующего в очереди об освободившемся месте (в собственной сессии БД)"""
+    try:
+        async with get_db_context() as db:
+            next_in_queue = await process_parking_departure(db, freed_spot, bot)
+
+        if next_in_queue:
+            logger.info("✅ Уведомление отправлено следующему в очереди (ID: %s)", next_in_queue.user_id)
+        else:
+            logger.info("ℹ️ Очередь пуста, место #%s свободно", freed_spot)
+    except Exception as e:
+        logger.error("Ошибка обработки очереди после убытия: %s", e, exc_info=True)
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ ВОРОТ ====================
-@router.message(F.text == f"{Emoji.GATE} Встать на ворота")
+async def answer_task_taken_by_other_driver(message: Message, db: AsyncSession, task: Task):
+    """Сообщение о том, что задача уже выполняется другим водителем"""
+    other_driver = await get_user(db, task.driver_id)
+    driver_name = f"{other_driver.first_name} {other_driver.last_name}".strip() if other_driver else "Другой водитель"
+    await message.answer(
+        f"{Emoji.WARNING} Задача #{task.id} уже выполняется другим водителем!\n"
+        f"👤 Водитель: {driver_name}\n"
+        f"🚪 Ворота: #{task.gate_number}\n\n"
+        f"Свяжитесь с оператором для уточнения."
+    )
+
+
+@menu_button(f"{Emoji.GATE} Встать на ворота")
 @with_db
-async def process_gate_request(message: Message, state: FSMContext, db: Session):
+async def process_gate_request(message: Message, state: FSMContext, db: AsyncSession):
     """Обработка постановки на ворота"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    # Находим активную парковку пользователя
-    active_parking = db.query(Parking).filter(
-        Parking.user_id == user.id,
-        Parking.departure_time == None
-    ).first()
+    # Находим активную парковку пользователя и задачу, связанную с этим ТС (один запрос)
+    active_parking, task = await get_active_parking_with_task(db, user.id)
 
     if not active_parking:
         await message.answer(
@@ -937,12 +1400,6 @@ async def process_gate_request(message: Message, state: FSMContext, db: Session)
         )
         return
 
-    # Ищем задачу, связанную с этим ТС
-    task = db.query(Task).filter(
-        Task.parking_id == active_parking.id,
-        Task.status.in_(["PENDING", "IN_PROGRESS"])
-    ).first()
-
     if not task:
         await message.answer(
             f"{Emoji.INFO} На ваше ТС не назначено активных задач.\n"
@@ -952,35 +1409,31 @@ async def process_gate_request(message: Message, state: FSMContext, db: Session)
         )
         return
 
-    logger.info(f"Найдена задача #{task.id}: статус={task.status}, driver_id={task.driver_id}, user_id={user.id}")
+    logger.info("Найдена задача #%s: статус=%s, driver_id=%s, user_id=%s", task.id, task.status, task.driver_id, user.id)
 
     # Проверяем, не занята ли задача другим водителем
     if task.driver_id and task.driver_id != user.id:
-        other_driver = await get_user(db, task.driver_id)
-        driver_name = f"{other_driver.first_name} {other_driver.last_name}".strip() if other_driver else "Другой водитель"
-        await message.answer(
-            f"{Emoji.WARNING} Задача #{task.id} уже выполняется другим водителем!\n"
-            f"👤 Водитель: {driver_name}\n"
-            f"🚪 Ворота: #{task.gate_number}\n\n"
-            f"Свяжитесь с оператором для уточнения."
-        )
-        return
-
-    # Если задача в статусе IN_PROGRESS, но driver_id не указан - исправляем это
-    if task.status == "IN_PROGRESS" and not task.driver_id:
-        task.driver_id = user.id
-        if not task.started_at:
-            task.started_at = get_timezone_aware_now()
-        db.commit()
-        logger.info(f"Задача #{task.id}: назначен водитель {user.id}")
-
-    # Если задача в статусе PENDING, назначаем на водителя
-    elif task.status == "PENDING":
-        task.driver_id = user.id
-        task.status = "IN_PROGRESS"
-        task.started_at = get_timezone_aware_now()
-        db.commit()
-        logger.info(f"Задача #{task.id}: переведена в IN_PROGRESS, назначен водитель {user.id}")
+        await answer_task_taken_by_other_driver(message, db, task)
+        return
+
+    # Назначаем задачу на водителя одним атомарным UPDATE:
+    # PENDING -> IN_PROGRESS, либо исправляем IN_PROGRESS без driver_id
+    was_pending = task.status == "PENDING"
+    if was_pending or (task.status == "IN_PROGRESS" and not task.driver_id):
+        if not await claim_task_for_driver(db, task, user.id):
+            # Другой водитель успел взять задачу между чтением и обновлением
+            await db.rollback()
+            await db.refresh(task)
+            if task.driver_id and task.driver_id != user.id:
+                await answer_task_taken_by_other_driver(message, db, task)
+            else:
+                await message.answer(f"{Emoji.INFO} Задача #{task.id} больше не активна.")
+            return
+        await db.commit()
+        if was_pending:
+            logger.info("Задача #%s: переведена в IN_PROGRESS, назначен водитель %s", task.id, user.id)
+        else:
+            logger.info("Задача #%s: назначен водитель %s", task.id, user.id)
 
     # Сохраняем данные задачи в состояние
     await state.update_data(
@@ -991,7 +1444,7 @@ async def process_gate_request(message: Message, state: FSMContext, db: Session)
     )
 
     # Получаем путь к изображению ворот
-    image_path = await get_gate_image_path(task.gate_number)
+    image_path = get_gate_image_path(task.gate_number)
 
     # Формируем текст сообщения
     abk_info = ""
@@ -1006,54 +1459,48 @@ async def process_gate_request(message: Message, state: FSMContext, db: Session)
         f"🚪 Номер ворот: #{task.gate_number}\n"
         f"📍 Ваше место: #{active_parking.spot_number}\n"
         f"🚗 Ваше ТС: {active_parking.vehicle_number}\n"
-        f"⏰ Время начала: {task.started_at.strftime('%H:%M %d.%m.%Y') if task.started_at else 'Только что'}\n\n"
+        f"⏰ Время начала: {format_hm_dmy(task.started_at) if task.started_at else 'Только что'}\n\n"
         f"Выберите действие:"
     )
 
-    # Создаем инлайн-клавиатуру для выбора действия
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.COMPLETED} Задача выполнена, встал на ворота",
-        callback_data="gate_completed"
-    )
-    builder.button(
-        text=f"{Emoji.GATE_OCCUPIED} Ворота заняты другим ТС",
-        callback_data="gate_occupied"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Отмена",
-        callback_data="gate_cancel"
-    )
-    builder.adjust(1)
-
     # Устанавливаем состояние
     await state.set_state(DriverStates.waiting_for_gate_confirmation)
 
     # Отправляем сообщение с изображением, если оно есть
-    if image_path and image_path.exists():
-        try:
-            photo = FSInputFile(image_path)
-            await message.answer_photo(
-                photo=photo,
-                caption=message_text,
-                reply_markup=builder.as_markup()
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке изображения ворот: {e}")
-            await message.answer(
-                message_text,
-                reply_markup=builder.as_markup()
-            )
+    await answer_with_gate_photo(message, task.gate_number, image_path, message_text, GATE_CONFIRMATION_MARKUP)
+
+
+async def _resolve_gate_context(
+    callback: CallbackQuery, state: FSMContext, db: AsyncSession
+) -> Optional[Tuple[Dict[str, Any], Task, User]]:
+    """
+    Проверка данных FSM, задачи и пользователя для кнопок подтверждения на воротах
+
+    Returns:
+        (данные FSM, задача, пользователь) или None, если проверка не пройдена
+        (пользователю уже отправлено сообщение об ошибке, состояние очищено)
+    """
+    data = await state.get_data()
+    task = user = None
+    if not data:
+        error = "Данные не найдены. Попробуйте заново."
+    elif not data.get('task_id'):
+        error = "ID задачи не найден."
     else:
-        await message.answer(
-            message_text,
-            reply_markup=builder.as_markup()
-        )
+        task = await db.get(Task, data['task_id'], options=(joinedload(Task.parking),))
+        user = await get_user(db, callback.from_user.id)
+        error = "Задача не найдена." if not task else "Пользователь не найден." if not user else None
+
+    if error:
+        await callback.message.edit_text(f"{Emoji.ERROR} {error}")
+        await state.clear()
+        return None
+    return data, task, user
 
 
 @router.callback_query(F.data == "gate_completed")
 @with_db
-async def process_gate_completed(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_gate_completed(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка успешного выполнения задачи"""
     data = await state.get_data()
     if not data:
@@ -1067,43 +1514,40 @@ async def process_gate_completed(callback: CallbackQuery, state: FSMContext, db:
         await state.clear()
         return
 
-    task = db.query(Task).filter(Task.id == task_id).first()
     user = await get_user(db, callback.from_user.id)
-
-    if not task:
-        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
-        await state.clear()
-        return
-
     if not user:
         await callback.message.edit_text(f"{Emoji.ERROR} Пользователь не найден.")
         await state.clear()
         return
 
-    # Находим активную парковку
-    active_parking = db.query(Parking).filter(
-        Parking.user_id == user.id,
-        Parking.departure_time == None
-    ).first()
+    # Задача и активная парковка пользователя (один запрос)
+    task, active_parking = await get_task_with_active_parking(db, task_id, user.id)
+
+    if not task:
+        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
+        await state.clear()
+        return
 
     # Обновляем статус задачи
     task.status = "COMPLETED"
-    task.completed_at = get_timezone_aware_now()
+    now = get_timezone_aware_now()
+    task.completed_at = now
 
     # Фиксируем убытие с парковки
     if active_parking:
-        active_parking.departure_time = get_timezone_aware_now()
+        active_parking.departure_time = now
         active_parking.gate_number = task.gate_number
 
-    db.commit()
+    await db.commit()
 
+    completed_str = format_hm_dmy(now)
     await callback.message.edit_text(
         f"{Emoji.SUCCESS} ЗАДАЧА ВЫПОЛНЕНА!\n\n"
         f"📋 Информация:\n"
         f"🆔 Задача: #{task.id}\n"
         f"🚪 Ворота: #{task.gate_number}\n"
         f"📍 Место #{active_parking.spot_number if active_parking else '?'} освобождено\n"
-        f"⏰ Время завершения: {task.completed_at.strftime('%H:%M %d.%m.%Y')}"
+        f"⏰ Время завершения: {completed_str}"
     )
 
     # Уведомляем оператора об успешном выполнении
@@ -1115,10 +1559,10 @@ async def process_gate_completed(callback: CallbackQuery, state: FSMContext, db:
                 f"👤 Водитель: {user.first_name} {user.last_name}\n"
                 f"🚗 ТС: {task.parking.vehicle_number if task.parking else 'Неизвестно'}\n"
                 f"🚪 Ворота: #{task.gate_number}\n"
-                f"⏰ Время: {task.completed_at.strftime('%H:%M %d.%m.%Y')}"
+                f"⏰ Время: {completed_str}"
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
     # Отправляем обновленное главное меню
     await callback.message.answer(
@@ -1131,120 +1575,70 @@ async def process_gate_completed(callback: CallbackQuery, state: FSMContext, db:
 
 @router.callback_query(F.data == "gate_occupied")
 @with_db
-async def process_gate_occupied(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_gate_occupied(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка ситуации, когда ворота заняты"""
-    data = await state.get_data()
-    if not data:
-        await callback.message.edit_text(f"{Emoji.ERROR} Данные не найдены. Попробуйте заново.")
-        await state.clear()
+    ctx = await _resolve_gate_context(callback, state, db)
+    if ctx is None:
         return
-
-    task_id = data.get('task_id')
+    data, task, user = ctx
     gate_number = data.get('gate_number')
 
-    if not task_id:
-        await callback.message.edit_text(f"{Emoji.ERROR} ID задачи не найден.")
-        await state.clear()
-        return
-
-    task = db.query(Task).filter(Task.id == task_id).first()
-    user = await get_user(db, callback.from_user.id)
-
-    if not task:
-        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
-        await state.clear()
-        return
-
-    if not user:
-        await callback.message.edit_text(f"{Emoji.ERROR} Пользователь не найден.")
-        await state.clear()
-        return
-
-    # Помечаем задачу как зависшую
-    task.status = "STUCK"
-    task.is_stuck = True
-    task.stuck_reason = f"Ворота #{gate_number} заняты другим ТС"
+    # Помечаем задачу как зависшую
+    task.status = "STUCK"
+    task.is_stuck = True
+    task.stuck_reason = f"Ворота #{gate_number} заняты другим ТС"
 
     # Для перецепных ТС возвращаем в пул
     if task.parking and task.parking.is_hitch:
         task.is_in_pool = True
         task.priority += 10  # Сильно повышаем приоритет
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
-        f"{Emoji.WARNING} ВОРОТА ЗАНЯТЫ!\n\n"
-        f"📋 Информация:\n"
-        f"🆔 Задача: #{task.id}\n"
-        f"🚪 Ворота: #{gate_number} заняты другим ТС\n"
-        f"👤 Ваш статус: Ожидайте нового назначения\n\n"
-        f"Оператор уже уведомлен и назначит новую задачу."
+        GATE_OCCUPIED_DRIVER_TMPL(task_id=task.id, gate=gate_number)
     )
 
     # Находим всех операторов и администраторов для уведомления
-    operators = db.query(User).filter(
-        User.roles.any(RoleModel.name.in_(["OPERATOR", "ADMIN"]))
-    ).all()
+    operators = await get_operators(db)
+    parking = task.parking
+    vehicle = parking.vehicle_number if parking else 'Неизвестно'
 
     # Уведомление для оператора, создавшего задачу
     if task.operator_id:
         try:
             await bot.send_message(
                 task.operator_id,
-                f"{Emoji.GATE_OCCUPIED} СРОЧНО! ВОРОТА #{gate_number} ЗАНЯТЫ!\n\n"
-                f"📋 Детали проблемы:\n"
-                f"🆔 Задача: #{task.id}\n"
-                f"👤 Водитель: {user.first_name} {user.last_name}\n"
-                f"🚗 ТС: {task.parking.vehicle_number if task.parking else 'Неизвестно'}\n"
-                f"📍 Место: #{task.parking.spot_number if task.parking else '?'}\n"
-                f"🚪 Назначенные ворота: #{gate_number}\n\n"
-                f"🔧 НЕОБХОДИМЫЕ ДЕЙСТВИЯ:\n"
-                f"1. Проверить, кто сейчас занимает ворота #{gate_number}\n"
-                f"2. Связаться с водителем, который там находится\n"
-                f"3. Освободить ворота или назначить другие ворота\n"
-                f"4. Создать новую задачу для водителя {user.first_name}"
+                GATE_OCCUPIED_OPERATOR_TMPL(
+                    gate=gate_number,
+                    task_id=task.id,
+                    first_name=user.first_name,
+                    last_name=user.last_name,
+                    vehicle=vehicle,
+                    spot=parking.spot_number if parking else '?'
+                )
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
-    # Массовое уведомление всех операторов
-    for op in operators:
-        if op.id != task.operator_id:  # Не дублируем основному оператору
-            try:
-                await bot.send_message(
-                    op.telegram_id,
-                    f"{Emoji.WARNING} ПРОБЛЕМА С ЗАДАЧЕЙ #{task.id}\n\n"
-                    f"🚪 Ворота #{gate_number} заняты\n"
-                    f"👤 Водитель: {user.first_name} {user.last_name}\n"
-                    f"🚗 ТС: {task.parking.vehicle_number if task.parking else 'Неизвестно'}\n\n"
-                    f"Требуется вмешательство оператора."
-                )
-            except Exception as e:
-                logger.error(f"Ошибка массового уведомления: {e}")
-
-    # Предлагаем водителю варианты действий
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.RETRY} Попробовать снова",
-        callback_data="retry_gate"
-    )
-    builder.button(
-        text=f"{Emoji.ASSIGN_AGAIN} Запросить новые ворота",
-        callback_data="request_new_gate"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Отмена",
-        callback_data="gate_cancel"
+    # Массовое уведомление всех операторов (параллельно, не дублируем основному оператору)
+    await broadcast_message(
+        [telegram_id for user_id, telegram_id in operators if user_id != task.operator_id],
+        f"{Emoji.WARNING} ПРОБЛЕМА С ЗАДАЧЕЙ #{task.id}\n\n"
+        f"🚪 Ворота #{gate_number} заняты\n"
+        f"👤 Водитель: {user.first_name} {user.last_name}\n"
+        f"🚗 ТС: {vehicle}\n\n"
+        f"Требуется вмешательство оператора."
     )
-    builder.adjust(1)
 
+    # Предлагаем водителю варианты действий
     await callback.message.answer(
         f"{Emoji.QUESTION} ЧТО ДЕЛАТЬ ДАЛЬШЕ?\n\n"
         f"Вы можете:\n"
         f"• Попробовать снова подъехать к воротам\n"
         f"• Запросить у оператора другие ворота\n"
         f"• Отменить действие",
-        reply_markup=builder.as_markup()
+        reply_markup=GATE_OCCUPIED_ACTIONS_MARKUP
     )
 
 
@@ -1269,36 +1663,21 @@ async def process_retry_gate(callback: CallbackQuery, state: FSMContext):
     )
 
     # Возвращаемся к выбору действия
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.COMPLETED} Задача выполнена, встал на ворота",
-        callback_data="gate_completed"
-    )
-    builder.button(
-        text=f"{Emoji.GATE_OCCUPIED} Ворота все еще заняты",
-        callback_data="gate_occupied"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Отмена",
-        callback_data="gate_cancel"
-    )
-    builder.adjust(1)
-
     await callback.message.answer(
         "Выберите действие после повторной попытки:",
-        reply_markup=builder.as_markup()
+        reply_markup=GATE_RETRY_CONFIRMATION_MARKUP
     )
 
 
 @router.callback_query(F.data == "request_new_gate")
 @with_db
-async def process_request_new_gate(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_request_new_gate(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Запрос новых ворот у оператора"""
     data = await state.get_data()
     task_id = data.get('task_id')
     gate_number = data.get('gate_number')
 
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=TASK_SUMMARY_OPTIONS)
     user = await get_user(db, callback.from_user.id)
 
     if not task:
@@ -1331,12 +1710,12 @@ async def process_request_new_gate(callback: CallbackQuery, state: FSMContext, d
                 f"3. Создать новую задачу"
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
 
 @router.callback_query(F.data == "gate_cancel")
 @with_db
-async def process_gate_cancel(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_gate_cancel(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Отмена действия с воротами"""
     user = await get_user(db, callback.from_user.id)
     await state.clear()
@@ -1353,37 +1732,16 @@ async def process_gate_cancel(callback: CallbackQuery, state: FSMContext, db: Se
 # ==================== ОБРАБОТЧИКИ ДЛЯ ВОДИТЕЛЕЙ ПЕРЕГОНА ====================
 @router.callback_query(F.data == "transfer_gate_occupied", DriverTransferStates.waiting_for_gate_confirmation)
 @with_db
-async def process_transfer_gate_occupied(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_transfer_gate_occupied(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка ситуации, когда ворота заняты для водителя перегона"""
-    data = await state.get_data()
-    if not data:
-        await callback.message.edit_text(f"{Emoji.ERROR} Данные не найдены. Попробуйте заново.")
-        await state.clear()
+    ctx = await _resolve_gate_context(callback, state, db)
+    if ctx is None:
         return
-
-    task_id = data.get('task_id')
+    data, task, user = ctx
     gate_number = data.get('gate_number')
     parking_spot = data.get('parking_spot')
     vehicle_number = data.get('vehicle_number')
 
-    if not task_id:
-        await callback.message.edit_text(f"{Emoji.ERROR} ID задачи не найден.")
-        await state.clear()
-        return
-
-    task = db.query(Task).filter(Task.id == task_id).first()
-    user = await get_user(db, callback.from_user.id)
-
-    if not task:
-        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
-        await state.clear()
-        return
-
-    if not user:
-        await callback.message.edit_text(f"{Emoji.ERROR} Пользователь не найден.")
-        await state.clear()
-        return
-
     # Помечаем задачу как зависшую
     task.status = "STUCK"
     task.is_stuck = True
@@ -1394,7 +1752,7 @@ async def process_transfer_gate_occupied(callback: CallbackQuery, state: FSMCont
     task.is_in_pool = True
     task.priority += 15  # Повышаем приоритет
 
-    db.commit()
+    await db.commit()
 
     # ОТВЕТ ВОДИТЕЛЮ - добавлено!
     await callback.message.edit_text(
@@ -1409,31 +1767,22 @@ async def process_transfer_gate_occupied(callback: CallbackQuery, state: FSMCont
         f"Оператор уже уведомлен."
     )
 
-    # Уведомления операторам
-    operators = db.query(User).filter(
-        User.roles.any(RoleModel.name.in_(["OPERATOR", "ADMIN"]))
-    ).all()
-
     # Уведомление для оператора, создавшего задачу
     if task.operator_id:
         try:
             await bot.send_message(
                 task.operator_id,
-                f"{Emoji.GATE_OCCUPIED} СРОЧНО! ВОРОТА #{gate_number} ЗАНЯТЫ!\n\n"
-                f"📋 Детали проблемы:\n"
-                f"🆔 Задача: #{task.id}\n"
-                f"👤 Водитель: {user.first_name} {user.last_name}\n"
-                f"🚗 ТС: {vehicle_number}\n"
-                f"📍 Место: #{parking_spot}\n"
-                f"🚪 Назначенные ворота: #{gate_number}\n\n"
-                f"🔧 НЕОБХОДИМЫЕ ДЕЙСТВИЯ:\n"
-                f"1. Проверить, кто сейчас занимает ворота #{gate_number}\n"
-                f"2. Связаться с водителем, который там находится\n"
-                f"3. Освободить ворота или назначить другие ворота\n"
-                f"4. Создать новую задачу для водителя {user.first_name}"
+                GATE_OCCUPIED_OPERATOR_TMPL(
+                    gate=gate_number,
+                    task_id=task.id,
+                    first_name=user.first_name,
+                    last_name=user.last_name,
+                    vehicle=vehicle_number,
+                    spot=parking_spot
+                )
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
     # Возвращаем в главное меню
     await callback.message.answer(
@@ -1444,32 +1793,16 @@ async def process_transfer_gate_occupied(callback: CallbackQuery, state: FSMCont
     await state.clear()
 @router.callback_query(F.data == "transfer_no_vehicle", DriverTransferStates.waiting_for_gate_confirmation)
 @with_db
-async def process_transfer_no_vehicle(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_transfer_no_vehicle(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка ситуации, когда ТС отсутствует на парковочном месте"""
-    data = await state.get_data()
-    if not data:
-        await callback.message.edit_text(f"{Emoji.ERROR} Данные не найдены. Попробуйте заново.")
-        await state.clear()
+    ctx = await _resolve_gate_context(callback, state, db)
+    if ctx is None:
         return
-
-    task_id = data.get('task_id')
+    data, task, user = ctx
     gate_number = data.get('gate_number')
     parking_spot = data.get('parking_spot')
     vehicle_number = data.get('vehicle_number')
 
-    if not task_id:
-        await callback.message.edit_text(f"{Emoji.ERROR} ID задачи не найден.")
-        await state.clear()
-        return
-
-    task = db.query(Task).filter(Task.id == task_id).first()
-    user = await get_user(db, callback.from_user.id)
-
-    if not task:
-        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
-        await state.clear()
-        return
-
     # Помечаем задачу как зависшую из-за отсутствия ТС
     task.status = "STUCK"
     task.is_stuck = True
@@ -1480,7 +1813,7 @@ async def process_transfer_no_vehicle(callback: CallbackQuery, state: FSMContext
     task.is_in_pool = True
     task.priority += 20  # Сильно повышаем приоритет
 
-    db.commit()
+    await db.commit()
 
     # ОТВЕТ ВОДИТЕЛЮ - добавлено!
     await callback.message.edit_text(
@@ -1495,11 +1828,6 @@ async def process_transfer_no_vehicle(callback: CallbackQuery, state: FSMContext
         f"Оператор уведомлен о проблеме."
     )
 
-    # Находим всех операторов
-    operators = db.query(User).filter(
-        User.roles.any(RoleModel.name.in_(["OPERATOR", "ADMIN"]))
-    ).all()
-
     # Срочное уведомление для оператора
     if task.operator_id:
         try:
@@ -1519,7 +1847,7 @@ async def process_transfer_no_vehicle(callback: CallbackQuery, state: FSMContext
                 f"3. Задача автоматически вернется в пул"
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
     # Возвращаем в главное меню
     await callback.message.answer(
@@ -1531,27 +1859,16 @@ async def process_transfer_no_vehicle(callback: CallbackQuery, state: FSMContext
 
 @router.callback_query(F.data == "transfer_breakdown", DriverTransferStates.waiting_for_gate_confirmation)
 @with_db
-async def process_transfer_breakdown(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_transfer_breakdown(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка поломки ТС для водителя перегона"""
-    data = await state.get_data()
-    if not data:
-        await callback.message.edit_text(f"{Emoji.ERROR} Данные не найдены.")
-        await state.clear()
+    ctx = await _resolve_gate_context(callback, state, db)
+    if ctx is None:
         return
-
-    task_id = data.get('task_id')
+    data, task, user = ctx
     gate_number = data.get('gate_number')
     parking_spot = data.get('parking_spot')
     vehicle_number = data.get('vehicle_number')
 
-    task = db.query(Task).filter(Task.id == task_id).first()
-    user = await get_user(db, callback.from_user.id)
-
-    if not task:
-        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
-        await state.clear()
-        return
-
     # Помечаем задачу как зависшую
     task.status = "STUCK"
     task.is_stuck = True
@@ -1559,7 +1876,7 @@ async def process_transfer_breakdown(callback: CallbackQuery, state: FSMContext,
     task.driver_id = None
     task.is_in_pool = False  # Не возвращаем в пул, так как ТС сломано
 
-    db.commit()
+    await db.commit()
 
     # ОТВЕТ ВОДИТЕЛЮ - добавлено!
     await callback.message.edit_text(
@@ -1587,7 +1904,7 @@ async def process_transfer_breakdown(callback: CallbackQuery, state: FSMContext,
                 f"❌ ТС требует ремонта. Задача закрыта."
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
     # Возвращаем в главное меню
     await callback.message.answer(
@@ -1599,46 +1916,34 @@ async def process_transfer_breakdown(callback: CallbackQuery, state: FSMContext,
 
 @router.callback_query(F.data == "transfer_gate_completed", DriverTransferStates.waiting_for_gate_confirmation)
 @with_db
-async def process_transfer_gate_completed(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_transfer_gate_completed(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка успешного выполнения задачи для водителя перегона"""
-    data = await state.get_data()
-    if not data:
-        await callback.message.edit_text(f"{Emoji.ERROR} Данные не найдены. Попробуйте заново.")
-        await state.clear()
-        return
-
-    task_id = data.get('task_id')
-    if not task_id:
-        await callback.message.edit_text(f"{Emoji.ERROR} ID задачи не найден.")
-        await state.clear()
-        return
-
-    task = db.query(Task).filter(Task.id == task_id).first()
-    user = await get_user(db, callback.from_user.id)
-
-    if not task:
-        await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
-        await state.clear()
+    ctx = await _resolve_gate_context(callback, state, db)
+    if ctx is None:
         return
+    _, task, user = ctx
 
     # Обновляем статус задачи
     task.status = "COMPLETED"
-    task.completed_at = get_timezone_aware_now()
+    now = get_timezone_aware_now()
+    task.completed_at = now
 
     # Освобождаем парковочное место
     if task.parking:
-        task.parking.departure_time = get_timezone_aware_now()
+        task.parking.departure_time = now
         task.parking.gate_number = task.gate_number
 
-    db.commit()
+    await db.commit()
+
+    vehicle = task.parking.vehicle_number if task.parking else 'Неизвестно'
 
     # ОТВЕТ ВОДИТЕЛЮ
     await callback.message.edit_text(
         f"{Emoji.SUCCESS} ЗАДАЧА #{task.id} ВЫПОЛНЕНА!\n\n"
         f"📋 Информация:\n"
         f"🚪 Ворота: #{task.gate_number}\n"
-        f"🚗 ТС: {task.parking.vehicle_number if task.parking else 'Неизвестно'}\n"
-        f"⏰ Время завершения: {task.completed_at.strftime('%H:%M %d.%m.%Y')}"
+        f"🚗 ТС: {vehicle}\n"
+        f"⏰ Время завершения: {format_hm_dmy(task.completed_at)}"
     )
 
     # Уведомляем оператора
@@ -1648,11 +1953,11 @@ async def process_transfer_gate_completed(callback: CallbackQuery, state: FSMCon
                 task.operator_id,
                 f"{Emoji.SUCCESS} Задача #{task.id} выполнена!\n"
                 f"👤 Водитель перегона: {user.first_name} {user.last_name}\n"
-                f"🚗 ТС: {task.parking.vehicle_number if task.parking else 'Неизвестно'}\n"
+                f"🚗 ТС: {vehicle}\n"
                 f"🚪 Ворота: #{task.gate_number}"
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+            logger.error("Ошибка уведомления оператора: %s", e)
 
     # Возвращаем в главное меню
     await callback.message.answer(
@@ -1662,17 +1967,18 @@ async def process_transfer_gate_completed(callback: CallbackQuery, state: FSMCon
 
     await state.clear()
 
-@router.message(F.text == f"{Emoji.SHIFT_START} Начать смену")
+@menu_button(f"{Emoji.SHIFT_START} Начать смену")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT)
 @with_db
-async def process_shift_start(message: Message, db: Session):
+async def process_shift_start(message: Message, db: AsyncSession):
     """Начало рабочей смены водителя перегона"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    if "DRIVER_TRANSFER" not in get_user_roles(user):
-        await message.answer(f"{Emoji.ERROR} Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     if user.is_on_shift:
@@ -1680,15 +1986,17 @@ async def process_shift_start(message: Message, db: Session):
         return
 
     # Начинаем смену
+    now = get_timezone_aware_now()
     user.is_on_shift = True
-    db.commit()
+    user.shift_start_time = now
+    await db.commit()
 
     # Отправляем сообщение о начале смены
     await message.answer(
         f"{Emoji.SUCCESS} Смена начата!\n\n"
         f"📋 Информация:\n"
         f"👤 Водитель: {user.first_name} {user.last_name}\n"
-        f"⏰ Время начала: {get_timezone_aware_now().strftime('%H:%M %d.%m.%Y')}\n\n"
+        f"⏰ Время начала: {format_hm_dmy(now)}\n\n"
         f"Теперь вы можете принимать задания от оператора."
     )
 
@@ -1700,17 +2008,19 @@ async def process_shift_start(message: Message, db: Session):
     )
 
 
-@router.message(F.text == f"{Emoji.SHIFT_END} Закончить смену")
+@menu_button(f"{Emoji.SHIFT_END} Закончить смену")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT,
+              not_on_shift_text=f"{Emoji.WARNING} Вы не на смене!")
 @with_db
-async def process_shift_end(message: Message, db: Session):
+async def process_shift_end(message: Message, db: AsyncSession):
     """Завершение рабочей смены водителя перегона"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    if "DRIVER_TRANSFER" not in get_user_roles(user):
-        await message.answer(f"{Emoji.ERROR} Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     if not user.is_on_shift:
@@ -1725,10 +2035,10 @@ async def process_shift_end(message: Message, db: Session):
         return
 
     # Проверка активных задач
-    active_task = db.query(Task).filter(
+    active_task = await db.scalar(select(Task).options(*TASK_SUMMARY_OPTIONS).where(
         Task.driver_id == user.id,
         Task.status == "IN_PROGRESS"
-    ).first()
+    ).limit(1))
 
     if active_task:
         await message.answer(
@@ -1742,55 +2052,42 @@ async def process_shift_end(message: Message, db: Session):
     # Статистика смены
     now = get_timezone_aware_now()
 
-    # Находим время начала смены (первое действие сегодня или created_at)
+    # Время начала смены сохраняется при ее открытии
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    first_task_today = db.query(Task).filter(
-        Task.driver_id == user.id,
-        Task.created_at >= today_start
-    ).order_by(Task.created_at.asc()).first()
+    shift_start = ensure_timezone_aware(user.shift_start_time) if user.shift_start_time else today_start
 
-    if first_task_today:
-        shift_start = ensure_timezone_aware(first_task_today.created_at)
-    else:
-        shift_start = ensure_timezone_aware(user.created_at)
-        if shift_start.date() < now.date():
-            shift_start = today_start
-
-    # Получаем перерывы за смену
-    breaks = db.query(Break).filter(
-        Break.user_id == user.id,
-        Break.start_time >= shift_start,
-        Break.end_time != None
-    ).all()
-
-    total_break_seconds = sum(b.duration for b in breaks)
-
-    # Получаем выполненные задачи за смену
-    completed_tasks = db.query(Task).filter(
-        Task.driver_id == user.id,
-        Task.status == "COMPLETED",
-        Task.completed_at >= shift_start
-    ).all()
-
-    # Получаем все задачи, которые водитель брал в работу
-    all_tasks = db.query(Task).filter(
-        Task.driver_id == user.id,
-        Task.created_at >= shift_start
-    ).all()
+    # Взятые и выполненные задачи и время перерывов за смену - одним запросом
+    all_tasks_count, completed_count, total_break_seconds = (await db.execute(select(
+        select(func.count(Task.id)).where(
+            Task.driver_id == user.id,
+            Task.started_at >= shift_start
+        ).scalar_subquery(),
+        select(func.count(Task.id)).where(
+            Task.driver_id == user.id,
+            Task.status == "COMPLETED",
+            Task.completed_at >= shift_start
+        ).scalar_subquery(),
+        select(func.coalesce(func.sum(Break.duration), 0)).where(
+            Break.user_id == user.id,
+            Break.start_time >= shift_start,
+            Break.end_time != None
+        ).scalar_subquery()
+    ))).one()
 
     # Завершаем смену
     user.is_on_shift = False
-    db.commit()
+    user.shift_start_time = None
+    await db.commit()
 
     await message.answer(
         f"{Emoji.SUCCESS} Смена завершена!\n\n"
         f"📊 Итоговая статистика:\n"
         f"👤 Водитель: {user.first_name} {user.last_name}\n"
-        f"⏰ Начало: {shift_start.strftime('%H:%M %d.%m.%Y')}\n"
-        f"⏰ Окончание: {now.strftime('%H:%M %d.%m.%Y')}\n"
+        f"⏰ Начало: {format_hm_dmy(shift_start)}\n"
+        f"⏰ Окончание: {format_hm_dmy(now)}\n"
         f"{Emoji.BREAK_TIME} Время на обеде: {format_duration(total_break_seconds)}\n"
-        f"{Emoji.COMPLETED} Выполнено задач: {len(completed_tasks)}\n"
-        f"📝 Всего взято задач: {len(all_tasks)}\n\n"
+        f"{Emoji.COMPLETED} Выполнено задач: {completed_count}\n"
+        f"📝 Всего взято задач: {all_tasks_count}\n\n"
         f"Спасибо за работу!"
     )
 
@@ -1801,9 +2098,11 @@ async def process_shift_end(message: Message, db: Session):
     )
 
 
-@router.message(F.text == f"{Emoji.TASK} Взять задачу")
+@menu_button(f"{Emoji.TASK} Взять задачу")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT,
+              not_on_shift_text=f"{Emoji.ERROR} Вы не на смене! Начните смену для принятия задач.")
 @with_db
-async def process_take_task(message: Message, state: FSMContext, db: Session):
+async def process_take_task(message: Message, state: FSMContext, db: AsyncSession):
     """Взятие задачи из общего пула водителем перегона"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -1811,28 +2110,38 @@ async def process_take_task(message: Message, state: FSMContext, db: Session):
         return
 
     # Проверяем, есть ли у пользователя роль DRIVER_TRANSFER
-    user_roles = get_user_roles(user)
-    if "DRIVER_TRANSFER" not in user_roles:
-        await message.answer(f"{Emoji.ERROR} Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     if not user.is_on_shift:
         await message.answer(f"{Emoji.ERROR} Вы не на смене! Начните смену для принятия задач.")
         return
 
-    # Проверяем, есть ли зависшие задачи у водителя
-    stuck_task = db.query(Task).filter(
+    # Зависшие и активные задачи водителя - одним запросом
+    blockers = (await db.scalars(select(Task).options(*TASK_SUMMARY_OPTIONS).where(
         Task.driver_id == user.id,
-        Task.status == "STUCK"
-    ).first()
+        Task.status.in_(("STUCK", "IN_PROGRESS"))
+    ))).all()
+    stuck_task = next((t for t in blockers if t.status == "STUCK"), None)
+    active_task = next((t for t in blockers if t.status == "IN_PROGRESS"), None)
 
     if stuck_task:
-        # Автоматически снимаем зависшую задачу с водителя
+        # Автоматически снимаем зависшую задачу с водителя и возвращаем в пул.
+        # Если у ТС уже есть другая активная задача (ux_task_parking_active),
+        # откатывается только SAVEPOINT: задача остается зависшей для оператора
+        returned_to_pool = True
+        try:
+            async with db.begin_nested():
+                stuck_task.status = "PENDING"
+                stuck_task.is_in_pool = True
+                stuck_task.priority += 5
+        except IntegrityError:
+            returned_to_pool = False
+            await db.refresh(stuck_task)
+            await db.refresh(stuck_task, ["parking"])
         stuck_task.driver_id = None
-        stuck_task.status = "PENDING"
-        stuck_task.is_in_pool = True
-        stuck_task.priority += 5
-        db.commit()
+        await db.commit()
 
         await message.answer(
             f"{Emoji.WARNING} С вас снята зависшая задача #{stuck_task.id}\n\n"
@@ -1840,16 +2149,12 @@ async def process_take_task(message: Message, state: FSMContext, db: Session):
             f"📍 Место: #{stuck_task.parking.spot_number}\n"
             f"🚗 ТС: {stuck_task.parking.vehicle_number}\n"
             f"🚪 Ворота: #{stuck_task.gate_number}\n\n"
-            f"✅ Задача возвращена в пул с повышенным приоритетом.\n"
-            f"Теперь вы можете взять новую задачу."
+            + (f"✅ Задача возвращена в пул с повышенным приоритетом.\n" if returned_to_pool
+               else f"ℹ️ У ТС уже есть активная задача, зависшую закроет оператор.\n")
+            + f"Теперь вы можете взять новую задачу."
         )
 
     # Проверяем, есть ли уже активная задача у водителя
-    active_task = db.query(Task).filter(
-        Task.driver_id == user.id,
-        Task.status == "IN_PROGRESS"
-    ).first()
-
     if active_task:
         await message.answer(
             f"{Emoji.WARNING} У вас уже есть активная задача #{active_task.id} в работе!\n"
@@ -1859,29 +2164,14 @@ async def process_take_task(message: Message, state: FSMContext, db: Session):
         )
         return
 
-    # Ищем задачи в общем пуле для перецепных ТС с максимальным приоритетом
-    task = db.query(Task).join(Parking).filter(
-        Task.status == "PENDING",
-        Task.is_in_pool == True,
-        Parking.is_hitch == True,
-        Parking.departure_time == None,
-        Task.driver_id == None
-    ).order_by(
-        Task.priority.desc(),
-        Task.created_at.asc()
-    ).first()
+    # Берем из общего пула задачу для перецепного ТС с максимальным приоритетом
+    task = await take_task_from_pool(db, user.id)
 
     if not task:
         await message.answer(f"{Emoji.INFO} Нет доступных задач в пуле.")
         return
 
-    # Назначаем задачу водителю
-    task.driver_id = user.id
-    task.status = "IN_PROGRESS"
-    task.started_at = get_timezone_aware_now()
-    task.is_stuck = False
-    task.stuck_reason = None
-    db.commit()
+    await db.commit()
 
     # Сохраняем данные задачи в состояние
     await state.update_data(
@@ -1893,7 +2183,7 @@ async def process_take_task(message: Message, state: FSMContext, db: Session):
     )
 
     # Получаем путь к изображению ворот
-    image_path = await get_gate_image_path(task.gate_number)
+    image_path = get_gate_image_path(task.gate_number)
 
     # Формируем текст сообщения
     abk_info = ""
@@ -1908,71 +2198,32 @@ async def process_take_task(message: Message, state: FSMContext, db: Session):
         f"{abk_info}"
         f"🚪 Ворота: #{task.gate_number}\n"
         f"📝 Тип: Перецепной\n"
-        f"⏰ Время начала: {task.started_at.strftime('%H:%M %d.%m.%Y')}\n\n"
+        f"⏰ Время начала: {format_hm_dmy(task.started_at)}\n\n"
         f"Выберите действие после подъезда к воротам:"
     )
 
-    # Создаем инлайн-клавиатуру для действий с задачей
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.COMPLETED} Задача выполнена, ворота свободны",
-        callback_data="transfer_gate_completed"
-    )
-    builder.button(
-        text=f"{Emoji.GATE_OCCUPIED} Ворота заняты другим ТС",
-        callback_data="transfer_gate_occupied"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Нет ТС на месте",
-        callback_data="transfer_no_vehicle"
-    )
-    builder.button(
-        text="🔧 Поломка ТС",
-        callback_data="transfer_breakdown"
-    )
-    builder.adjust(1)
-
     # Отправляем сообщение с изображением, если оно есть
-    if image_path and image_path.exists():
-        try:
-            photo = FSInputFile(image_path)
-            await message.answer_photo(
-                photo=photo,
-                caption=message_text,
-                reply_markup=builder.as_markup()
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке изображения ворот: {e}")
-            await message.answer(
-                message_text,
-                reply_markup=builder.as_markup()
-            )
-    else:
-        await message.answer(
-            message_text,
-            reply_markup=builder.as_markup()
-        )
+    await answer_with_gate_photo(message, task.gate_number, image_path, message_text, TRANSFER_GATE_CONFIRMATION_MARKUP)
 
     # Устанавливаем состояние
     await state.set_state(DriverTransferStates.waiting_for_gate_confirmation)
 
     # Уведомляем оператора о том, кто взял задачу
     if task.operator_id:
-        try:
-            await bot.send_message(
-                task.operator_id,
-                f"{Emoji.DRIVER_TRANSFER} Водитель перегона {user.first_name} {user.last_name}\n"
-                f"взял задачу #{task.id} в работу!\n"
-                f"📍 Место: #{task.parking.spot_number}\n"
-                f"🚪 Ворота: #{task.gate_number}"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+        notify_in_background(
+            task.operator_id,
+            f"{Emoji.DRIVER_TRANSFER} Водитель перегона {user.first_name} {user.last_name}\n"
+            f"взял задачу #{task.id} в работу!\n"
+            f"📍 Место: #{task.parking.spot_number}\n"
+            f"🚪 Ворота: #{task.gate_number}",
+            "Ошибка уведомления оператора: %s"
+        )
 
 
-@router.message(F.text == f"{Emoji.TASK} Текущая задача")
+@menu_button(f"{Emoji.TASK} Текущая задача")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT)
 @with_db
-async def process_current_task(message: Message, state: FSMContext, db: Session):
+async def process_current_task(message: Message, state: FSMContext, db: AsyncSession):
     """Показать информацию о текущей задаче и предложить действия"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -1980,27 +2231,29 @@ async def process_current_task(message: Message, state: FSMContext, db: Session)
         return
 
     # Проверяем, есть ли у пользователя роль DRIVER_TRANSFER
-    user_roles = get_user_roles(user)
-    if "DRIVER_TRANSFER" not in user_roles:
-        await message.answer(f"{Emoji.ERROR} Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     # Находим активную задачу
-    active_task = db.query(Task).filter(
+    active_task = await db.scalar(select(Task).options(*TASK_SUMMARY_OPTIONS).where(
         Task.driver_id == user.id,
         Task.status == "IN_PROGRESS"
-    ).first()
+    ).limit(1))
 
     if not active_task:
         await message.answer(f"{Emoji.INFO} У вас нет активных задач.")
         return
 
+    parking = active_task.parking
+    started_str = format_hm_dmy(active_task.started_at) if active_task.started_at else 'Неизвестно'
+
     # Сохраняем данные задачи в состояние
     await state.update_data(
         task_id=active_task.id,
         gate_number=active_task.gate_number,
-        parking_spot=active_task.parking.spot_number if active_task.parking else None,
-        vehicle_number=active_task.parking.vehicle_number if active_task.parking else None,
+        parking_spot=parking.spot_number if parking else None,
+        vehicle_number=parking.vehicle_number if parking else None,
         is_transfer_driver=True
     )
 
@@ -2018,7 +2271,7 @@ async def process_current_task(message: Message, state: FSMContext, db: Session)
         duration_str = f"{hours}ч {mins}мин"
 
     # Получаем путь к изображению ворот
-    image_path = await get_gate_image_path(active_task.gate_number)
+    image_path = get_gate_image_path(active_task.gate_number)
 
     # Формируем текст сообщения
     abk_info = ""
@@ -2028,62 +2281,25 @@ async def process_current_task(message: Message, state: FSMContext, db: Session)
     message_text = (
         f"{Emoji.TASK} ТЕКУЩАЯ ЗАДАЧА #{active_task.id}\n\n"
         f"📋 Информация:\n"
-        f"🚗 ТС: {active_task.parking.vehicle_number if active_task.parking else 'Неизвестно'}\n"
-        f"📍 Место: #{active_task.parking.spot_number if active_task.parking else '?'}\n"
+        f"🚗 ТС: {parking.vehicle_number if parking else 'Неизвестно'}\n"
+        f"📍 Место: #{parking.spot_number if parking else '?'}\n"
         f"{abk_info}"
         f"🚪 Ворота: #{active_task.gate_number}\n"
-        f"⏰ Время начала: {active_task.started_at.strftime('%H:%M %d.%m.%Y') if active_task.started_at else 'Неизвестно'}\n"
+        f"⏰ Время начала: {started_str}\n"
         f"⏱️ В работе: {duration_str}\n"
         f"📊 Приоритет: {active_task.priority}\n\n"
         f"Выберите действие:"
     )
 
-    # Создаем инлайн-клавиатуру для действий с задачей
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.COMPLETED} Задача выполнена, ворота свободны",
-        callback_data="transfer_gate_completed"
-    )
-    builder.button(
-        text=f"{Emoji.GATE_OCCUPIED} Ворота заняты другим ТС",
-        callback_data="transfer_gate_occupied"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Нет ТС на месте",
-        callback_data="transfer_no_vehicle"
-    )
-    builder.button(
-        text="🔧 Поломка ТС",
-        callback_data="transfer_breakdown"
-    )
-    builder.adjust(1)
-
     await state.set_state(DriverTransferStates.waiting_for_gate_confirmation)
 
     # Отправляем сообщение с изображением, если оно есть
-    if image_path and image_path.exists():
-        try:
-            photo = FSInputFile(image_path)
-            await message.answer_photo(
-                photo=photo,
-                caption=message_text,
-                reply_markup=builder.as_markup()
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке изображения ворот: {e}")
-            await message.answer(
-                message_text,
-                reply_markup=builder.as_markup()
-            )
-    else:
-        await message.answer(
-            message_text,
-            reply_markup=builder.as_markup()
-        )
+    await answer_with_gate_photo(message, active_task.gate_number, image_path, message_text, TRANSFER_GATE_CONFIRMATION_MARKUP)
 
-@router.message(F.text == f"{Emoji.COMPLETED} Завершить задачу")
+@menu_button(f"{Emoji.COMPLETED} Завершить задачу")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT)
 @with_db
-async def process_complete_current_task(message: Message, state: FSMContext, db: Session):
+async def process_complete_current_task(message: Message, state: FSMContext, db: AsyncSession):
     """Завершение текущей активной задачи"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -2091,77 +2307,59 @@ async def process_complete_current_task(message: Message, state: FSMContext, db:
         return
 
     # Проверяем, есть ли у пользователя роль DRIVER_TRANSFER
-    user_roles = get_user_roles(user)
-    if "DRIVER_TRANSFER" not in user_roles:
-        await message.answer(f"{Emoji.ERROR} Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     # Находим активную задачу
-    active_task = db.query(Task).filter(
+    active_task = await db.scalar(select(Task).options(*TASK_SUMMARY_OPTIONS).where(
         Task.driver_id == user.id,
         Task.status == "IN_PROGRESS"
-    ).first()
+    ).limit(1))
 
     if not active_task:
         await message.answer(f"{Emoji.INFO} У вас нет активных задач.")
         return
 
+    parking = active_task.parking
+    started_str = format_hm_dmy(active_task.started_at) if active_task.started_at else 'Неизвестно'
+
     # Сохраняем данные задачи в состояние
     await state.update_data(
         task_id=active_task.id,
         gate_number=active_task.gate_number,
-        parking_spot=active_task.parking.spot_number if active_task.parking else None,
-        vehicle_number=active_task.parking.vehicle_number if active_task.parking else None,
+        parking_spot=parking.spot_number if parking else None,
+        vehicle_number=parking.vehicle_number if parking else None,
         is_transfer_driver=True
     )
 
-    # Создаем инлайн-клавиатуру для действий с задачей
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.COMPLETED} Задача выполнена, ворота свободны",
-        callback_data="transfer_gate_completed"
-    )
-    builder.button(
-        text=f"{Emoji.GATE_OCCUPIED} Ворота заняты другим ТС",
-        callback_data="transfer_gate_occupied"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Нет ТС на месте",
-        callback_data="transfer_no_vehicle"
-    )
-    builder.button(
-        text="🔧 Поломка ТС",
-        callback_data="transfer_breakdown"
-    )
-    builder.adjust(1)
-
     await state.set_state(DriverTransferStates.waiting_for_gate_confirmation)
     await message.answer(
         f"{Emoji.QUESTION} ЗАВЕРШЕНИЕ ЗАДАЧИ #{active_task.id}\n\n"
         f"📋 Информация о текущей задаче:\n"
-        f"🚗 ТС: {active_task.parking.vehicle_number if active_task.parking else 'Неизвестно'}\n"
-        f"📍 Место: #{active_task.parking.spot_number if active_task.parking else '?'}\n"
+        f"🚗 ТС: {parking.vehicle_number if parking else 'Неизвестно'}\n"
+        f"📍 Место: #{parking.spot_number if parking else '?'}\n"
         f"🚪 Ворота: #{active_task.gate_number}\n"
-        f"⏰ Начало: {active_task.started_at.strftime('%H:%M %d.%m.%Y') if active_task.started_at else 'Неизвестно'}\n\n"
+        f"⏰ Начало: {started_str}\n\n"
         f"Выберите действие:",
-        reply_markup=builder.as_markup()
+        reply_markup=TRANSFER_GATE_CONFIRMATION_MARKUP
     )
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ ОБЕДА ====================
-@router.message(F.text.contains("Обед"))
-@router.message(F.text == f"{Emoji.BREAK_START} Уйти на обед")
-@router.message(F.text == f"{Emoji.BREAK_END} Вернуться с обеда")
+@menu_button(f"{Emoji.BREAK_START} Уйти на обед")
+@menu_button(f"{Emoji.BREAK_END} Вернуться с обеда")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT)
 @with_db
-async def process_break_menu(message: Message, db: Session):
+async def process_break_menu(message: Message, db: AsyncSession):
     """Меню обеда для водителя перегона"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "DRIVER_TRANSFER" not in get_user_roles(user):
-        await message.answer("❌ Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     if not user.is_on_shift:
@@ -2184,7 +2382,7 @@ async def process_break_menu(message: Message, db: Session):
 
 @router.callback_query(F.data == "break_start")
 @with_db
-async def process_break_start(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_break_start(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Начало процесса ухода на обед"""
     user = await get_user(db, callback.from_user.id)
     if not user:
@@ -2198,18 +2396,15 @@ async def process_break_start(callback: CallbackQuery, state: FSMContext, db: Se
     if user.is_on_break:
         await callback.message.edit_text(
             "❌ Вы уже на обеде!\n\nСначала вернитесь с обеда.",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_break_menu"
-            ).as_markup()
+            reply_markup=BACK_TO_BREAK_MENU_MARKUP
         )
         return
 
     # Проверка только активных задач (IN_PROGRESS)
-    active_task = db.query(Task).filter(
+    active_task = await db.scalar(select(Task).options(*TASK_SUMMARY_OPTIONS).where(
         Task.driver_id == user.id,
         Task.status == "IN_PROGRESS"
-    ).first()
+    ).limit(1))
 
     if active_task:
         await callback.message.edit_text(
@@ -2217,17 +2412,14 @@ async def process_break_start(callback: CallbackQuery, state: FSMContext, db: Se
             f"📍 Место: #{active_task.parking.spot_number}\n"
             f"🚪 Ворота: #{active_task.gate_number}\n\n"
             f"Сначала завершите текущую задачу перед уходом на обед.",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_break_menu"
-            ).as_markup()
+            reply_markup=BACK_TO_BREAK_MENU_MARKUP
         )
         return
 
     await state.set_state(DriverTransferStates.waiting_for_break_confirmation)
     await callback.message.edit_text(
         f"{Emoji.BREAK_START} Подтвердите уход на обед\n\n"
-        f"⏰ Время ухода: {get_timezone_aware_now().strftime('%H:%M %d.%m.%Y')}\n\n"
+        f"⏰ Время ухода: {format_hm_dmy(get_timezone_aware_now())}\n\n"
         f"Во время обеда вы не сможете брать новые задачи.\n"
         f"Время обеда будет вычтено из статистики рабочей смены.",
         reply_markup=get_break_confirmation_keyboard()
@@ -2236,13 +2428,18 @@ async def process_break_start(callback: CallbackQuery, state: FSMContext, db: Se
 
 @router.callback_query(F.data == "break_confirm")
 @with_db
-async def process_break_confirm(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_break_confirm(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Подтверждение ухода на обед"""
     user = await get_user(db, callback.from_user.id)
     if not user:
         await callback.message.edit_text("❌ Пользователь не найден.")
         return
 
+    if user.is_on_break:
+        await callback.message.edit_text("❌ Вы уже на обеде!")
+        await state.clear()
+        return
+
     user.is_on_break = True
     user.break_start_time = get_timezone_aware_now()
 
@@ -2254,11 +2451,18 @@ async def process_break_confirm(callback: CallbackQuery, state: FSMContext, db:
         duration=0
     )
     db.add(break_record)
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # ux_break_open: повторное нажатие успело открыть обед раньше
+        await db.rollback()
+        await callback.message.edit_text("❌ Вы уже на обеде!")
+        await state.clear()
+        return
 
     await callback.message.edit_text(
         f"{Emoji.BREAK_START} Вы ушли на обед!\n\n"
-        f"⏰ Время: {user.break_start_time.strftime('%H:%M %d.%m.%Y')}\n\n"
+        f"⏰ Время: {format_hm_dmy(user.break_start_time)}\n\n"
         f"Для возврата с обеда используйте кнопку '{Emoji.BREAK_END} Вернуться с обеда'."
     )
     await callback.message.answer(
@@ -2270,7 +2474,7 @@ async def process_break_confirm(callback: CallbackQuery, state: FSMContext, db:
 
 @router.callback_query(F.data == "break_end")
 @with_db
-async def process_break_end(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_break_end(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Возвращение с обеда"""
     user = await get_user(db, callback.from_user.id)
     if not user:
@@ -2280,10 +2484,7 @@ async def process_break_end(callback: CallbackQuery, state: FSMContext, db: Sess
     if not user.is_on_break:
         await callback.message.edit_text(
             "❌ Вы не на обеде!",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_break_menu"
-            ).as_markup()
+            reply_markup=BACK_TO_BREAK_MENU_MARKUP
         )
         return
 
@@ -2292,26 +2493,24 @@ async def process_break_end(callback: CallbackQuery, state: FSMContext, db: Sess
     break_duration = now - break_start
     break_seconds = int(break_duration.total_seconds())
 
+    # Пользователь меняется через ORM: flush сбрасывает его запись в кэше get_user
     user.is_on_break = False
     user.total_break_time = (user.total_break_time or 0) + break_seconds
     user.break_start_time = None
 
-    break_record = db.query(Break).filter(
+    # Незавершенный обед у пользователя один (уникальный индекс ux_break_open) - закрываем без SELECT
+    await db.execute(update(Break).where(
         Break.user_id == user.id,
         Break.end_time == None
-    ).order_by(Break.start_time.desc()).first()
-
-    if break_record:
-        break_record.end_time = now
-        break_record.duration = break_seconds
+    ).values(end_time=now, duration=break_seconds).execution_options(synchronize_session=False))
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"{Emoji.BREAK_END} Вы вернулись с обеда!\n\n"
         f"📊 Статистика обеда:\n"
-        f"⏰ Уход: {break_start.strftime('%H:%M %d.%m.%Y')}\n"
-        f"⏰ Возврат: {now.strftime('%H:%M %d.%m.%Y')}\n"
+        f"⏰ Уход: {format_hm_dmy(break_start)}\n"
+        f"⏰ Возврат: {format_hm_dmy(now)}\n"
         f"⏱️ Длительность: {format_duration(break_seconds)}\n\n"
         f"Время обеда вычтено из статистики смены."
     )
@@ -2323,22 +2522,19 @@ async def process_break_end(callback: CallbackQuery, state: FSMContext, db: Sess
 
 @router.callback_query(F.data == "break_cancel")
 @with_db
-async def process_break_cancel(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_break_cancel(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Отмена ухода на обед"""
     user = await get_user(db, callback.from_user.id)
     await callback.message.edit_text(
         "❌ Уход на обед отменен.",
-        reply_markup=InlineKeyboardBuilder().button(
-            text=f"{Emoji.BACK} Назад",
-            callback_data="back_to_break_menu"
-        ).as_markup()
+        reply_markup=BACK_TO_BREAK_MENU_MARKUP
     )
     await state.clear()
 
 
 @router.callback_query(F.data == "back_to_break_menu")
 @with_db
-async def process_back_to_break_menu(callback: CallbackQuery, db: Session):
+async def process_back_to_break_menu(callback: CallbackQuery, db: AsyncSession):
     """Возврат в меню обеда"""
     user = await get_user(db, callback.from_user.id)
 
@@ -2358,7 +2554,7 @@ async def process_back_to_break_menu(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data == "back_to_driver_transfer_menu")
 @with_db
-async def process_back_to_driver_transfer_menu(callback: CallbackQuery, db: Session):
+async def process_back_to_driver_transfer_menu(callback: CallbackQuery, db: AsyncSession):
     """Возврат в меню водителя перегона"""
     user = await get_user(db, callback.from_user.id)
     await callback.message.edit_text("Возврат в меню...")
@@ -2368,59 +2564,41 @@ async def process_back_to_driver_transfer_menu(callback: CallbackQuery, db: Sess
     )
 
 
-@router.message(F.text == f"{Emoji.STATS} Статистика за смену")
-@with_db
-async def process_shift_stats(message: Message, db: Session):
+@menu_button(f"{Emoji.STATS} Статистика за смену")
+@require_role("DRIVER_TRANSFER", TRANSFER_DRIVER_ONLY_TEXT)
+@with_db(readonly=True)
+async def process_shift_stats(message: Message, db: AsyncSession):
     """Статистика за смену для водителя перегона"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "DRIVER_TRANSFER" not in get_user_roles(user):
-        await message.answer("❌ Эта функция доступна только водителям перегона.")
+    if not user.has_role("DRIVER_TRANSFER"):
+        await message.answer(TRANSFER_DRIVER_ONLY_TEXT)
         return
 
     now = get_timezone_aware_now()
 
     # Определение начала смены
-    if user.is_on_shift:
-        first_task_today = db.query(Task).filter(
-            Task.driver_id == user.id,
-            Task.created_at >= now.replace(hour=0, minute=0, second=0, microsecond=0)
-        ).order_by(Task.created_at.asc()).first()
-
-        if first_task_today:
-            shift_start = ensure_timezone_aware(first_task_today.created_at)
-        else:
-            shift_start = ensure_timezone_aware(user.created_at)
-            if shift_start.date() < now.date():
-                shift_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if user.is_on_shift and user.shift_start_time:
+        shift_start = ensure_timezone_aware(user.shift_start_time)
     else:
-        shift_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        shift_start = today_start
 
-    # Статистика задач
-    tasks = db.query(Task).filter(
+    # Статистика задач (взятых в работу с начала смены) по статусам
+    status_counts = dict((await db.execute(select(Task.status, func.count(Task.id)).where(
         Task.driver_id == user.id,
-        Task.created_at >= shift_start
-    ).all()
-
-    completed = [t for t in tasks if t.status == "COMPLETED"]
-    stuck = [t for t in tasks if t.status == "STUCK"]
-    in_progress = [t for t in tasks if t.status == "IN_PROGRESS"]
+        Task.started_at >= shift_start
+    ).group_by(Task.status))).all())
 
-    # Статистика обедов
-    breaks = db.query(Break).filter(
+    # Статистика обедов: длительность завершенных обедов сохраняется при возвращении
+    total_break_seconds = await db.scalar(select(func.coalesce(func.sum(Break.duration), 0)).where(
         Break.user_id == user.id,
-        Break.start_time >= shift_start
-    ).all()
-
-    total_break_seconds = 0
-    for br in breaks:
-        if br.end_time:
-            end = ensure_timezone_aware(br.end_time)
-            start = ensure_timezone_aware(br.start_time)
-            total_break_seconds += int((end - start).total_seconds())
+        Break.start_time >= shift_start,
+        Break.end_time != None
+    ))
 
     if user.is_on_break and user.break_start_time:
         break_start = ensure_timezone_aware(user.break_start_time)
@@ -2430,25 +2608,33 @@ async def process_shift_stats(message: Message, db: Session):
         f"📊 СТАТИСТИКА {'ТЕКУЩЕЙ СМЕНЫ' if user.is_on_shift else 'ЗА СЕГОДНЯ'}\n\n"
         f"👤 Водитель: {user.first_name} {user.last_name}\n"
         f"{Emoji.BREAK_START} Статус: {'НА ОБЕДЕ' if user.is_on_break else 'РАБОТАЕТ'}\n\n"
-        f"⏰ Период: с {shift_start.strftime('%H:%M %d.%m.%Y')}\n"
-        f"⏰ Текущее время: {now.strftime('%H:%M %d.%m.%Y')}\n"
+        f"⏰ Период: с {format_hm_dmy(shift_start)}\n"
+        f"⏰ Текущее время: {format_hm_dmy(now)}\n"
         f"{Emoji.BREAK_TIME} Время на обеде: {format_duration(total_break_seconds)}\n\n"
         f"📋 ЗАДАЧИ:\n"
-        f"{Emoji.COMPLETED} Выполнено: {len(completed)}\n"
-        f"{Emoji.STUCK} Зависло: {len(stuck)}\n"
-        f"{Emoji.IN_PROGRESS} В работе: {len(in_progress)}\n"
-        f"📝 Всего задач: {len(tasks)}\n"
-    )
-
-    # Текущая активная задача
-    active_task = next((t for t in tasks if t.status == "IN_PROGRESS"), None)
+        f"{Emoji.COMPLETED} Выполнено: {status_counts.get('COMPLETED', 0)}\n"
+        f"{Emoji.STUCK} Зависло: {status_counts.get('STUCK', 0)}\n"
+        f"{Emoji.IN_PROGRESS} В работе: {status_counts.get('IN_PROGRESS', 0)}\n"
+        f"📝 Всего задач: {sum(status_counts.values())}\n"
+    )
+
+    # Текущая активная задача: выбираем только отображаемые столбцы
+    active_task = None
+    if status_counts.get("IN_PROGRESS"):
+        active_task = (await db.execute(select(
+            Task.gate_number, Task.started_at, Parking.spot_number
+        ).join(Parking).where(
+            Task.driver_id == user.id,
+            Task.status == "IN_PROGRESS",
+            Task.started_at >= shift_start
+        ).limit(1))).first()
     if active_task and active_task.started_at:
         started = ensure_timezone_aware(active_task.started_at)
         duration = now - started
         minutes = int(duration.total_seconds() / 60)
         response += (
             f"\n{Emoji.IN_PROGRESS} ТЕКУЩАЯ ЗАДАЧА:\n"
-            f"📍 Место #{active_task.parking.spot_number}\n"
+            f"📍 Место #{active_task.spot_number}\n"
             f"🚪 Ворота #{active_task.gate_number}\n"
             f"⏰ В работе: {minutes} мин\n"
         )
@@ -2459,48 +2645,56 @@ async def process_shift_stats(message: Message, db: Session):
 # ==================== ОБРАБОТЧИКИ ДЕЙСТВИЙ С ЗАДАЧАМИ ====================
 @router.callback_query(F.data.startswith("complete_task_"))
 @with_db
-async def process_task_complete(callback: CallbackQuery, db: Session):
+async def process_task_complete(callback: CallbackQuery, db: AsyncSession):
     """Завершение задачи"""
     task_id = int(callback.data.replace("complete_task_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
 
-    if not task:
+    # Задача не загружается в сессию: UPDATE ... RETURNING сразу отдает столбцы,
+    # нужные для освобождения места и уведомления оператора
+    now = get_timezone_aware_now()
+    driver_name = select(User.first_name).where(User.id == Task.driver_id).scalar_subquery()
+    row = (await db.execute(update(Task).where(Task.id == task_id).values(
+        status="COMPLETED",
+        completed_at=now
+    ).returning(
+        Task.parking_id, Task.gate_number, Task.operator_id, driver_name
+    ).execution_options(synchronize_session=False))).first()
+
+    if not row:
         await callback.message.edit_text("❌ Задача не найдена.")
         return
 
-    task.status = "COMPLETED"
-    task.completed_at = get_timezone_aware_now()
+    parking_id, gate_number, operator_id, driver_first_name = row
 
-    if task.parking:
-        task.parking.departure_time = get_timezone_aware_now()
-        task.parking.gate_number = task.gate_number
+    vehicle_number = await db.scalar(update(Parking).where(Parking.id == parking_id).values(
+        departure_time=now,
+        gate_number=gate_number
+    ).returning(Parking.vehicle_number).execution_options(synchronize_session=False))
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"{Emoji.COMPLETED} Задача #{task_id} выполнена!\n"
-        f"🚗 ТС отправлено на ворота #{task.gate_number}"
+        f"🚗 ТС отправлено на ворота #{gate_number}"
     )
 
-    if task.operator_id:
-        try:
-            await bot.send_message(
-                task.operator_id,
-                f"{Emoji.COMPLETED} Задача #{task_id} выполнена!\n"
-                f"👤 Водитель: {task.driver.first_name if task.driver else 'Неизвестно'}\n"
-                f"🚗 ТС: {task.parking.vehicle_number if task.parking else 'Неизвестно'}\n"
-                f"🚪 Ворота: #{task.gate_number}"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+    if operator_id:
+        notify_in_background(
+            operator_id,
+            f"{Emoji.COMPLETED} Задача #{task_id} выполнена!\n"
+            f"👤 Водитель: {driver_first_name if driver_first_name is not None else 'Неизвестно'}\n"
+            f"🚗 ТС: {vehicle_number if vehicle_number is not None else 'Неизвестно'}\n"
+            f"🚪 Ворота: #{gate_number}",
+            "Ошибка уведомления оператора: %s"
+        )
 
 
 @router.callback_query(F.data.startswith("no_vehicle_"))
 @with_db
-async def process_no_vehicle(callback: CallbackQuery, db: Session):
+async def process_no_vehicle(callback: CallbackQuery, db: AsyncSession):
     """Ситуация 'Нет ТС' - снятие задачи и возврат в пул"""
     task_id = int(callback.data.replace("no_vehicle_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=TASK_SUMMARY_OPTIONS)
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -2508,25 +2702,26 @@ async def process_no_vehicle(callback: CallbackQuery, db: Session):
 
     driver_id = task.driver_id
 
-    task.status = "STUCK"
-    task.is_stuck = True
-    task.stuck_reason = "Нет ТС"
-    task.driver_id = None
-    task.is_in_pool = True
-    task.priority += 5
+    # Приоритет повышается в самом UPDATE, без чтения-изменения-записи
+    await db.execute(update(Task).where(Task.id == task.id).values(
+        status="STUCK",
+        is_stuck=True,
+        stuck_reason="Нет ТС",
+        driver_id=None,
+        is_in_pool=True,
+        priority=Task.priority + 5
+    ))
 
-    db.commit()
+    await db.commit()
 
     if driver_id:
-        try:
-            await bot.send_message(
-                driver_id,
-                f"⚠️ Задача #{task.id} снята с вас.\n"
-                f"Причина: ТС отсутствует на парковочном месте\n\n"
-                f"✅ Вы можете взять другую задачу."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления водителя: {e}")
+        notify_in_background(
+            driver_id,
+            f"⚠️ Задача #{task.id} снята с вас.\n"
+            f"Причина: ТС отсутствует на парковочном месте\n\n"
+            f"✅ Вы можете взять другую задачу.",
+            "Ошибка уведомления водителя: %s"
+        )
 
     await callback.message.edit_text(
         f"⚠️ Задача #{task_id} помечена как 'Нет ТС'.\n"
@@ -2534,27 +2729,48 @@ async def process_no_vehicle(callback: CallbackQuery, db: Session):
     )
 
     if task.operator_id:
-        try:
-            await bot.send_message(
-                task.operator_id,
-                f"⚠️ Задача #{task.id} зависла!\n"
-                f"Причина: Нет ТС на месте\n"
-                f"🚗 ТС: {task.parking.vehicle_number}\n"
-                f"📍 Место: #{task.parking.spot_number}\n"
-                f"🚪 Ворота: #{task.gate_number}\n\n"
-                f"✅ Задача возвращена в пул.\n"
-                f"Требуется вмешательство оператора."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+        notify_in_background(
+            task.operator_id,
+            f"⚠️ Задача #{task.id} зависла!\n"
+            f"Причина: Нет ТС на месте\n"
+            f"🚗 ТС: {task.parking.vehicle_number}\n"
+            f"📍 Место: #{task.parking.spot_number}\n"
+            f"🚪 Ворота: #{task.gate_number}\n\n"
+            f"✅ Задача возвращена в пул.\n"
+            f"Требуется вмешательство оператора.",
+            "Ошибка уведомления оператора: %s"
+        )
+
+
+async def _notify_task_stuck(task: Task, driver_id: Optional[int], reason: str, driver_text: str, operator_note: str):
+    """
+    Параллельное уведомление снятого водителя и оператора о зависшей задаче
+
+    Ошибка отправки одному получателю только логируется и не мешает второму.
+    """
+    notifications = []
+    if driver_id:
+        notifications.append(_send_notification(driver_id, driver_text, "Ошибка уведомления водителя: %s"))
+    if task.operator_id:
+        operator_text = (
+            f"⚠️ Задача #{task.id} зависла!\n"
+            f"Причина: {reason}\n"
+            f"🚗 ТС: {task.parking.vehicle_number}\n"
+            f"📍 Место: #{task.parking.spot_number}\n"
+            f"🚪 Ворота: #{task.gate_number}\n\n"
+            f"{operator_note}"
+        )
+        notifications.append(_send_notification(task.operator_id, operator_text, "Ошибка уведомления оператора: %s"))
+    await asyncio.gather(*notifications)
 
 
 @router.callback_query(F.data.startswith("breakdown_"))
 @with_db
-async def process_breakdown(callback: CallbackQuery, db: Session):
+async def process_breakdown(callback: CallbackQuery, db: AsyncSession):
     """Ситуация 'Поломка ТС' - снятие задачи без возврата в пул"""
     task_id = int(callback.data.replace("breakdown_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    # Для уведомлений из места нужны только номер и ТС, пользователи не подгружаются
+    task = await db.get(Task, task_id, options=TASK_SUMMARY_OPTIONS)
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -2568,45 +2784,31 @@ async def process_breakdown(callback: CallbackQuery, db: Session):
     task.driver_id = None
     task.is_in_pool = False
 
-    db.commit()
-
-    if driver_id:
-        try:
-            await bot.send_message(
-                driver_id,
-                f"⚠️ Задача #{task.id} снята с вас.\n"
-                f"Причина: Поломка ТС\n\n"
-                f"✅ Вы можете взять другую задачу."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления водителя: {e}")
+    await db.commit()
 
     await callback.message.edit_text(
         f"⚠️ Задача #{task_id} помечена как 'Поломка ТС'.\n"
         f"✅ Задача снята с водителя."
     )
 
-    if task.operator_id:
-        try:
-            await bot.send_message(
-                task.operator_id,
-                f"⚠️ Задача #{task.id} зависла!\n"
-                f"Причина: Поломка ТС\n"
-                f"🚗 ТС: {task.parking.vehicle_number}\n"
-                f"📍 Место: #{task.parking.spot_number}\n"
-                f"🚪 Ворота: #{task.gate_number}\n\n"
-                f"❌ ТС требует ремонта. Задача закрыта."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+    await _notify_task_stuck(
+        task,
+        driver_id,
+        "Поломка ТС",
+        f"⚠️ Задача #{task.id} снята с вас.\n"
+        f"Причина: Поломка ТС\n\n"
+        f"✅ Вы можете взять другую задачу.",
+        "❌ ТС требует ремонта. Задача закрыта."
+    )
 
 
 @router.callback_query(F.data.startswith("stuck_timeout_"))
 @with_db
-async def process_stuck_timeout(callback: CallbackQuery, db: Session):
+async def process_stuck_timeout(callback: CallbackQuery, db: AsyncSession):
     """Ситуация 'Долгое ожидание' - снятие задачи с повышенным приоритетом"""
     task_id = int(callback.data.replace("stuck_timeout_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    # Для уведомлений из места нужны только номер и ТС, пользователи не подгружаются
+    task = await db.get(Task, task_id, options=TASK_SUMMARY_OPTIONS)
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -2621,75 +2823,59 @@ async def process_stuck_timeout(callback: CallbackQuery, db: Session):
     task.is_in_pool = True
     task.priority += 10
 
-    db.commit()
-
-    if driver_id:
-        try:
-            await bot.send_message(
-                driver_id,
-                f"⚠️ Задача #{task.id} снята с вас из-за долгого ожидания.\n\n"
-                f"📋 Информация:\n"
-                f"📍 Место: #{task.parking.spot_number}\n"
-                f"🚗 ТС: {task.parking.vehicle_number}\n"
-                f"🚪 Ворота: #{task.gate_number}\n\n"
-                f"✅ Задача возвращена в пул. Вы можете взять другую задачу."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления водителя: {e}")
+    await db.commit()
 
     await callback.message.edit_text(
         f"⚠️ Задача #{task_id} помечена как 'Долгое ожидание'.\n"
         f"✅ Задача снята с водителя и возвращена в пул с повышенным приоритетом."
     )
 
-    if task.operator_id:
-        try:
-            await bot.send_message(
-                task.operator_id,
-                f"⚠️ Задача #{task.id} зависла!\n"
-                f"Причина: Долгое ожидание на воротах\n"
-                f"🚗 ТС: {task.parking.vehicle_number}\n"
-                f"📍 Место: #{task.parking.spot_number}\n"
-                f"🚪 Ворота: #{task.gate_number}\n\n"
-                f"✅ Задача возвращена в пул с приоритетом {task.priority}.\n"
-                f"Требуется вмешательство оператора."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления оператора: {e}")
+    await _notify_task_stuck(
+        task,
+        driver_id,
+        "Долгое ожидание на воротах",
+        f"⚠️ Задача #{task.id} снята с вас из-за долгого ожидания.\n\n"
+        f"📋 Информация:\n"
+        f"📍 Место: #{task.parking.spot_number}\n"
+        f"🚗 ТС: {task.parking.vehicle_number}\n"
+        f"🚪 Ворота: #{task.gate_number}\n\n"
+        f"✅ Задача возвращена в пул. Вы можете взять другую задачу.",
+        f"✅ Задача возвращена в пул с приоритетом {task.priority}.\n"
+        f"Требуется вмешательство оператора."
+    )
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ ОПЕРАТОРОВ ====================
-@router.message(F.text == f"{Emoji.TASK} Дать задание")
+@menu_button(f"{Emoji.TASK} Дать задание")
 @with_db
-async def process_give_task(message: Message, db: Session):
+async def process_give_task(message: Message, db: AsyncSession):
     """Создание нового задания оператором"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    if "OPERATOR" not in get_user_roles(user):
+    if not user.has_role("OPERATOR"):
         await message.answer(f"{Emoji.ERROR} Эта функция доступна только операторам.")
         return
 
-    # Получаем все припаркованные ТС
-    active_parkings = db.query(Parking).filter(
+    # Все припаркованные ТС с водителями и признаком активной задачи - одним запросом
+    has_active_task = exists().where(
+        Task.parking_id == Parking.id,
+        Task.status.in_(["PENDING", "IN_PROGRESS"])
+    ).label("has_active_task")
+    rows = (await db.execute(select(Parking, has_active_task).options(
+        joinedload(Parking.user)
+    ).where(
         Parking.departure_time == None
-    ).all()
+    ))).all()
 
-    if not active_parkings:
+    if not rows:
         await message.answer(f"{Emoji.INFO} Нет припаркованных ТС.")
         return
 
-    # Получаем ID парковок, у которых уже есть активные задачи
-    active_task_parking_ids = db.query(Task.parking_id).filter(
-        Task.status.in_(["PENDING", "IN_PROGRESS"]),
-        Task.parking_id.isnot(None)
-    ).all()
-    active_task_parking_ids = [p[0] for p in active_task_parking_ids]
-
-    # Фильтруем ТС, у которых нет активных задач
-    available_parkings = [p for p in active_parkings if p.id not in active_task_parking_ids]
+    # ТС, у которых нет активных задач
+    available_parkings = [parking for parking, busy in rows if not busy]
 
     if not available_parkings:
         await message.answer(
@@ -2716,9 +2902,9 @@ async def process_give_task(message: Message, db: Session):
     # Добавляем статистику
     stats_text = (
         f"\n\n📊 Статистика:\n"
-        f"• Всего ТС на парковке: {len(active_parkings)}\n"
+        f"• Всего ТС на парковке: {len(rows)}\n"
         f"• Доступно для заданий: {len(available_parkings)}\n"
-        f"• С активными задачами: {len(active_task_parking_ids)}"
+        f"• С активными задачами: {len(rows) - len(available_parkings)}"
     )
 
     builder.button(text=f"{Emoji.BACK} Назад", callback_data="menu_main")
@@ -2730,104 +2916,41 @@ async def process_give_task(message: Message, db: Session):
     )
 
 
-@router.callback_query(F.data == "select_abk1")
-@with_db
-async def process_select_abk1(callback: CallbackQuery, state: FSMContext, db: Session):
-    """Выбор АБК-1"""
-    await state.update_data(abk_type="ABK1")
-
-    # Получаем данные из состояния для отображения
-    data = await state.get_data()
-    parking_id = data.get('parking_id')
+async def _select_abk(callback: CallbackQuery, state: FSMContext, abk_type: str):
+    """Сохранение выбранного АБК и запрос номера ворот"""
+    data = await state.update_data(abk_type=abk_type)
+    abk_name, gates, no_parking_prompt = ABK_GATE_PROMPTS[abk_type]
 
-    if parking_id:
-        parking = db.query(Parking).filter(Parking.id == parking_id).first()
-        if parking:
-            driver_name = f"{parking.user.first_name} {parking.user.last_name}".strip() or "Водитель"
-            type_mark = "🔗 Перецепной" if parking.is_hitch else "🚛 Не перецепной"
-
-            await callback.message.edit_text(
-                f"🏢 Выбран АБК-1\n\n"
-                f"📋 Информация о ТС:\n"
-                f"📍 Место: #{parking.spot_number}\n"
-                f"🚗 Номер: {parking.vehicle_number}\n"
-                f"👤 Водитель: {driver_name}\n"
-                f"📝 Тип: {type_mark}\n\n"
-                f"📋 Доступные ворота для АБК-1:\n"
-                f"• с 1 по 59\n"
-                f"• с 66 по 83\n"
-                f"❌ Ворота с 60 по 65 НЕДОСТУПНЫ\n\n"
-                f"Введите номер ворот:"
-            )
-        else:
-            await callback.message.edit_text(
-                f"🏢 Выбран АБК-1\n\n"
-                f"📋 Доступные ворота:\n"
-                f"• с 1 по 59\n"
-                f"• с 66 по 83\n"
-                f"❌ Ворота с 60 по 65 НЕДОСТУПНЫ\n\n"
-                f"Введите номер ворот:"
-            )
+    # Данные о ТС сохранены в состоянии при выборе ТС, БД не нужна
+    if data.get('parking_id'):
+        await callback.message.edit_text(ABK_SELECTED_TMPL(
+            abk_name=abk_name,
+            spot=data['spot_number'],
+            vehicle=data['vehicle_number'],
+            driver=data['driver_name'],
+            type_mark="🔗 Перецепной" if data['is_hitch'] else "🚛 Не перецепной",
+            gates=gates
+        ))
     else:
-        await callback.message.edit_text(
-            f"🏢 Выбран АБК-1\n\n"
-            f"📋 Доступные ворота:\n"
-            f"• с 1 по 59\n"
-            f"• с 66 по 83\n"
-            f"❌ Ворота с 60 по 65 НЕДОСТУПНЫ\n\n"
-            f"Введите номер ворот:"
-        )
+        await callback.message.edit_text(no_parking_prompt)
 
     await state.set_state(OperatorStates.waiting_for_gate_number)
 
 
-@router.callback_query(F.data == "select_abk2")
-@with_db
-async def process_select_abk2(callback: CallbackQuery, state: FSMContext, db: Session):
-    """Выбор АБК-2"""
-    await state.update_data(abk_type="ABK2")
-
-    # Получаем данные из состояния для отображения
-    data = await state.get_data()
-    parking_id = data.get('parking_id')
-
-    if parking_id:
-        parking = db.query(Parking).filter(Parking.id == parking_id).first()
-        if parking:
-            driver_name = f"{parking.user.first_name} {parking.user.last_name}".strip() or "Водитель"
-            type_mark = "🔗 Перецепной" if parking.is_hitch else "🚛 Не перецепной"
+@router.callback_query(F.data == "select_abk1")
+async def process_select_abk1(callback: CallbackQuery, state: FSMContext):
+    """Выбор АБК-1"""
+    await _select_abk(callback, state, "ABK1")
 
-            await callback.message.edit_text(
-                f"🏢 Выбран АБК-2\n\n"
-                f"📋 Информация о ТС:\n"
-                f"📍 Место: #{parking.spot_number}\n"
-                f"🚗 Номер: {parking.vehicle_number}\n"
-                f"👤 Водитель: {driver_name}\n"
-                f"📝 Тип: {type_mark}\n\n"
-                f"📋 Доступные ворота для АБК-2:\n"
-                f"• с 1 по 10\n\n"
-                f"Введите номер ворот:"
-            )
-        else:
-            await callback.message.edit_text(
-                f"🏢 Выбран АБК-2\n\n"
-                f"📋 Доступные ворота:\n"
-                f"• с 1 по 10\n\n"
-                f"Введите номер ворот:"
-            )
-    else:
-        await callback.message.edit_text(
-            f"🏢 Выбран АБК-2\n\n"
-            f"📋 Доступные ворота:\n"
-            f"• с 1 по 10\n\n"
-            f"Введите номер ворот:"
-        )
 
-    await state.set_state(OperatorStates.waiting_for_gate_number)
+@router.callback_query(F.data == "select_abk2")
+async def process_select_abk2(callback: CallbackQuery, state: FSMContext):
+    """Выбор АБК-2"""
+    await _select_abk(callback, state, "ABK2")
 
 @router.message(OperatorStates.waiting_for_gate_number)
 @with_db
-async def process_gate_assignment(message: Message, state: FSMContext, db: Session):
+async def process_gate_assignment(message: Message, state: FSMContext, db: AsyncSession):
     """Назначение ворот и создание задачи с проверкой доступности ворот"""
     try:
         gate_number = int(message.text)
@@ -2850,80 +2973,69 @@ async def process_gate_assignment(message: Message, state: FSMContext, db: Sessi
         return
 
     # Проверка доступности ворот в зависимости от выбранного АБК
-    is_valid_gate = False
-    error_message = ""
-
-    if abk_type == "ABK1":
-        # АБК-1: ворота 1-59 и 66-83 (60-65 недоступны)
-        if 1 <= gate_number <= 59:
-            is_valid_gate = True
-        elif 66 <= gate_number <= 83:
-            is_valid_gate = True
-        else:
-            error_message = (
-                f"{Emoji.ERROR} Для АБК-1 доступны ворота:\n"
-                f"• с 1 по 59\n"
-                f"• с 66 по 83\n"
-                f"Ворота с 60 по 65 недоступны для использования."
-            )
-    elif abk_type == "ABK2":
-        # АБК-2: ворота 1-10
-        if 1 <= gate_number <= 10:
-            is_valid_gate = True
-        else:
-            error_message = (
-                f"{Emoji.ERROR} Для АБК-2 доступны только ворота с 1 по 10."
-            )
-    else:
-        error_message = f"{Emoji.ERROR} Неизвестный тип АБК."
+    allowed_gates = ABK_GATES.get(abk_type)
+    if allowed_gates is None:
+        await message.answer(f"{Emoji.ERROR} Неизвестный тип АБК.")
+        return
 
-    if not is_valid_gate:
-        await message.answer(error_message)
+    if gate_number not in allowed_gates:
+        await message.answer(ABK_GATE_ERRORS[abk_type])
         return
 
-    parking = db.query(Parking).filter(Parking.id == parking_id).first()
     operator = await get_user(db, message.from_user.id)
 
-    if not parking:
+    # Данные о ТС взяты из состояния; из БД нужны только время убытия
+    # и активная задача (если появилась) - одним запросом
+    row = (await db.execute(select(
+        Parking.departure_time, Task.id, Task.gate_number, Task.status, Task.created_at
+    ).outerjoin(Task, and_(
+        Task.parking_id == Parking.id,
+        Task.status.in_(["PENDING", "IN_PROGRESS"])
+    )).where(Parking.id == parking_id).limit(1))).first()
+
+    if not row:
         await message.answer(f"{Emoji.ERROR} ТС не найдено.")
         await state.clear()
         return
 
-    # Финальная проверка - нет ли уже активной задачи
-    existing_task = db.query(Task).filter(
-        Task.parking_id == parking_id,
-        Task.status.in_(["PENDING", "IN_PROGRESS"])
-    ).first()
+    departure_time, existing_task_id, existing_gate, existing_status, existing_created_at = row
 
-    if existing_task:
+    # Финальная проверка - нет ли уже активной задачи
+    if existing_task_id:
         await message.answer(
             f"{Emoji.WARNING} НЕВОЗМОЖНО СОЗДАТЬ ЗАДАНИЕ!\n\n"
-            f"У этого ТС уже есть активная задача #{existing_task.id}:\n"
-            f"🚪 Ворота: #{existing_task.gate_number}\n"
-            f"📌 Статус: {STATUS_NAMES.get(existing_task.status, existing_task.status)}\n"
-            f"⏰ Создана: {existing_task.created_at.strftime('%H:%M %d.%m.%Y')}\n\n"
+            f"У этого ТС уже есть активная задача #{existing_task_id}:\n"
+            f"🚪 Ворота: #{existing_gate}\n"
+            f"📌 Статус: {STATUS_NAMES.get(existing_status, existing_status)}\n"
+            f"⏰ Создана: {format_hm_dmy(existing_created_at)}\n\n"
             f"Дождитесь завершения текущей задачи."
         )
         await state.clear()
         return
 
     # Проверяем, не убыло ли ТС
-    if parking.departure_time:
+    if departure_time:
         await message.answer(
             f"{Emoji.ERROR} Это ТС уже убыло с парковки в "
-            f"{parking.departure_time.strftime('%H:%M %d.%m.%Y')}."
+            f"{format_hm_dmy(departure_time)}."
         )
         await state.clear()
         return
 
+    spot_number = data['spot_number']
+    vehicle_number = data['vehicle_number']
+    is_hitch = data['is_hitch']
+
+    now = get_timezone_aware_now()
+
     # Создание задачи с указанием АБК
     task = Task(
-        parking_id=parking.id,
+        parking_id=parking_id,
         operator_id=operator.id,
         gate_number=gate_number,
         status="PENDING",
-        created_at=get_timezone_aware_now(),
-        is_in_pool=parking.is_hitch  # В пул только перецепные
+        created_at=now,
+        is_in_pool=is_hitch  # В пул только перецепные
     )
 
     # Добавляем информацию об АБК
@@ -2932,7 +3044,7 @@ async def process_gate_assignment(message: Message, state: FSMContext, db: Sessi
 
     driver_info = ""
 
-    if parking.is_hitch:
+    if is_hitch:
         # Перецепной - в общий пул водителей перегона
         driver_info = f"в общий пул водителей перегона ({abk_info})"
 
@@ -2940,67 +3052,69 @@ async def process_gate_assignment(message: Message, state: FSMContext, db: Sessi
         notification_text = (
             f"{Emoji.TASK_POOL} НОВАЯ ЗАДАЧА В ПУЛЕ!\n\n"
             f"📋 Информация:\n"
-            f"📍 Место: #{parking.spot_number}\n"
-            f"🚗 ТС: {parking.vehicle_number}\n"
+            f"📍 Место: #{spot_number}\n"
+            f"🚗 ТС: {vehicle_number}\n"
             f"🏢 {abk_info}\n"
             f"🚪 Ворота: #{gate_number}\n"
             f"📝 Тип: Перецепной\n"
-            f"⏰ Время: {get_timezone_aware_now().strftime('%H:%M %d.%m.%Y')}\n\n"
+            f"⏰ Время: {format_hm_dmy(now)}\n\n"
             f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
         )
 
-        # Уведомление всех активных водителей перегона
-        from services import get_active_transfer_drivers
-        active_drivers = await get_active_transfer_drivers(db)
-        notified_count = 0
-
-        for driver in active_drivers:
-            try:
-                # Отправляем задачу с изображением ворот
-                await send_task_with_image(
-                    driver.telegram_id,
-                    building_type,
-                    gate_number,
-                    notification_text
-                )
-                notified_count += 1
-                await asyncio.sleep(0.1)  # Небольшая задержка между отправками
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления водителю {driver.telegram_id}: {e}")
-
-        driver_info += f" (уведомлено {notified_count} водителей)"
+        # Получатели: все активные водители перегона
+        recipients = await get_active_transfer_driver_ids(db)
+        if not recipients:
+            driver_info += " (нет активных водителей перегона)"
     else:
         # Неперецепной - конкретному водителю
-        driver = parking.user
-        task.assigned_driver_id = driver.id
+        task.assigned_driver_id = data['driver_id']
         task.is_in_pool = False
-        driver_info = f"водителю ТС {driver.first_name} {driver.last_name} ({abk_info})"
+        driver_info = f"водителю ТС {data['driver_name']} ({abk_info})"
 
         notification_text = (
             f"{Emoji.TASK} НОВОЕ ЗАДАНИЕ!\n\n"
             f"📋 Информация:\n"
-            f"📍 Место: #{parking.spot_number}\n"
-            f"🚗 ТС: {parking.vehicle_number}\n"
+            f"📍 Место: #{spot_number}\n"
+            f"🚗 ТС: {vehicle_number}\n"
             f"🏢 {abk_info}\n"
             f"🚪 Ворота: #{gate_number}\n"
             f"📝 Тип: Не перецепной\n"
-            f"⏰ Время: {get_timezone_aware_now().strftime('%H:%M %d.%m.%Y')}\n\n"
+            f"⏰ Время: {format_hm_dmy(now)}\n\n"
             f'Используйте кнопку "{Emoji.GATE} Встать на ворота".'
         )
 
-        try:
-            # Отправляем задачу с изображением ворот конкретному водителю
-            await send_task_with_image(
-                driver.telegram_id,
+    db.add(task)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # ux_task_parking_active: другой оператор успел создать задачу для этого ТС
+        await db.rollback()
+        await message.answer(
+            f"{Emoji.WARNING} НЕВОЗМОЖНО СОЗДАТЬ ЗАДАНИЕ!\n\n"
+            f"Другой оператор только что создал задачу для этого ТС."
+        )
+        await state.clear()
+        return
+
+    # Оператор получает ответ сразу, уведомления водителям уходят в фоне
+    if is_hitch:
+        if recipients:
+            run_in_background(_broadcast_pool_task(
+                message.chat.id,
+                task.id,
+                recipients,
                 building_type,
                 gate_number,
                 notification_text
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления водителя {driver.telegram_id}: {e}")
-
-    db.add(task)
-    db.commit()
+            ))
+    else:
+        # Задача с изображением ворот конкретному водителю
+        run_in_background(send_task_with_image(
+            data['driver_telegram_id'],
+            building_type,
+            gate_number,
+            notification_text
+        ))
 
     await message.answer(
         f"{Emoji.SUCCESS} ЗАДАНИЕ СОЗДАНО!\n\n"
@@ -3009,36 +3123,42 @@ async def process_gate_assignment(message: Message, state: FSMContext, db: Sessi
         f"👤 Назначено: {driver_info}\n"
         f"🏢 {abk_info}\n"
         f"🚪 Ворота: #{gate_number}\n"
-        f"📍 Место: #{parking.spot_number}\n"
-        f"🚗 ТС: {parking.vehicle_number}\n"
-        f"📊 Статус: {'В пуле задач' if parking.is_hitch else 'Назначена водителю'}\n"
-        f"⏰ Время создания: {task.created_at.strftime('%H:%M %d.%m.%Y')}",
+        f"📍 Место: #{spot_number}\n"
+        f"🚗 ТС: {vehicle_number}\n"
+        f"📊 Статус: {'В пуле задач' if is_hitch else 'Назначена водителю'}\n"
+        f"⏰ Время создания: {format_hm_dmy(task.created_at)}",
         reply_markup=get_main_menu_keyboard(operator)
     )
     await state.clear()
 
 @router.callback_query(F.data.startswith("select_vehicle_"))
 @with_db
-async def process_select_vehicle(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_select_vehicle(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Выбор ТС и запрос выбора АБК"""
     parking_id = int(callback.data.replace("select_vehicle_", ""))
-    parking = db.query(Parking).filter(Parking.id == parking_id).first()
 
-    if not parking:
+    # Место, его водитель и активная задача (если есть) - одним запросом
+    row = (await db.execute(select(
+        Parking, Task.id, Task.gate_number, Task.status
+    ).outerjoin(Task, and_(
+        Task.parking_id == Parking.id,
+        Task.status.in_(["PENDING", "IN_PROGRESS"])
+    )).options(
+        joinedload(Parking.user)
+    ).where(Parking.id == parking_id).limit(1))).first()
+
+    if not row:
         await callback.message.edit_text(f"{Emoji.ERROR} ТС не найдено.")
         return
 
-    # Дополнительная проверка - нет ли уже активной задачи
-    existing_task = db.query(Task).filter(
-        Task.parking_id == parking_id,
-        Task.status.in_(["PENDING", "IN_PROGRESS"])
-    ).first()
+    parking, existing_task_id, existing_gate, existing_status = row
 
-    if existing_task:
+    # Дополнительная проверка - нет ли уже активной задачи
+    if existing_task_id:
         await callback.message.edit_text(
-            f"{Emoji.WARNING} У этого ТС уже есть активная задача #{existing_task.id}!\n"
-            f"🚪 Ворота: #{existing_task.gate_number}\n"
-            f"📌 Статус: {STATUS_NAMES.get(existing_task.status, existing_task.status)}\n\n"
+            f"{Emoji.WARNING} У этого ТС уже есть активная задача #{existing_task_id}!\n"
+            f"🚪 Ворота: #{existing_gate}\n"
+            f"📌 Статус: {STATUS_NAMES.get(existing_status, existing_status)}\n\n"
             f"Дождитесь завершения текущей задачи."
         )
         return
@@ -3050,10 +3170,20 @@ async def process_select_vehicle(callback: CallbackQuery, state: FSMContext, db:
         )
         return
 
-    # Сохраняем ID парковки в состояние
-    await state.update_data(parking_id=parking.id)
-
     driver_name = f"{parking.user.first_name} {parking.user.last_name}".strip() or "Водитель"
+
+    # Сохраняем в состояние все, что нужно для создания задачи,
+    # чтобы следующие шаги не загружали место и водителя повторно
+    await state.update_data(
+        parking_id=parking.id,
+        spot_number=parking.spot_number,
+        vehicle_number=parking.vehicle_number,
+        is_hitch=parking.is_hitch,
+        driver_id=parking.user.id,
+        driver_telegram_id=parking.user.telegram_id,
+        driver_name=driver_name
+    )
+
     type_mark = "🔗 Перецепной" if parking.is_hitch else "🚛 Не перецепной"
     type_emoji = "🔗" if parking.is_hitch else "🚛"
 
@@ -3067,37 +3197,21 @@ async def process_select_vehicle(callback: CallbackQuery, state: FSMContext, db:
         f"📝 Тип: {type_mark}\n"
     )
 
-    if not existing_task:
+    if not existing_task_id:
         info_text += f"{Emoji.SUCCESS} Нет активных задач\n\n"
     else:
         info_text += f"{Emoji.WARNING} Есть активная задача\n\n"
 
-    # Создаем клавиатуру для выбора АБК
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text="🏢 АБК-1 (ворота 1-59, 66-83)",
-        callback_data="select_abk1"
-    )
-    builder.button(
-        text="🏢 АБК-2 (ворота 1-10)",
-        callback_data="select_abk2"
-    )
-    builder.button(
-        text=f"{Emoji.CANCEL} Отмена",
-        callback_data="menu_main"
-    )
-    builder.adjust(1)
-
     info_text += "🏢 Выберите АБК для задания:"
 
     await callback.message.edit_text(
         info_text,
-        reply_markup=builder.as_markup()
+        reply_markup=ABK_SELECTION_MARKUP
     )
 
-@router.message(F.text == f"{Emoji.QUEUE} Статус очереди")
-@with_db
-async def process_queue_status(message: Message, db: Session):
+@menu_button(f"{Emoji.QUEUE} Статус очереди")
+@with_db(readonly=True)
+async def process_queue_status(message: Message, db: AsyncSession):
     """Просмотр статуса очереди на парковку"""
     user = await get_user(db, message.from_user.id)
     if not user:
@@ -3105,17 +3219,17 @@ async def process_queue_status(message: Message, db: Session):
         return
 
     # Проверяем права (доступно для операторов и админов)
-    user_roles = get_user_roles(user)
-    if "OPERATOR" not in user_roles and "ADMIN" not in user_roles:
+    now = get_timezone_aware_now()
+    if not user.has_any_role("OPERATOR", "ADMIN"):
         # Для обычных пользователей показываем только их позицию
-        queue_item = db.query(ParkingQueue).filter(
+        queue_item = await db.scalar(select(ParkingQueue).where(
             ParkingQueue.user_id == user.id,
             ParkingQueue.status.in_(["waiting", "notified"])
-        ).first()
+        ).limit(1))
 
         if queue_item:
             position = await get_queue_position(db, user.id)
-            wait_time = get_timezone_aware_now() - ensure_timezone_aware(queue_item.created_at)
+            wait_time = now - ensure_timezone_aware(queue_item.created_at)
 
             await message.answer(
                 f"{Emoji.QUEUE} ВАША ПОЗИЦИЯ В ОЧЕРЕДИ:\n\n"
@@ -3132,10 +3246,10 @@ async def process_queue_status(message: Message, db: Session):
     # Для операторов и админов показываем полную статистику
     queue_stats = await get_queue_stats(db)
 
-    # Получаем список всех в очереди
-    queue_list = db.query(ParkingQueue).filter(
+    # Получаем список всех в очереди вместе с пользователями (одним запросом)
+    queue_list = (await db.scalars(select(ParkingQueue).options(joinedload(ParkingQueue.user)).where(
         ParkingQueue.status.in_(["waiting", "notified"])
-    ).order_by(ParkingQueue.created_at.asc()).limit(20).all()
+    ).order_by(ParkingQueue.created_at.asc()).limit(20))).all()
 
     response = f"{Emoji.QUEUE} ОЧЕРЕДЬ НА ПАРКОВКУ:\n\n"
     response += f"📊 Статистика:\n"
@@ -3148,9 +3262,9 @@ async def process_queue_status(message: Message, db: Session):
     if queue_list:
         response += f"📋 Первые 20 в очереди:\n\n"
         for i, item in enumerate(queue_list, 1):
-            user_info = await get_user(db, item.user_id)
+            user_info = item.user
             name = f"{user_info.first_name} {user_info.last_name}".strip() or f"ID: {item.user_id}"
-            wait_time = get_timezone_aware_now() - ensure_timezone_aware(item.created_at)
+            wait_time = now - ensure_timezone_aware(item.created_at)
 
             response += (
                 f"{i}. {name}\n"
@@ -3164,21 +3278,23 @@ async def process_queue_status(message: Message, db: Session):
     await message.answer(response[:4000])
 
 
-@router.message(F.text == f"{Emoji.TASK_POOL} Пул задач")
-@with_db
-async def process_task_pool(message: Message, db: Session):
+@menu_button(f"{Emoji.TASK_POOL} Пул задач")
+@with_db(readonly=True)
+async def process_task_pool(message: Message, db: AsyncSession):
     """Просмотр пула задач оператором"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user):
+    if not user.has_any_role("OPERATOR", "ADMIN"):
         await message.answer("❌ Эта функция доступна только операторам и администраторам.")
         return
 
-    # Получаем задачи в пуле
-    pool_tasks = db.query(Task).join(Parking).filter(
+    # Получаем задачи в пуле: место приходит тем же JOIN, пользователи для списка не нужны
+    pool_tasks = (await db.scalars(select(Task).join(Parking).options(
+        contains_eager(Task.parking)
+    ).where(
         Task.status == "PENDING",
         Task.is_in_pool == True,
         Parking.is_hitch == True,
@@ -3186,13 +3302,14 @@ async def process_task_pool(message: Message, db: Session):
     ).order_by(
         Task.priority.desc(),
         Task.created_at.asc()
-    ).all()
+    ))).all()
 
     if not pool_tasks:
         await message.answer(f"{Emoji.INFO} Пул задач пуст.")
         return
 
-    response = f"{Emoji.TASK_POOL} ПУЛ ЗАДАЧ ДЛЯ ВОДИТЕЛЕЙ ПЕРЕГОНА:\n\n"
+    # Части ответа собираются в список и склеиваются один раз
+    parts = [f"{Emoji.TASK_POOL} ПУЛ ЗАДАЧ ДЛЯ ВОДИТЕЛЕЙ ПЕРЕГОНА:\n\n"]
 
     now = get_timezone_aware_now()
 
@@ -3216,7 +3333,7 @@ async def process_task_pool(message: Message, db: Session):
         # Дополнительная метка для срочных задач
         urgent_mark = " ⚠️ СРОЧНО!" if minutes > 30 else ""
 
-        response += (
+        parts.append(
             f"🆔 ЗАДАЧА #{task.id}{urgent_mark}\n"
             f"{priority_text}\n"
             f"🚪 Ворота: #{task.gate_number}\n"
@@ -3231,7 +3348,7 @@ async def process_task_pool(message: Message, db: Session):
     high_priority = len([t for t in pool_tasks if t.priority >= 10])
     medium_priority = len([t for t in pool_tasks if 5 <= t.priority < 10])
 
-    response += (
+    parts.append(
         f"📊 СТАТИСТИКА ПУЛА:\n"
         f"• Всего задач: {total_tasks}\n"
         f"• 🔴 Высокий приоритет: {high_priority}\n"
@@ -3239,90 +3356,79 @@ async def process_task_pool(message: Message, db: Session):
         f"• ⚪ Низкий приоритет: {total_tasks - high_priority - medium_priority}\n"
     )
 
-    await message.answer(response[:4000])
+    await message.answer("".join(parts)[:4000])
 
 
-@router.message(F.text == f"{Emoji.TASK_POOL} Очистить пул")
+@menu_button(f"{Emoji.TASK_POOL} Очистить пул")
 @with_db
-async def process_clear_task_pool(message: Message, db: Session):
+async def process_clear_task_pool(message: Message, db: AsyncSession):
     """Очистка пула задач от зависших и неактуальных задач"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    if "OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user):
+    if not user.has_any_role("OPERATOR", "ADMIN"):
         await message.answer(f"{Emoji.ERROR} Доступ запрещен.")
         return
 
-    # Находим все задачи в пуле
-    pool_tasks = db.query(Task).join(Parking).filter(
+    # Считаем задачи в пуле на стороне БД, сами задачи здесь не нужны
+    total_count, hitch_count, non_hitch_count = (await db.execute(select(
+        func.count(Task.id),
+        func.count(Task.id).filter(Parking.is_hitch == True),
+        func.count(Task.id).filter(Parking.is_hitch == False)
+    ).join(Parking, Task.parking_id == Parking.id).where(
         Task.status == "PENDING",
         Task.is_in_pool == True,
         Parking.departure_time == None
-    ).all()
+    ))).one()
 
-    if not pool_tasks:
+    if not total_count:
         await message.answer(f"{Emoji.INFO} Пул задач пуст.")
         return
 
-    # Создаем клавиатуру для выбора действия
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text="🔄 Перезапустить все",
-        callback_data="clear_pool_restart"
-    )
-    builder.button(
-        text="❌ Удалить все",
-        callback_data="clear_pool_delete"
-    )
-    builder.button(
-        text="📋 Показать список",
-        callback_data="clear_pool_list"
-    )
-    builder.button(
-        text=f"{Emoji.BACK} Отмена",
-        callback_data="menu_main"
-    )
-    builder.adjust(1)
-
     await message.answer(
         f"{Emoji.TASK_POOL} ОЧИСТКА ПУЛА ЗАДАЧ\n\n"
         f"📊 Статистика:\n"
-        f"• Всего задач в пуле: {len(pool_tasks)}\n"
-        f"• Перецепных: {len([t for t in pool_tasks if t.parking and t.parking.is_hitch])}\n"
-        f"• Не перецепных: {len([t for t in pool_tasks if t.parking and not t.parking.is_hitch])}\n\n"
+        f"• Всего задач в пуле: {total_count}\n"
+        f"• Перецепных: {hitch_count}\n"
+        f"• Не перецепных: {non_hitch_count}\n\n"
         f"Выберите действие:",
-        reply_markup=builder.as_markup()
+        reply_markup=CLEAR_POOL_ACTIONS_MARKUP
     )
 
 
 @router.callback_query(F.data == "clear_pool_list")
 @with_db
-async def process_clear_pool_list(callback: CallbackQuery, db: Session):
+async def process_clear_pool_list(callback: CallbackQuery, db: AsyncSession):
     """Показать список задач в пуле"""
-    pool_tasks = db.query(Task).join(Parking).filter(
+    # Место приходит тем же JOIN, водители всех задач - одним selectin-запросом
+    pool_tasks = (await db.scalars(select(Task).join(Parking).options(
+        contains_eager(Task.parking),
+        selectinload(Task.driver)
+    ).where(
         Task.status == "PENDING",
         Task.is_in_pool == True,
         Parking.departure_time == None
-    ).all()
+    ))).all()
 
     if not pool_tasks:
         await callback.message.edit_text(f"{Emoji.INFO} Пул задач пуст.")
         return
 
-    response = f"{Emoji.TASK_POOL} ЗАДАЧИ В ПУЛЕ:\n\n"
+    parts = [f"{Emoji.TASK_POOL} ЗАДАЧИ В ПУЛЕ:\n\n"]
+    now = get_timezone_aware_now()
 
     for task in pool_tasks:
         created = ensure_timezone_aware(task.created_at)
-        wait_time = get_timezone_aware_now() - created
+        wait_time = now - created
         minutes = int(wait_time.total_seconds() / 60)
 
         driver_name = "Не назначен"
         if task.driver:
             driver_name = f"{task.driver.first_name} {task.driver.last_name}".strip()
 
-        response += (
+        parts.append(
             f"🆔 Задача #{task.id}\n"
             f"🚗 ТС: {task.parking.vehicle_number}\n"
             f"📍 Место: #{task.parking.spot_number}\n"
@@ -3333,89 +3439,78 @@ async def process_clear_pool_list(callback: CallbackQuery, db: Session):
             f"{'─' * 40}\n\n"
         )
 
-    # Добавляем кнопки действий
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text="🔄 Перезапустить все",
-        callback_data="clear_pool_restart"
-    )
-    builder.button(
-        text="❌ Удалить все",
-        callback_data="clear_pool_delete"
-    )
-    builder.button(
-        text=f"{Emoji.BACK} Назад",
-        callback_data="menu_main"
-    )
-    builder.adjust(1)
-
     await callback.message.edit_text(
-        response[:4000],
-        reply_markup=builder.as_markup()
+        "".join(parts)[:4000],
+        reply_markup=CLEAR_POOL_MARKUP
     )
 
 
 @router.callback_query(F.data == "clear_pool_restart")
 @with_db
-async def process_clear_pool_restart(callback: CallbackQuery, db: Session):
+async def process_clear_pool_restart(callback: CallbackQuery, db: AsyncSession):
     """Перезапустить все задачи в пуле"""
-    # Находим все зависшие задачи в пуле
-    stuck_tasks = db.query(Task).join(Parking).filter(
-        Task.status == "STUCK",
-        Task.is_in_pool == True,
-        Parking.departure_time == None
-    ).all()
-
-    # Сбрасываем их статус
-    count = 0
-    for task in stuck_tasks:
-        task.status = "PENDING"
-        task.driver_id = None
-        task.is_stuck = False
-        task.stuck_reason = None
-        task.priority = max(0, task.priority - 5)  # Снижаем приоритет
-        count += 1
-
-    # Также проверяем задачи, которые слишком долго висят
-    old_tasks = db.query(Task).join(Parking).filter(
+    # Места, с которых ТС еще не убыло
+    active_parking_ids = select(Parking.id).where(Parking.departure_time == None)
+    # У ТС может быть только одна активная задача (ux_task_parking_active): перезапускаем
+    # последнюю зависшую задачу ТС и только если другой активной у него нет
+    other_task = aliased(Task)
+    last_stuck_ids = select(func.max(other_task.id)).where(
+        other_task.status == "STUCK",
+        other_task.is_in_pool == True
+    ).group_by(other_task.parking_id)
+    has_other_active_task = exists().where(
+        other_task.parking_id == Task.parking_id,
+        other_task.status.in_(["PENDING", "IN_PROGRESS"])
+    )
+
+    # Сбрасываем приоритет задач, которые слишком долго висят.
+    # Выполняется до перезапуска зависших, чтобы они не попали в эту выборку
+    old_tasks_count = (await db.execute(update(Task).where(
         Task.status == "PENDING",
         Task.is_in_pool == True,
         Task.created_at <= get_timezone_aware_now() - timedelta(hours=24),
-        Parking.departure_time == None
-    ).all()
+        Task.parking_id.in_(active_parking_ids)
+    ).values(priority=0).execution_options(synchronize_session=False))).rowcount
 
-    for task in old_tasks:
-        task.priority = 0  # Сбрасываем приоритет для очень старых задач
-        count += 1
+    # Перезапускаем зависшие задачи в пуле со сниженным приоритетом
+    stuck_tasks_count = (await db.execute(update(Task).where(
+        Task.status == "STUCK",
+        Task.is_in_pool == True,
+        Task.parking_id.in_(active_parking_ids),
+        Task.id.in_(last_stuck_ids),
+        ~has_other_active_task
+    ).values(
+        status="PENDING",
+        driver_id=None,
+        is_stuck=False,
+        stuck_reason=None,
+        priority=case((Task.priority > 5, Task.priority - 5), else_=0)
+    ).execution_options(synchronize_session=False))).rowcount
+
+    count = stuck_tasks_count + old_tasks_count
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"{Emoji.SUCCESS} Пул задач очищен!\n\n"
         f"📊 Результат:\n"
-        f"• Перезапущено зависших задач: {len(stuck_tasks)}\n"
-        f"• Сброшен приоритет старых задач: {len(old_tasks)}\n"
+        f"• Перезапущено зависших задач: {stuck_tasks_count}\n"
+        f"• Сброшен приоритет старых задач: {old_tasks_count}\n"
         f"• Всего обработано: {count}"
     )
 
 
 @router.callback_query(F.data == "clear_pool_delete")
 @with_db
-async def process_clear_pool_delete(callback: CallbackQuery, db: Session):
+async def process_clear_pool_delete(callback: CallbackQuery, db: AsyncSession):
     """Удалить все задачи из пула"""
-    # Находим все задачи в пуле
-    pool_tasks = db.query(Task).join(Parking).filter(
+    # Удаляем все задачи пула одним DELETE, не загружая их
+    count = (await db.execute(delete(Task).where(
         Task.status == "PENDING",
         Task.is_in_pool == True
-    ).all()
+    ).execution_options(synchronize_session=False))).rowcount
 
-    count = len(pool_tasks)
-
-    # Удаляем задачи
-    for task in pool_tasks:
-        db.delete(task)
-
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"{Emoji.SUCCESS} Пул задач очищен!\n\n"
@@ -3424,52 +3519,54 @@ async def process_clear_pool_delete(callback: CallbackQuery, db: Session):
     )
 
 
-@router.message(F.text == f"{Emoji.STATUS} Статус заданий")
-@with_db
-async def process_tasks_status(message: Message, db: Session):
+@menu_button(f"{Emoji.STATUS} Статус заданий")
+@with_db(readonly=True)
+async def process_tasks_status(message: Message, db: AsyncSession):
     """Просмотр статуса активных заданий"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user):
+    if not user.has_any_role("OPERATOR", "ADMIN"):
         await message.answer("❌ Эта функция доступна только операторам и администраторам.")
         return
 
     # Получаем активные задания
-    tasks = db.query(Task).filter(
+    tasks = (await db.scalars(select(Task).options(*TASK_LIST_OPTIONS).where(
         Task.status.in_(["PENDING", "IN_PROGRESS", "STUCK"])
     ).order_by(
         Task.priority.desc(),
         Task.created_at.desc()
-    ).limit(20).all()
+    ).limit(20))).all()
 
     if not tasks:
         await message.answer(f"{Emoji.INFO} Нет активных заданий.")
         return
 
-    response = f"{Emoji.TASK} СТАТУС ЗАДАНИЙ:\n\n"
+    # Части ответа собираются в список и склеиваются один раз
+    parts = [f"{Emoji.TASK} СТАТУС ЗАДАНИЙ:\n\n"]
 
+    now = get_timezone_aware_now()
     for task in tasks:
         # Русское название статуса
         status_text = STATUS_NAMES.get(task.status, task.status)
         status_emoji = TASK_STATUS_EMOJI.get(task.status, "❓")
+        created = ensure_timezone_aware(task.created_at)
 
         # Время выполнения
         duration = ""
         if task.started_at:
             started = ensure_timezone_aware(task.started_at)
-            delta = get_timezone_aware_now() - started
+            delta = now - started
             hours = delta.seconds // 3600
             minutes = (delta.seconds % 3600) // 60
             if hours > 0:
                 duration = f" ({hours}ч {minutes}м)"
             else:
                 duration = f" ({minutes}м)"
-        elif task.status == "PENDING" and task.created_at:
-            created = ensure_timezone_aware(task.created_at)
-            delta = get_timezone_aware_now() - created
+        elif task.status == "PENDING" and created:
+            delta = now - created
             hours = delta.seconds // 3600
             minutes = (delta.seconds % 3600) // 60
             if hours > 0:
@@ -3496,7 +3593,7 @@ async def process_tasks_status(message: Message, db: Session):
         # Тип задачи
         task_type = "🔗 Перецепной" if task.parking and task.parking.is_hitch else "🚛 Не перецепной"
 
-        response += (
+        parts.append(
             f"{status_emoji} ЗАДАЧА #{task.id}\n"
             f"📌 Статус: {status_text}{duration}\n"
             f"🚪 Ворота: #{task.gate_number}\n"
@@ -3509,55 +3606,54 @@ async def process_tasks_status(message: Message, db: Session):
 
         # Причина зависания
         if task.is_stuck and task.stuck_reason:
-            response += f"⚠️ Причина: {task.stuck_reason}\n"
+            parts.append(f"⚠️ Причина: {task.stuck_reason}\n")
 
         # Время создания
-        if task.created_at:
-            created = ensure_timezone_aware(task.created_at)
-            response += f"⏰ Создана: {created.strftime('%H:%M %d.%m.%Y')}\n"
+        if created:
+            parts.append(f"⏰ Создана: {format_hm_dmy(created)}\n")
 
-        response += f"{'─' * 40}\n\n"
+        parts.append(f"{'─' * 40}\n\n")
 
-    await message.answer(response[:4000])
+    await message.answer("".join(parts)[:4000])
 
-@router.message(F.text == f"{Emoji.PARKING} Статус парковки")
-@with_db
-async def process_parking_status(message: Message, db: Session):
+@menu_button(f"{Emoji.PARKING} Статус парковки")
+@with_db(readonly=True)
+async def process_parking_status(message: Message, db: AsyncSession):
     """Просмотр статуса парковки"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    user_roles = get_user_roles(user)
-    if not any(r in user_roles for r in ["OPERATOR", "ADMIN", "DEB_EMPLOYEE"]):
+    if not user.has_any_role("OPERATOR", "ADMIN", "DEB_EMPLOYEE"):
         await message.answer("❌ Доступ запрещен.")
         return
 
     total_spots = config.PARKING_SPOTS
     now = get_timezone_aware_now()
-    active_parkings = db.query(Parking).filter(Parking.departure_time == None).all()
-    occupied_spots = len(active_parkings)
 
-    # Анализ времени стоянки
-    time_stats = {"1h": 0, "2h": 0, "3h": 0, "6h": 0, "12h": 0, "24h": 0}
+    # Анализ времени стоянки: интервал определяется в SQL сравнением времени прибытия
+    # с готовыми границами, БД возвращает по строке на интервал
+    time_bucket = case(
+        *((Parking.arrival_time < now - timedelta(hours=hours), label)
+          for hours, label in ((24, "24h"), (12, "12h"), (6, "6h"), (3, "3h"), (2, "2h"), (1, "1h"))),
+        else_="0h"
+    )
+    bucket_counts = dict((await db.execute(select(time_bucket, func.count(Parking.id)).where(
+        Parking.departure_time == None
+    ).group_by(time_bucket))).all())
 
-    for parking in active_parkings:
-        hours = (now - ensure_timezone_aware(parking.arrival_time)).total_seconds() / 3600
-        if hours > 24:
-            time_stats["24h"] += 1
-        elif hours > 12:
-            time_stats["12h"] += 1
-        elif hours > 6:
-            time_stats["6h"] += 1
-        elif hours > 3:
-            time_stats["3h"] += 1
-        elif hours > 2:
-            time_stats["2h"] += 1
-        elif hours > 1:
-            time_stats["1h"] += 1
+    occupied_spots = sum(bucket_counts.values())
+    time_stats = {label: bucket_counts.get(label, 0) for label in ("1h", "2h", "3h", "6h", "12h", "24h")}
 
-    response = (
+    # Для списка нужны только 5 ТС, стоящих дольше всех; при пустой парковке запрос не нужен
+    active_parkings = []
+    if occupied_spots:
+        active_parkings = (await db.scalars(select(Parking).options(
+            selectinload(Parking.user)
+        ).where(Parking.departure_time == None).order_by(Parking.arrival_time).limit(5))).all()
+
+    parts = [
         f"{Emoji.PARKING} Статус парковки\n\n"
         f"📊 Общая статистика:\n"
         f"• Всего мест: {total_spots}\n"
@@ -3570,34 +3666,34 @@ async def process_parking_status(message: Message, db: Session):
         f"• 3-6 часов: {time_stats['6h']}\n"
         f"• 6-12 часов: {time_stats['12h']}\n"
         f"• Более 12 часов: {time_stats['24h']}\n\n"
-        f"🔄 Обновлено: {now.strftime('%H:%M %d.%m.%Y')}"
-    )
+        f"🔄 Обновлено: {format_hm_dmy(now)}"
+    ]
 
     if active_parkings:
-        response += "\n\n🚗 Список припаркованных ТС:\n"
-        for parking in active_parkings[:5]:
+        parts.append("\n\n🚗 Список припаркованных ТС:\n")
+        for parking in active_parkings:
             driver_name = f"{parking.user.first_name} {parking.user.last_name}".strip() or "Водитель"
             duration = now - ensure_timezone_aware(parking.arrival_time)
             hours = int(duration.total_seconds() // 3600)
             minutes = int((duration.total_seconds() % 3600) // 60)
-            response += f"• #{parking.spot_number}: {parking.vehicle_number} ({driver_name}) - {hours}ч {minutes}м\n"
+            parts.append(f"• #{parking.spot_number}: {parking.vehicle_number} ({driver_name}) - {hours}ч {minutes}м\n")
 
-        if len(active_parkings) > 5:
-            response += f"• ... и еще {len(active_parkings) - 5} ТС"
+        if occupied_spots > 5:
+            parts.append(f"• ... и еще {occupied_spots - 5} ТС")
 
-    await message.answer(response)
+    await message.answer("".join(parts))
 
 
-@router.message(F.text == f"{Emoji.REPORT} Отчет")
+@menu_button(f"{Emoji.REPORT} Отчет")
 @with_db
-async def process_operator_report(message: Message, db: Session):
+async def process_operator_report(message: Message, db: AsyncSession):
     """Меню отчетов для оператора"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "OPERATOR" not in get_user_roles(user):
+    if not user.has_role("OPERATOR"):
         await message.answer("❌ Эта функция доступна только операторам.")
         return
 
@@ -3608,59 +3704,50 @@ async def process_operator_report(message: Message, db: Session):
 
 
 @router.callback_query(F.data == "operator_report_tasks")
-@with_db
-async def process_operator_report_tasks(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_operator_report_tasks(callback: CallbackQuery, db: AsyncSession):
     """Отчет по задачам за сегодня"""
     user = await get_user(db, callback.from_user.id)
-    if not user or "OPERATOR" not in get_user_roles(user):
+    if not user or not user.has_role("OPERATOR"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
     now = get_timezone_aware_now()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
 
-    tasks_today = db.query(Task).filter(Task.created_at >= today_start).all()
-
-    completed = len([t for t in tasks_today if t.status == "COMPLETED"])
-    pending = len([t for t in tasks_today if t.status == "PENDING"])
-    in_progress = len([t for t in tasks_today if t.status == "IN_PROGRESS"])
-    stuck = len([t for t in tasks_today if t.status == "STUCK"])
+    # Задачи за сегодня по статусам: считаем на стороне БД
+    status_counts = dict((await db.execute(select(Task.status, func.count(Task.id)).where(
+        Task.created_at >= today_start
+    ).group_by(Task.status))).all())
 
     response = (
         f"📊 Отчет по задачам за сегодня\n\n"
         f"📅 Дата: {now.strftime('%d.%m.%Y')}\n"
         f"⏰ Время: {now.strftime('%H:%M')}\n\n"
         f"📋 Статистика задач:\n"
-        f"{Emoji.COMPLETED} Выполнено: {completed}\n"
-        f"{Emoji.PENDING} Ожидание: {pending}\n"
-        f"{Emoji.IN_PROGRESS} В работе: {in_progress}\n"
-        f"{Emoji.STUCK} Зависло: {stuck}\n"
-        f"📝 Всего: {len(tasks_today)}"
-    )
-
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.BACK} Назад к отчетам",
-        callback_data="back_to_reports_menu"
+        f"{Emoji.COMPLETED} Выполнено: {status_counts.get('COMPLETED', 0)}\n"
+        f"{Emoji.PENDING} Ожидание: {status_counts.get('PENDING', 0)}\n"
+        f"{Emoji.IN_PROGRESS} В работе: {status_counts.get('IN_PROGRESS', 0)}\n"
+        f"{Emoji.STUCK} Зависло: {status_counts.get('STUCK', 0)}\n"
+        f"📝 Всего: {sum(status_counts.values())}"
     )
-    builder.adjust(1)
 
-    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.message.edit_text(response, reply_markup=BACK_TO_REPORTS_MARKUP)
 
 
 @router.callback_query(F.data == "operator_report_parking")
-@with_db
-async def process_operator_report_parking(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_operator_report_parking(callback: CallbackQuery, db: AsyncSession):
     """Отчет по парковке"""
     user = await get_user(db, callback.from_user.id)
-    if not user or "OPERATOR" not in get_user_roles(user):
+    if not user or not user.has_role("OPERATOR"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
     now = get_timezone_aware_now()
     total_spots = config.PARKING_SPOTS
-    active_parkings = db.query(Parking).filter(Parking.departure_time == None).all()
-    occupied_spots = len(active_parkings)
+    # Для отчета нужно только число занятых мест (ix_parking_active)
+    occupied_spots = await db.scalar(select(func.count(Parking.id)).where(Parking.departure_time == None))
 
     response = (
         f"📊 Отчет по парковке\n\n"
@@ -3672,14 +3759,7 @@ async def process_operator_report_parking(callback: CallbackQuery, db: Session):
         f"• Свободно: {total_spots - occupied_spots}"
     )
 
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.BACK} Назад к отчетам",
-        callback_data="back_to_reports_menu"
-    )
-    builder.adjust(1)
-
-    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.message.edit_text(response, reply_markup=BACK_TO_REPORTS_MARKUP)
 
 
 @router.callback_query(F.data == "operator_report_excel")
@@ -3702,13 +3782,13 @@ async def process_back_to_reports_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("report_"))
-@with_db
-async def process_report_selection(callback: CallbackQuery, state: FSMContext, db: Session):
+@with_db(readonly=True)
+async def process_report_selection(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Обработка выбора периода для Excel отчета"""
     period = callback.data.replace("report_", "")
     user = await get_user(db, callback.from_user.id)
 
-    if not user or "OPERATOR" not in get_user_roles(user):
+    if not user or not user.has_role("OPERATOR"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
@@ -3748,24 +3828,20 @@ async def process_report_selection(callback: CallbackQuery, state: FSMContext, d
 
     await callback.message.edit_text(f"📊 Генерация Excel отчета за {period_name}...")
 
-    parkings = db.query(Parking).filter(
-        Parking.arrival_time >= start_date,
-        Parking.arrival_time <= end_date
-    ).order_by(Parking.arrival_time).all()
+    rows = await stream_parking_report_rows(db, start_date, end_date)
+    excel_file, rows_count = await generate_excel_report(rows, period_name)
 
-    if not parkings:
+    if not rows_count:
         await callback.message.edit_text(f"❌ Нет данных за {period_name}.")
         return
 
-    excel_file = await generate_excel_report(parkings, period_name)
-
     await callback.message.answer_document(
         document=BufferedInputFile(
             excel_file.getvalue(),
             filename=f"отчет_парковки_{period_name}.xlsx"
         ),
         caption=f"📊 Excel отчет за {period_name}\n"
-               f"📋 Всего записей: {len(parkings)}"
+               f"📋 Всего записей: {rows_count}"
     )
 
     await callback.message.answer(
@@ -3776,7 +3852,7 @@ async def process_report_selection(callback: CallbackQuery, state: FSMContext, d
 
 @router.message(OperatorStates.waiting_for_report_period)
 @with_db
-async def process_custom_period(message: Message, state: FSMContext, db: Session):
+async def process_custom_period(message: Message, state: FSMContext, db: AsyncSession):
     """Обработка пользовательского периода для отчета"""
     if message.text == f"{Emoji.CANCEL} Отмена":
         await state.clear()
@@ -3788,7 +3864,7 @@ async def process_custom_period(message: Message, state: FSMContext, db: Session
         return
 
     user = await get_user(db, message.from_user.id)
-    if not user or "OPERATOR" not in get_user_roles(user):
+    if not user or not user.has_role("OPERATOR"):
         await message.answer("❌ Доступ запрещен.")
         return
 
@@ -3806,25 +3882,21 @@ async def process_custom_period(message: Message, state: FSMContext, db: Session
             await message.answer("❌ Дата начала не может быть позже даты окончания.")
             return
 
-        parkings = db.query(Parking).filter(
-            Parking.arrival_time >= start_date,
-            Parking.arrival_time <= end_date
-        ).order_by(Parking.arrival_time).all()
+        period_name = f"{dates[0].strip()}_{dates[1].strip()}"
+        rows = await stream_parking_report_rows(db, start_date, end_date)
+        excel_file, rows_count = await generate_excel_report(rows, period_name)
 
-        if not parkings:
+        if not rows_count:
             await message.answer("❌ Нет данных за выбранный период.")
             return
 
-        period_name = f"{dates[0].strip()}_{dates[1].strip()}"
-        excel_file = await generate_excel_report(parkings, period_name)
-
         await message.answer_document(
             document=BufferedInputFile(
                 excel_file.getvalue(),
                 filename=f"отчет_парковки_{period_name}.xlsx"
             ),
             caption=f"📊 Excel отчет за период {dates[0].strip()} - {dates[1].strip()}\n"
-                   f"📋 Всего записей: {len(parkings)}"
+                   f"📋 Всего записей: {rows_count}"
         )
 
         await state.clear()
@@ -3843,40 +3915,39 @@ async def process_custom_period(message: Message, state: FSMContext, db: Session
         )
 
 
-@router.message(F.text == f"{Emoji.STUCK} Зависшие задачи")
-@with_db
-async def process_stuck_tasks(message: Message, db: Session):
+@menu_button(f"{Emoji.STUCK} Зависшие задачи")
+@with_db(readonly=True)
+async def process_stuck_tasks(message: Message, db: AsyncSession):
     """Просмотр зависших задач"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    user_roles = get_user_roles(user)
-    if "OPERATOR" not in user_roles and "ADMIN" not in user_roles:
+    if not user.has_any_role("OPERATOR", "ADMIN"):
         await message.answer("❌ Эта функция доступна только операторам и администраторам.")
         return
 
-    # Получаем все зависшие задачи
-    stuck_tasks = db.query(Task).filter(
+    # Получаем последние 10 зависших задач для показа
+    stuck_tasks = (await db.scalars(select(Task).options(*TASK_LIST_OPTIONS).where(
         Task.status == "STUCK"
     ).order_by(
         Task.priority.desc(),
         Task.created_at.desc()
-    ).all()
+    ).limit(10))).all()
 
     if not stuck_tasks:
         await message.answer(f"{Emoji.INFO} Нет зависших задач.")
         return
 
-    response = f"{Emoji.STUCK} ЗАВИСШИЕ ЗАДАЧИ:\n\n"
+    parts = [f"{Emoji.STUCK} ЗАВИСШИЕ ЗАДАЧИ:\n\n"]
 
     # Сохраняем список задач в состояние для последующего использования
     # Для этого нужно получить FSMContext, но здесь его нет, поэтому будем использовать callback_data
 
     now = get_timezone_aware_now()
 
-    for task in stuck_tasks[:10]:  # Показываем последние 10
+    for task in stuck_tasks:
         created = ensure_timezone_aware(task.created_at)
         wait_time = now - created
         minutes = int(wait_time.total_seconds() / 60)
@@ -3900,7 +3971,7 @@ async def process_stuck_tasks(message: Message, db: Session):
         # Тип ТС
         vehicle_type = "🔗 Перецепной" if task.parking and task.parking.is_hitch else "🚛 Не перецепной"
 
-        response += (
+        parts.append(
             f"🆔 ЗАДАЧА #{task.id}\n"
             f"📌 Причина: {task.stuck_reason or 'Не указана'}\n"
             f"⏰ Зависла: {wait_str} назад\n"
@@ -3910,7 +3981,7 @@ async def process_stuck_tasks(message: Message, db: Session):
             f"👤 Водитель: {driver_info}\n"
             f"📊 Приоритет: {task.priority}\n"
             f"📝 Тип: {vehicle_type}\n"
-            f"⏰ Создана: {created.strftime('%H:%M %d.%m.%Y')}\n"
+            f"⏰ Создана: {format_hm_dmy(created)}\n"
         )
 
         # Добавляем инлайн-кнопки для каждой задачи
@@ -3925,36 +3996,45 @@ async def process_stuck_tasks(message: Message, db: Session):
         )
         builder.adjust(2)
 
-        # Отправляем каждую задачу отдельно с кнопками
+        # Отправляем каждую задачу отдельно с кнопками. Отправка последовательная:
+        # параллельные сообщения в один чат приходят в произвольном порядке,
+        # а список отсортирован по приоритету
         await message.answer(
-            response,
+            "".join(parts),
             reply_markup=builder.as_markup()
         )
-        response = ""  # Сбрасываем для следующей задачи
+        parts.clear()  # Сбрасываем для следующей задачи
 
     # Клавиатура для массовых действий
     builder = InlineKeyboardBuilder()
-    restartable_tasks = [t for t in stuck_tasks if t.parking and t.parking.is_hitch and t.parking.departure_time is None]
-    if restartable_tasks:
+    # Перезапустить можно все зависшие перецепные ТС на парковке, а не только показанные
+    restartable_count = await db.scalar(
+        select(func.count(Task.id)).join(Parking, Task.parking_id == Parking.id).where(
+            Task.status == "STUCK",
+            Parking.is_hitch == True,
+            Parking.departure_time == None
+        )
+    )
+    if restartable_count:
         builder.button(
-            text=f"🔄 Перезапустить все в пул ({len(restartable_tasks)})",
+            text=f"🔄 Перезапустить все в пул ({restartable_count})",
             callback_data="restart_all_stuck"
         )
     builder.button(text=f"{Emoji.BACK} Назад", callback_data="menu_main")
     builder.adjust(1)
 
-    if response:  # Если остался неотправленный текст
-        await message.answer(response[:4000], reply_markup=builder.as_markup())
+    if parts:  # Если остался неотправленный текст
+        await message.answer("".join(parts)[:4000], reply_markup=builder.as_markup())
     else:
         await message.answer("Выберите действие:", reply_markup=builder.as_markup())
 
 @router.callback_query(F.data.startswith("reassign_gate_"))
 @with_db
-async def process_reassign_gate(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_reassign_gate(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Начало процесса переназначения ворот для зависшей задачи"""
     task_id = int(callback.data.replace("reassign_gate_", ""))
 
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=(joinedload(Task.parking),))
     if not task:
         await callback.message.edit_text(f"{Emoji.ERROR} Задача не найдена.")
         return
@@ -3963,17 +4043,10 @@ async def process_reassign_gate(callback: CallbackQuery, state: FSMContext, db:
     await state.update_data(stuck_task_id=task_id)
     await state.set_state(OperatorStates.waiting_for_new_gate_for_stuck_task)
 
-    # Определяем доступные ворота в зависимости от АБК
-    # Здесь нужно определить логику определения АБК для задачи
-    # Например, по номеру ворот или по дополнительному полю
-
-    # Примерная логика определения АБК (можно настроить под ваши нужды)
-    if 1 <= task.gate_number <= 59 or 66 <= task.gate_number <= 83:
-        abk_type = "ABK1"
-        available_gates = "1-59, 66-83"
-    elif 1 <= task.gate_number <= 10:
-        abk_type = "ABK2"
-        available_gates = "1-10"
+    # Определяем АБК и доступные ворота по текущим воротам задачи
+    abk_type = GATE_TO_ABK.get(task.gate_number)
+    if abk_type:
+        available_gates = ABK_INFO[abk_type][1]
     else:
         abk_type = "неизвестно"
         available_gates = "уточните у администратора"
@@ -3992,7 +4065,7 @@ async def process_reassign_gate(callback: CallbackQuery, state: FSMContext, db:
 
 @router.message(OperatorStates.waiting_for_new_gate_for_stuck_task)
 @with_db
-async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, db: Session):
+async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, db: AsyncSession):
     """Обработка ввода нового номера ворот для зависшей задачи"""
     try:
         new_gate_number = int(message.text)
@@ -4013,7 +4086,7 @@ async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, d
         await state.clear()
         return
 
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=(joinedload(Task.parking),))
     operator = await get_user(db, message.from_user.id)
 
     if not task:
@@ -4021,36 +4094,11 @@ async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, d
         await state.clear()
         return
 
-    # Проверяем доступность новых ворот (аналогично проверке при создании задачи)
-    is_valid_gate = False
-    error_message = ""
-
-    # Определяем АБК по старым воротам (можно добавить логику определения)
-    if 1 <= task.gate_number <= 59 or 66 <= task.gate_number <= 83:
-        # АБК-1
-        if 1 <= new_gate_number <= 59 or 66 <= new_gate_number <= 83:
-            is_valid_gate = True
-        else:
-            error_message = (
-                f"{Emoji.ERROR} Для этой задачи доступны ворота АБК-1:\n"
-                f"• с 1 по 59\n"
-                f"• с 66 по 83\n"
-                f"Ворота с 60 по 65 недоступны для использования."
-            )
-    elif 1 <= task.gate_number <= 10:
-        # АБК-2
-        if 1 <= new_gate_number <= 10:
-            is_valid_gate = True
-        else:
-            error_message = (
-                f"{Emoji.ERROR} Для этой задачи доступны только ворота АБК-2 с 1 по 10."
-            )
-    else:
-        # Если не можем определить, разрешаем любые ворота
-        is_valid_gate = True
-
-    if not is_valid_gate:
-        await message.answer(error_message)
+    # Новые ворота должны быть в том же АБК, что и старые.
+    # Если АБК по старым воротам не определить, разрешаем любые ворота
+    old_abk = GATE_TO_ABK.get(task.gate_number)
+    if old_abk and new_gate_number not in ABK_GATES[old_abk]:
+        await message.answer(STUCK_GATE_ERRORS[old_abk])
         return
 
     # Сохраняем старый номер ворот для истории
@@ -4068,18 +4116,17 @@ async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, d
         task.is_in_pool = True
         task.priority += 5  # Повышаем приоритет
 
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        await message.answer(ACTIVE_TASK_CONFLICT_TEXT.format(task_id=task_id))
+        await state.clear()
+        return
 
     # Определяем тип здания для отправки изображения
-    if 1 <= new_gate_number <= 59 or 66 <= new_gate_number <= 83:
-        building_type = "ABK1"
-        abk_name = "АБК-1"
-    elif 1 <= new_gate_number <= 10:
-        building_type = "ABK2"
-        abk_name = "АБК-2"
-    else:
-        building_type = None
-        abk_name = "неизвестно"
+    building_type = GATE_TO_ABK.get(new_gate_number)
+    abk_name = ABK_INFO[building_type][0] if building_type else "неизвестно"
 
     # Уведомляем водителя, если он был назначен
     if task.assigned_driver_id:
@@ -4110,12 +4157,11 @@ async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, d
                     await bot.send_message(driver.telegram_id, notification_text)
 
             except Exception as e:
-                logger.error(f"Ошибка уведомления водителя: {e}")
+                logger.error("Ошибка уведомления водителя: %s", e)
 
     # Уведомляем всех активных водителей перегона, если задача в пуле
     elif task.is_in_pool:
-        from services import get_active_transfer_drivers
-        active_drivers = await get_active_transfer_drivers(db)
+        driver_ids = await get_active_transfer_driver_ids(db)
 
         notification_text = (
             f"{Emoji.TASK_POOL} ЗАДАЧА ПЕРЕНАЗНАЧЕНА В ПУЛЕ!\n\n"
@@ -4130,20 +4176,10 @@ async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, d
             f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
         )
 
-        for driver in active_drivers:
-            try:
-                if building_type:
-                    await send_task_with_image(
-                        driver.telegram_id,
-                        building_type,
-                        new_gate_number,
-                        notification_text
-                    )
-                else:
-                    await bot.send_message(driver.telegram_id, notification_text)
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logger.error(f"Ошибка уведомления водителя {driver.telegram_id}: {e}")
+        if building_type:
+            await broadcast_task_with_image(driver_ids, building_type, new_gate_number, notification_text)
+        else:
+            await broadcast_message(driver_ids, notification_text)
 
     await message.answer(
         f"{Emoji.SUCCESS} ВОРОТА ПЕРЕНАЗНАЧЕНЫ!\n\n"
@@ -4161,11 +4197,11 @@ async def process_new_gate_for_stuck_task(message: Message, state: FSMContext, d
 
 @router.callback_query(F.data.startswith("close_stuck_task_"))
 @with_db
-async def process_close_stuck_task(callback: CallbackQuery, state: FSMContext, db: Session):
+async def process_close_stuck_task(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     """Закрытие зависшей задачи"""
     task_id = int(callback.data.replace("close_stuck_task_", ""))
 
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=TASK_SUMMARY_OPTIONS)
     operator = await get_user(db, callback.from_user.id)
 
     if not task:
@@ -4178,7 +4214,7 @@ async def process_close_stuck_task(callback: CallbackQuery, state: FSMContext, d
     task.driver_id = None
     task.is_in_pool = False
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"{Emoji.SUCCESS} ЗАДАЧА #{task.id} ЗАКРЫТА!\n\n"
@@ -4193,7 +4229,7 @@ async def process_close_stuck_task(callback: CallbackQuery, state: FSMContext, d
 
 @router.callback_query(F.data.startswith("stuck_page_"))
 @with_db
-async def process_stuck_page(callback: CallbackQuery, db: Session):
+async def process_stuck_page(callback: CallbackQuery, db: AsyncSession):
     """Пагинация по зависшим задачам"""
     page = int(callback.data.replace("stuck_page_", ""))
     await show_stuck_tasks_list(callback, db, page)
@@ -4201,24 +4237,28 @@ async def process_stuck_page(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data == "refresh_stuck_tasks")
 @with_db
-async def process_refresh_stuck_tasks(callback: CallbackQuery, db: Session):
+async def process_refresh_stuck_tasks(callback: CallbackQuery, db: AsyncSession):
     """Обновление списка зависших задач"""
     await show_stuck_tasks_list(callback, db, 0)
 
 
 @router.callback_query(F.data == "back_to_stuck_list")
 @with_db
-async def process_back_to_stuck_list(callback: CallbackQuery, db: Session):
+async def process_back_to_stuck_list(callback: CallbackQuery, db: AsyncSession):
     """Возврат к списку зависших задач"""
     await show_stuck_tasks_list(callback, db, 0)
 
 
 @router.callback_query(F.data.startswith("stuck_task_info_"))
-@with_db
-async def process_stuck_task_info(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_stuck_task_info(callback: CallbackQuery, db: AsyncSession):
     """Детальная информация о зависшей задаче"""
     task_id = int(callback.data.replace("stuck_task_info_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=(
+        joinedload(Task.parking),
+        selectinload(Task.driver),
+        selectinload(Task.operator)
+    ))
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -4235,7 +4275,7 @@ async def process_stuck_task_info(callback: CallbackQuery, db: Session):
         f"📍 Место: #{task.parking.spot_number if task.parking else '?'}\n"
         f"🚪 Ворота: #{task.gate_number}\n"
         f"📌 Причина: {task.stuck_reason or 'Не указана'}\n"
-        f"⏰ Создана: {created.strftime('%H:%M %d.%m.%Y')}\n"
+        f"⏰ Создана: {format_hm_dmy(created)}\n"
         f"⏱️ В ожидании: {format_duration(int(wait_time.total_seconds()))}\n"
         f"📊 Приоритет: {task.priority}\n"
         f"📝 Тип: {'Перецепной' if task.parking and task.parking.is_hitch else 'Не перецепной'}\n\n"
@@ -4255,10 +4295,10 @@ async def process_stuck_task_info(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data.startswith("restart_task_"))
 @with_db
-async def process_restart_stuck_task(callback: CallbackQuery, db: Session):
+async def process_restart_stuck_task(callback: CallbackQuery, db: AsyncSession):
     """Перезапуск зависшей задачи"""
     task_id = int(callback.data.replace("restart_task_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id, options=(joinedload(Task.parking),))
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -4272,7 +4312,12 @@ async def process_restart_stuck_task(callback: CallbackQuery, db: Session):
     task.is_in_pool = True  # Возвращаем в пул
     task.priority = min(task.priority + 3, 20)  # Повышаем приоритет
 
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        await callback.message.edit_text(ACTIVE_TASK_CONFLICT_TEXT.format(task_id=task_id))
+        return
 
     await callback.message.edit_text(
         f"✅ Задача #{task.id} перезапущена!\n\n"
@@ -4285,20 +4330,15 @@ async def process_restart_stuck_task(callback: CallbackQuery, db: Session):
 
     # Уведомляем активных водителей перегона
     if task.parking and task.parking.is_hitch:
-        active_drivers = await get_active_transfer_drivers(db)
-        for driver in active_drivers:
-            try:
-                await bot.send_message(
-                    driver.telegram_id,
-                    f"{Emoji.TASK_POOL} ПЕРЕЗАПУЩЕНА ЗАДАЧА #{task.id}!\n\n"
-                    f"📍 Место: #{task.parking.spot_number}\n"
-                    f"🚗 ТС: {task.parking.vehicle_number}\n"
-                    f"🚪 Ворота: #{task.gate_number}\n"
-                    f"📊 Приоритет: {task.priority}\n\n"
-                    f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка уведомления водителя: {e}")
+        await broadcast_message(
+            await get_active_transfer_driver_ids(db),
+            f"{Emoji.TASK_POOL} ПЕРЕЗАПУЩЕНА ЗАДАЧА #{task.id}!\n\n"
+            f"📍 Место: #{task.parking.spot_number}\n"
+            f"🚗 ТС: {task.parking.vehicle_number}\n"
+            f"🚪 Ворота: #{task.gate_number}\n"
+            f"📊 Приоритет: {task.priority}\n\n"
+            f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
+        )
 
     # Возвращаемся к списку
     await show_stuck_tasks_list(callback, db, 0)
@@ -4306,13 +4346,25 @@ async def process_restart_stuck_task(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data == "restart_all_hitch_stuck")
 @with_db
-async def process_restart_all_hitch_stuck(callback: CallbackQuery, db: Session):
+async def process_restart_all_hitch_stuck(callback: CallbackQuery, db: AsyncSession):
     """Перезапуск всех перецепных зависших задач"""
-    stuck_tasks = db.query(Task).join(Parking).filter(
+    # Как и при перезапуске пула: по последней зависшей задаче ТС и только
+    # если у ТС нет другой активной задачи (ux_task_parking_active)
+    other_task = aliased(Task)
+    last_stuck_ids = select(func.max(other_task.id)).where(
+        other_task.status == "STUCK"
+    ).group_by(other_task.parking_id)
+    has_other_active_task = exists().where(
+        other_task.parking_id == Task.parking_id,
+        other_task.status.in_(["PENDING", "IN_PROGRESS"])
+    )
+    stuck_tasks = (await db.scalars(select(Task).join(Parking).options(contains_eager(Task.parking)).where(
         Task.status == "STUCK",
         Parking.is_hitch == True,
-        Parking.departure_time == None
-    ).all()
+        Parking.departure_time == None,
+        Task.id.in_(last_stuck_ids),
+        ~has_other_active_task
+    ))).all()
 
     count = 0
     for task in stuck_tasks:
@@ -4324,7 +4376,16 @@ async def process_restart_all_hitch_stuck(callback: CallbackQuery, db: Session):
         task.priority += 3
         count += 1
 
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Оператор успел создать задачу для одного из ТС: повторите перезапуск
+        await db.rollback()
+        await callback.message.edit_text(
+            f"{Emoji.WARNING} Для одного из ТС только что создана активная задача.\n\n"
+            f"Перезапуск не выполнен, повторите действие."
+        )
+        return
 
     await callback.message.edit_text(
         f"✅ Перезапущено {count} перецепных задач!\n\n"
@@ -4333,17 +4394,12 @@ async def process_restart_all_hitch_stuck(callback: CallbackQuery, db: Session):
 
     # Уведомляем активных водителей
     if count > 0:
-        active_drivers = await get_active_transfer_drivers(db)
-        for driver in active_drivers:
-            try:
-                await bot.send_message(
-                    driver.telegram_id,
-                    f"{Emoji.TASK_POOL} ПЕРЕЗАПУЩЕНО {count} ЗАДАЧ!\n\n"
-                    f"В пуле появились новые задачи с повышенным приоритетом.\n"
-                    f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка уведомления водителя: {e}")
+        await broadcast_message(
+            await get_active_transfer_driver_ids(db),
+            f"{Emoji.TASK_POOL} ПЕРЕЗАПУЩЕНО {count} ЗАДАЧ!\n\n"
+            f"В пуле появились новые задачи с повышенным приоритетом.\n"
+            f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
+        )
 
     # Возвращаемся к списку
     await show_stuck_tasks_list(callback, db, 0)
@@ -4351,10 +4407,10 @@ async def process_restart_all_hitch_stuck(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data.startswith("reassign_task_"))
 @with_db
-async def process_reassign_task(callback: CallbackQuery, db: Session, state: FSMContext):
+async def process_reassign_task(callback: CallbackQuery, db: AsyncSession, state: FSMContext):
     """Назначение задачи другому водителю"""
     task_id = int(callback.data.replace("reassign_task_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -4367,17 +4423,26 @@ async def process_reassign_task(callback: CallbackQuery, db: Session, state: FSM
     active_drivers = await get_active_transfer_drivers(db)
 
     if not active_drivers:
-        await callback.message.edit_text(
-            "❌ Нет активных водителей перегона для назначения.\n\n"
-            "Задача будет возвращена в пул."
-        )
         # Возвращаем в пул
         task.status = "PENDING"
         task.driver_id = None
         task.is_stuck = False
         task.stuck_reason = None
         task.is_in_pool = True
-        db.commit()
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            await callback.message.edit_text(
+                "❌ Нет активных водителей перегона для назначения.\n\n"
+                + ACTIVE_TASK_CONFLICT_TEXT.format(task_id=task_id)
+            )
+            return
+
+        await callback.message.edit_text(
+            "❌ Нет активных водителей перегона для назначения.\n\n"
+            "Задача возвращена в пул."
+        )
         return
 
     builder = InlineKeyboardBuilder()
@@ -4402,14 +4467,14 @@ async def process_reassign_task(callback: CallbackQuery, db: Session, state: FSM
 
 @router.callback_query(F.data.startswith("assign_to_driver_"))
 @with_db
-async def process_assign_to_driver(callback: CallbackQuery, db: Session):
+async def process_assign_to_driver(callback: CallbackQuery, db: AsyncSession):
     """Назначение задачи выбранному водителю"""
     parts = callback.data.replace("assign_to_driver_", "").split("_")
     driver_id = int(parts[0])
     task_id = int(parts[1])
 
-    task = db.query(Task).filter(Task.id == task_id).first()
-    driver = db.query(User).filter(User.id == driver_id).first()
+    task = await db.get(Task, task_id, options=TASK_SUMMARY_OPTIONS)
+    driver = await db.get(User, driver_id)
 
     if not task or not driver:
         await callback.message.edit_text("❌ Задача или водитель не найдены.")
@@ -4423,7 +4488,12 @@ async def process_assign_to_driver(callback: CallbackQuery, db: Session):
     task.stuck_reason = None
     task.is_in_pool = False
 
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        await callback.message.edit_text(ACTIVE_TASK_CONFLICT_TEXT.format(task_id=task_id))
+        return
 
     # Уведомляем водителя
     try:
@@ -4436,7 +4506,7 @@ async def process_assign_to_driver(callback: CallbackQuery, db: Session):
             f'Используйте кнопку "{Emoji.GATE} Встать на ворота".'
         )
     except Exception as e:
-        logger.error(f"Ошибка уведомления водителя: {e}")
+        logger.error("Ошибка уведомления водителя: %s", e)
 
     await callback.message.edit_text(
         f"✅ Задача #{task.id} назначена водителю {driver.first_name} {driver.last_name}!"
@@ -4445,10 +4515,10 @@ async def process_assign_to_driver(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data.startswith("mark_breakdown_"))
 @with_db
-async def process_mark_breakdown(callback: CallbackQuery, db: Session):
+async def process_mark_breakdown(callback: CallbackQuery, db: AsyncSession):
     """Отметить задачу как поломку ТС"""
     task_id = int(callback.data.replace("mark_breakdown_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -4458,7 +4528,7 @@ async def process_mark_breakdown(callback: CallbackQuery, db: Session):
     task.is_in_pool = False  # Не возвращаем в пул
     # Статус оставляем STUCK
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"🔧 Задача #{task.id} отмечена как ПОЛОМКА ТС.\n\n"
@@ -4474,15 +4544,15 @@ async def process_mark_breakdown(callback: CallbackQuery, db: Session):
                 f"Задача закрыта. Вы можете взять новую задачу."
             )
         except Exception as e:
-            logger.error(f"Ошибка уведомления водителя: {e}")
+            logger.error("Ошибка уведомления водителя: %s", e)
 
 
 @router.callback_query(F.data.startswith("close_stuck_task_"))
 @with_db
-async def process_close_stuck_task(callback: CallbackQuery, db: Session):
+async def process_close_stuck_task(callback: CallbackQuery, db: AsyncSession):
     """Закрыть зависшую задачу"""
     task_id = int(callback.data.replace("close_stuck_task_", ""))
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
 
     if not task:
         await callback.message.edit_text("❌ Задача не найдена.")
@@ -4493,7 +4563,7 @@ async def process_close_stuck_task(callback: CallbackQuery, db: Session):
     task.stuck_reason = "Закрыта оператором"
     task.is_in_pool = False
 
-    db.commit()
+    await db.commit()
 
     await callback.message.edit_text(
         f"❌ Задача #{task.id} закрыта оператором."
@@ -4504,16 +4574,16 @@ async def process_close_stuck_task(callback: CallbackQuery, db: Session):
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ МЕНЮ СТАТУСОВ ====================
 
-@router.message(F.text == f"{Emoji.STATUS} Статусы")
+@menu_button(f"{Emoji.STATUS} Статусы")
 @with_db
-async def process_statuses_menu(message: Message, db: Session):
+async def process_statuses_menu(message: Message, db: AsyncSession):
     """Меню статусов для оператора"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer(f"{Emoji.ERROR} Сначала используйте /start для регистрации.")
         return
 
-    if "OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user):
+    if not user.has_any_role("OPERATOR", "ADMIN"):
         await message.answer(f"{Emoji.ERROR} Доступ запрещен.")
         return
 
@@ -4529,26 +4599,23 @@ async def process_statuses_menu(message: Message, db: Session):
 
 
 @router.callback_query(F.data == "status_tasks")
-@with_db
-async def process_status_tasks(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_status_tasks(callback: CallbackQuery, db: AsyncSession):
     """Статус задач за текущую смену"""
     user = await get_user(db, callback.from_user.id)
-    if not user or ("OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user)):
+    if not user or not user.has_any_role("OPERATOR", "ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
     start_time, end_time, period_name = get_current_shift_period()
 
     # Получаем задачи за текущую смену (без выполненных)
-    tasks = get_tasks_for_current_shift(db, include_completed=False)
+    tasks = await get_tasks_for_current_shift(db, include_completed=False, options=TASK_LIST_OPTIONS)
 
     if not tasks:
         await callback.message.edit_text(
             f"{Emoji.INFO} Нет активных задач за {period_name}.",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_statuses"
-            ).as_markup()
+            reply_markup=BACK_TO_STATUSES_MARKUP
         )
         return
 
@@ -4570,10 +4637,11 @@ async def process_status_tasks(callback: CallbackQuery, db: Session):
 
     if in_progress:
         response += f"{Emoji.IN_PROGRESS} ЗАДАЧИ В РАБОТЕ:\n"
+        now = get_timezone_aware_now()
         for task in in_progress[:5]:
             driver_name = f"{task.driver.first_name} {task.driver.last_name}".strip() if task.driver else "Не назначен"
             started = ensure_timezone_aware(task.started_at) if task.started_at else task.created_at
-            duration = get_timezone_aware_now() - started
+            duration = now - started
             minutes = int(duration.total_seconds() / 60)
             response += (
                 f"• Задача #{task.id}: {task.parking.vehicle_number}\n"
@@ -4596,27 +4664,22 @@ async def process_status_tasks(callback: CallbackQuery, db: Session):
         if len(stuck) > 3:
             response += f"  ... и еще {len(stuck) - 3}\n"
 
-    builder = InlineKeyboardBuilder()
-    builder.button(text=f"{Emoji.BACK} Назад", callback_data="back_to_statuses")
-    builder.button(text=f"{Emoji.UPDATE} Обновить", callback_data="status_tasks")
-    builder.adjust(2)
-
-    await callback.message.edit_text(response[:4000], reply_markup=builder.as_markup())
+    await callback.message.edit_text(response[:4000], reply_markup=STATUS_TASKS_MARKUP)
 
 
 @router.callback_query(F.data == "status_parking")
-@with_db
-async def process_status_parking(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_status_parking(callback: CallbackQuery, db: AsyncSession):
     """Статус парковки за текущую смену"""
     user = await get_user(db, callback.from_user.id)
-    if not user or ("OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user)):
+    if not user or not user.has_any_role("OPERATOR", "ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
     start_time, end_time, period_name = get_current_shift_period()
 
     # Получаем записи парковки за смену
-    parkings = get_parking_for_current_shift(db)
+    parkings = await get_parking_for_current_shift(db, options=(selectinload(Parking.user),))
 
     total_spots = config.PARKING_SPOTS
     active_parkings = [p for p in parkings if p.departure_time is None]
@@ -4636,36 +4699,32 @@ async def process_status_parking(callback: CallbackQuery, db: Session):
 
     if active_parkings:
         response += f"🚗 ТЕКУЩИЕ НА ПАРКОВКЕ:\n"
+        now = get_timezone_aware_now()
         for parking in active_parkings[:5]:
             driver_name = f"{parking.user.first_name} {parking.user.last_name}".strip() or "Водитель"
-            duration = get_timezone_aware_now() - ensure_timezone_aware(parking.arrival_time)
+            duration = now - ensure_timezone_aware(parking.arrival_time)
             hours = int(duration.total_seconds() / 3600)
             minutes = int((duration.total_seconds() % 3600) / 60)
             response += f"• #{parking.spot_number}: {parking.vehicle_number} ({driver_name}) - {hours}ч {minutes}м\n"
         if len(active_parkings) > 5:
             response += f"  ... и еще {len(active_parkings) - 5}\n"
 
-    builder = InlineKeyboardBuilder()
-    builder.button(text=f"{Emoji.BACK} Назад", callback_data="back_to_statuses")
-    builder.button(text=f"{Emoji.UPDATE} Обновить", callback_data="status_parking")
-    builder.adjust(2)
-
-    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.message.edit_text(response, reply_markup=STATUS_PARKING_MARKUP)
 
 
 @router.callback_query(F.data == "status_queue")
-@with_db
-async def process_status_queue(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_status_queue(callback: CallbackQuery, db: AsyncSession):
     """Статус очереди за текущую смену"""
     user = await get_user(db, callback.from_user.id)
-    if not user or ("OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user)):
+    if not user or not user.has_any_role("OPERATOR", "ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
     start_time, end_time, period_name = get_current_shift_period()
 
     # Получаем записи очереди за смену
-    queue_items = get_queue_for_current_shift(db)
+    queue_items = await get_queue_for_current_shift(db)
 
     waiting = [q for q in queue_items if q.status == "waiting"]
     notified = [q for q in queue_items if q.status == "notified"]
@@ -4684,46 +4743,39 @@ async def process_status_queue(callback: CallbackQuery, db: Session):
 
     if waiting:
         response += f"{Emoji.WAITING} ТЕКУЩАЯ ОЧЕРЕДЬ:\n"
+        now = get_timezone_aware_now()
         for i, item in enumerate(waiting[:10], 1):
-            wait_time = get_timezone_aware_now() - ensure_timezone_aware(item.created_at)
+            wait_time = now - ensure_timezone_aware(item.created_at)
             minutes = int(wait_time.total_seconds() / 60)
             response += f"{i}. {item.vehicle_number} ({minutes} мин)\n"
         if len(waiting) > 10:
             response += f"  ... и еще {len(waiting) - 10}\n"
 
-    builder = InlineKeyboardBuilder()
-    builder.button(text=f"{Emoji.BACK} Назад", callback_data="back_to_statuses")
-    builder.button(text=f"{Emoji.UPDATE} Обновить", callback_data="status_queue")
-    builder.adjust(2)
-
-    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.message.edit_text(response, reply_markup=STATUS_QUEUE_MARKUP)
 
 
 @router.callback_query(F.data == "status_stuck")
-@with_db
-async def process_status_stuck(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_status_stuck(callback: CallbackQuery, db: AsyncSession):
     """Зависшие задачи за текущую смену (в меню статусов)"""
     user = await get_user(db, callback.from_user.id)
-    if not user or ("OPERATOR" not in get_user_roles(user) and "ADMIN" not in get_user_roles(user)):
+    if not user or not user.has_any_role("OPERATOR", "ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
     start_time, end_time, period_name = get_current_shift_period()
 
     # Показываем краткую статистику, но предлагаем перейти в управление
-    stuck_tasks = db.query(Task).filter(
+    stuck_tasks = (await db.scalars(select(Task).where(
         Task.status == "STUCK",
         Task.created_at >= start_time,
         Task.created_at <= end_time
-    ).order_by(Task.priority.desc(), Task.created_at.desc()).all()
+    ).order_by(Task.priority.desc(), Task.created_at.desc()))).all()
 
     if not stuck_tasks:
         await callback.message.edit_text(
             f"{Emoji.SUCCESS} Зависших задач за {period_name} нет!",
-            reply_markup=InlineKeyboardBuilder().button(
-                text=f"{Emoji.BACK} Назад",
-                callback_data="back_to_statuses"
-            ).as_markup()
+            reply_markup=BACK_TO_STATUSES_MARKUP
         )
         return
 
@@ -4744,30 +4796,19 @@ async def process_status_stuck(callback: CallbackQuery, db: Session):
         f"🔧 Поломка: {breakdown}\n"
     )
 
-    builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"{Emoji.STUCK} Управление зависшими",
-        callback_data="manage_stuck_tasks"
-    )
-    builder.button(
-        text=f"{Emoji.BACK} Назад",
-        callback_data="back_to_statuses"
-    )
-    builder.adjust(1)
-
-    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.message.edit_text(response, reply_markup=STUCK_SUMMARY_MARKUP)
 
 
 @router.callback_query(F.data == "manage_stuck_tasks")
 @with_db
-async def process_manage_stuck_tasks(callback: CallbackQuery, db: Session):
+async def process_manage_stuck_tasks(callback: CallbackQuery, db: AsyncSession):
     """Переход в режим управления зависшими задачами"""
     await show_stuck_tasks_list(callback, db, 0)
 
 
 @router.callback_query(F.data == "status_shift_info")
-@with_db
-async def process_status_shift_info(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_status_shift_info(callback: CallbackQuery, db: AsyncSession):
     """Информация о текущей смене"""
     user = await get_user(db, callback.from_user.id)
 
@@ -4775,9 +4816,9 @@ async def process_status_shift_info(callback: CallbackQuery, db: Session):
     now = get_timezone_aware_now()
 
     # Общая статистика за смену
-    tasks = get_tasks_for_current_shift(db, include_completed=True)
-    parkings = get_parking_for_current_shift(db)
-    queue_items = get_queue_for_current_shift(db)
+    tasks = await get_tasks_for_current_shift(db, include_completed=True)
+    parkings = await get_parking_for_current_shift(db)
+    queue_items = await get_queue_for_current_shift(db)
 
     completed_tasks = [t for t in tasks if t.status == "COMPLETED"]
     stuck_tasks = [t for t in tasks if t.status == "STUCK"]
@@ -4786,7 +4827,7 @@ async def process_status_shift_info(callback: CallbackQuery, db: Session):
         f"{Emoji.INFO} ИНФОРМАЦИЯ О СМЕНЕ\n\n"
         f"📅 Текущий период: {period_name}\n"
         f"⏰ Период: {start_time.strftime('%H:%M %d.%m')} - {end_time.strftime('%H:%M %d.%m')}\n"
-        f"⏱️ Текущее время: {now.strftime('%H:%M %d.%m.%Y')}\n\n"
+        f"⏱️ Текущее время: {format_hm_dmy(now)}\n\n"
         f"📊 СТАТИСТИКА ЗА СМЕНУ:\n"
         f"• Задач создано: {len(tasks)}\n"
         f"  {Emoji.COMPLETED} Выполнено: {len(completed_tasks)}\n"
@@ -4797,16 +4838,12 @@ async def process_status_shift_info(callback: CallbackQuery, db: Session):
         f"• Очередь: {len([q for q in queue_items if q.status == 'waiting'])} в ожидании\n"
     )
 
-    builder = InlineKeyboardBuilder()
-    builder.button(text=f"{Emoji.BACK} Назад", callback_data="back_to_statuses")
-    builder.adjust(1)
-
-    await callback.message.edit_text(response, reply_markup=builder.as_markup())
+    await callback.message.edit_text(response, reply_markup=BACK_TO_STATUSES_MARKUP)
 
 
 @router.callback_query(F.data == "back_to_statuses")
 @with_db
-async def process_back_to_statuses(callback: CallbackQuery, db: Session):
+async def process_back_to_statuses(callback: CallbackQuery, db: AsyncSession):
     """Возврат в меню статусов"""
     user = await get_user(db, callback.from_user.id)
     start_time, end_time, period_name = get_current_shift_period()
@@ -4820,18 +4857,18 @@ async def process_back_to_statuses(callback: CallbackQuery, db: Session):
     )
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ АДМИНИСТРАТОРОВ ====================
-@router.message(F.text == f"{Emoji.SETTINGS} Выдать роли")
+@menu_button(f"{Emoji.SETTINGS} Выдать роли")
 @with_db
-async def process_grant_roles(message: Message, db: Session):
+async def process_grant_roles(message: Message, db: AsyncSession):
     """Просмотр и выдача ролей администратором"""
     user = await get_user(db, message.from_user.id)
-    if not user or "ADMIN" not in get_user_roles(user):
+    if not user or not user.has_role("ADMIN"):
         await message.answer("❌ Доступ запрещен.")
         return
 
-    requests = db.query(RoleRequest).filter(
+    requests = (await db.scalars(select(RoleRequest).where(
         RoleRequest.status == "ожидает"
-    ).order_by(RoleRequest.created_at).all()
+    ).order_by(RoleRequest.created_at))).all()
 
     if not requests:
         await message.answer(f"{Emoji.INFO} Нет запросов на выдачу ролей.")
@@ -4842,17 +4879,11 @@ async def process_grant_roles(message: Message, db: Session):
         requests_by_role.setdefault(req.requested_role, []).append(req)
 
     builder = InlineKeyboardBuilder()
-    role_names = {
-        "OPERATOR": f"{Emoji.OPERATOR} Оператор",
-        "DRIVER_TRANSFER": f"{Emoji.DRIVER_TRANSFER} Водитель перегона",
-        "ADMIN": f"{Emoji.ADMIN} Администратор",
-        "DEB_EMPLOYEE": f"{Emoji.DEB} Сотрудник ДЭБ"
-    }
 
     for role, role_requests in requests_by_role.items():
-        if role in role_names:
+        if role in ROLE_DISPLAY_NAMES_WITH_EMOJI:
             builder.button(
-                text=f"{role_names[role]} ({len(role_requests)})",
+                text=f"{ROLE_DISPLAY_NAMES_WITH_EMOJI[role]} ({len(role_requests)})",
                 callback_data=f"show_requests_{role}"
             )
 
@@ -4874,29 +4905,22 @@ async def process_grant_roles(message: Message, db: Session):
 
 
 @router.callback_query(F.data == "show_all_requests")
-@with_db
-async def process_show_all_requests(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_show_all_requests(callback: CallbackQuery, db: AsyncSession):
     """Показать все запросы на роли"""
     admin = await get_user(db, callback.from_user.id)
-    if not admin or "ADMIN" not in get_user_roles(admin):
+    if not admin or not admin.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
-    requests = db.query(RoleRequest).filter(
+    requests = (await db.scalars(select(RoleRequest).options(joinedload(RoleRequest.user)).where(
         RoleRequest.status == "ожидает"
-    ).order_by(RoleRequest.created_at).all()
+    ).order_by(RoleRequest.created_at))).all()
 
     if not requests:
         await callback.message.edit_text(f"{Emoji.INFO} Нет запросов на выдачу ролей.")
         return
 
-    role_names = {
-        "OPERATOR": "Оператор",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-
     response = "📋 Все запросы на роли:\n\n"
     builder = InlineKeyboardBuilder()
 
@@ -4907,11 +4931,11 @@ async def process_show_all_requests(callback: CallbackQuery, db: Session):
 
         response += (
             f"{i}. {full_name}\n"
-            f"   📝 Роль: {role_names.get(req.requested_role, req.requested_role)}\n"
+            f"   📝 Роль: {ROLE_DISPLAY_NAMES.get(req.requested_role, req.requested_role)}\n"
             f"   💼 Должность: {req.position or 'Не указана'}\n"
             f"   👤 @{req.user.username or 'нет'}\n"
             f"   🆔 {req.user.telegram_id}\n"
-            f"   ⏰ {req.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"   ⏰ {format_dt(req.created_at)}\n\n"
         )
 
         builder.button(
@@ -4933,33 +4957,26 @@ async def process_show_all_requests(callback: CallbackQuery, db: Session):
 
 
 @router.callback_query(F.data.startswith("show_requests_"))
-@with_db
-async def process_show_requests(callback: CallbackQuery, db: Session):
+@with_db(readonly=True)
+async def process_show_requests(callback: CallbackQuery, db: AsyncSession):
     """Показать запросы на конкретную роль"""
     role_str = callback.data.replace("show_requests_", "")
     admin = await get_user(db, callback.from_user.id)
 
-    if not admin or "ADMIN" not in get_user_roles(admin):
+    if not admin or not admin.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
-    requests = db.query(RoleRequest).filter(
+    requests = (await db.scalars(select(RoleRequest).options(joinedload(RoleRequest.user)).where(
         RoleRequest.requested_role == role_str,
         RoleRequest.status == "ожидает"
-    ).order_by(RoleRequest.created_at).all()
+    ).order_by(RoleRequest.created_at))).all()
 
     if not requests:
         await callback.message.edit_text(f"✅ Нет запросов на роль '{role_str}'.")
         return
 
-    role_names = {
-        "OPERATOR": "Оператор",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-
-    response = f"📋 Запросы на роль '{role_names.get(role_str, role_str)}':\n\n"
+    response = f"📋 Запросы на роль '{ROLE_DISPLAY_NAMES.get(role_str, role_str)}':\n\n"
     builder = InlineKeyboardBuilder()
 
     for i, req in enumerate(requests, 1):
@@ -4972,7 +4989,7 @@ async def process_show_requests(callback: CallbackQuery, db: Session):
             f"   💼 {req.position or 'Не указана'}\n"
             f"   👤 @{req.user.username or 'нет'}\n"
             f"   🆔 {req.user.telegram_id}\n"
-            f"   ⏰ {req.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"   ⏰ {format_dt(req.created_at)}\n\n"
         )
 
         builder.button(
@@ -4995,7 +5012,7 @@ async def process_show_requests(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data.startswith("grant_"))
 @with_db
-async def process_grant_request(callback: CallbackQuery, db: Session):
+async def process_grant_request(callback: CallbackQuery, db: AsyncSession):
     """Выдача роли пользователю"""
     callback_data = callback.data.replace("grant_", "")
     last_underscore = callback_data.rfind('_')
@@ -5008,7 +5025,7 @@ async def process_grant_request(callback: CallbackQuery, db: Session):
     target_id = int(callback_data[last_underscore + 1:])
 
     admin = await get_user(db, callback.from_user.id)
-    if not admin or "ADMIN" not in get_user_roles(admin):
+    if not admin or not admin.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
@@ -5017,38 +5034,34 @@ async def process_grant_request(callback: CallbackQuery, db: Session):
         await callback.message.edit_text("❌ Пользователь не найден.")
         return
 
-    role_model = db.query(RoleModel).filter(RoleModel.name == role_str).first()
+    role_model = await db.scalar(select(RoleModel).where(RoleModel.name == role_str).limit(1))
     if not role_model:
         await callback.message.edit_text("❌ Роль не найдена.")
         return
 
-    user_roles = get_user_roles(target_user)
-    if role_str in user_roles:
+    if target_user.has_role(role_str):
         await callback.message.edit_text("❌ У пользователя уже есть эта роль.")
         return
 
     target_user.roles.append(role_model)
 
-    request = db.query(RoleRequest).filter(
+    request = await db.scalar(select(RoleRequest).where(
         RoleRequest.user_id == target_user.id,
         RoleRequest.requested_role == role_str,
         RoleRequest.status == "ожидает"
-    ).first()
+    ).limit(1))
 
+    now = get_timezone_aware_now()
     if request:
         request.status = "approved"
-        request.processed_at = get_timezone_aware_now()
+        request.processed_at = now
         request.processed_by = admin.telegram_id
 
-    db.commit()
+    await db.commit()
+    if role_str in ("ADMIN", "OPERATOR"):
+        invalidate_role_rosters_cache()
 
-    role_names = {
-        "OPERATOR": "Оператор",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-    role_name = role_names.get(role_str, role_str)
+    role_name = ROLE_DISPLAY_NAMES.get(role_str, role_str)
 
     try:
         await bot.send_message(
@@ -5057,11 +5070,11 @@ async def process_grant_request(callback: CallbackQuery, db: Session):
             f"📋 Информация:\n"
             f"👤 Администратор: {admin.first_name} {admin.last_name}\n"
             f"📝 Выдана роль: {role_name}\n"
-            f"⏰ Время: {get_timezone_aware_now().strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"⏰ Время: {format_dt(now)}\n\n"
             f"Используйте /start для обновления меню."
         )
     except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя: {e}")
+        logger.error("Ошибка уведомления пользователя: %s", e)
 
     await callback.message.edit_text(
         f"✅ Роль '{role_name}' выдана пользователю "
@@ -5071,7 +5084,7 @@ async def process_grant_request(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data.startswith("reject_"))
 @with_db
-async def process_reject_request(callback: CallbackQuery, db: Session):
+async def process_reject_request(callback: CallbackQuery, db: AsyncSession):
     """Отклонение запроса на роль"""
     callback_data = callback.data.replace("reject_", "")
     last_underscore = callback_data.rfind('_')
@@ -5084,7 +5097,7 @@ async def process_reject_request(callback: CallbackQuery, db: Session):
     target_id = int(callback_data[last_underscore + 1:])
 
     admin = await get_user(db, callback.from_user.id)
-    if not admin or "ADMIN" not in get_user_roles(admin):
+    if not admin or not admin.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
@@ -5093,25 +5106,20 @@ async def process_reject_request(callback: CallbackQuery, db: Session):
         await callback.message.edit_text("❌ Пользователь не найден.")
         return
 
-    request = db.query(RoleRequest).filter(
+    request = await db.scalar(select(RoleRequest).where(
         RoleRequest.user_id == target_user.id,
         RoleRequest.requested_role == role_str,
         RoleRequest.status == "ожидает"
-    ).first()
+    ).limit(1))
 
+    now = get_timezone_aware_now()
     if request:
         request.status = "rejected"
-        request.processed_at = get_timezone_aware_now()
+        request.processed_at = now
         request.processed_by = admin.telegram_id
-        db.commit()
+        await db.commit()
 
-    role_names = {
-        "OPERATOR": "Оператор",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-    role_name = role_names.get(role_str, role_str)
+    role_name = ROLE_DISPLAY_NAMES.get(role_str, role_str)
 
     try:
         await bot.send_message(
@@ -5120,11 +5128,11 @@ async def process_reject_request(callback: CallbackQuery, db: Session):
             f"📋 Информация:\n"
             f"👤 Администратор: {admin.first_name} {admin.last_name}\n"
             f"📝 Запрошенная роль: {role_name}\n"
-            f"⏰ Время: {get_timezone_aware_now().strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"⏰ Время: {format_dt(now)}\n\n"
             f"Вы можете повторно запросить роль через меню бота."
         )
     except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя: {e}")
+        logger.error("Ошибка уведомления пользователя: %s", e)
 
     await callback.message.edit_text(
         f"❌ Запрос на роль '{role_name}' отклонен для пользователя "
@@ -5132,16 +5140,16 @@ async def process_reject_request(callback: CallbackQuery, db: Session):
     )
 
 
-@router.message(F.text == f"{Emoji.SETTINGS} Забрать роли")
+@menu_button(f"{Emoji.SETTINGS} Забрать роли")
 @with_db
-async def process_revoke_roles(message: Message, db: Session):
+async def process_revoke_roles(message: Message, db: AsyncSession):
     """Управление отзывом ролей"""
     user = await get_user(db, message.from_user.id)
-    if not user or "ADMIN" not in get_user_roles(user):
+    if not user or not user.has_role("ADMIN"):
         await message.answer("❌ Доступ запрещен.")
         return
 
-    users_with_roles = db.query(User).filter(User.roles.any()).all()
+    users_with_roles = (await db.scalars(select(User).where(User.roles.any()))).all()
     if not users_with_roles:
         await message.answer(f"{Emoji.INFO} В системе нет пользователей с ролями.")
         return
@@ -5171,12 +5179,12 @@ async def process_revoke_roles(message: Message, db: Session):
 
 @router.callback_query(F.data.startswith("show_user_roles_"))
 @with_db
-async def process_show_user_roles(callback: CallbackQuery, db: Session):
+async def process_show_user_roles(callback: CallbackQuery, db: AsyncSession):
     """Показать роли пользователя для отзыва"""
     target_id = int(callback.data.replace("show_user_roles_", ""))
     admin = await get_user(db, callback.from_user.id)
 
-    if not admin or "ADMIN" not in get_user_roles(admin):
+    if not admin or not admin.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
@@ -5190,14 +5198,6 @@ async def process_show_user_roles(callback: CallbackQuery, db: Session):
         await callback.message.edit_text("❌ У пользователя нет ролей.")
         return
 
-    role_names = {
-        "DRIVER": "Водитель",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "OPERATOR": "Оператор",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ"
-    }
-
     response = (
         f"👤 Пользователь: {target_user.first_name} {target_user.last_name}\n"
         f"🆔 ID: {target_user.telegram_id}\n"
@@ -5207,7 +5207,7 @@ async def process_show_user_roles(callback: CallbackQuery, db: Session):
 
     builder = InlineKeyboardBuilder()
     for role_key in user_roles:
-        role_name = role_names.get(role_key, role_key)
+        role_name = ROLE_DISPLAY_NAMES.get(role_key, role_key)
         response += f"• {role_name}\n"
 
         if role_key != "DRIVER" and not (role_key == "ADMIN" and target_id == admin.telegram_id):
@@ -5228,7 +5228,7 @@ async def process_show_user_roles(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data.startswith("revoke_role_"))
 @with_db
-async def process_revoke_role(callback: CallbackQuery, db: Session):
+async def process_revoke_role(callback: CallbackQuery, db: AsyncSession):
     """Отзыв роли у пользователя"""
     callback_data = callback.data.replace("revoke_role_", "")
     last_underscore = callback_data.rfind('_')
@@ -5241,7 +5241,7 @@ async def process_revoke_role(callback: CallbackQuery, db: Session):
     target_id = int(callback_data[last_underscore + 1:])
 
     admin = await get_user(db, callback.from_user.id)
-    if not admin or "ADMIN" not in get_user_roles(admin):
+    if not admin or not admin.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
@@ -5254,13 +5254,12 @@ async def process_revoke_role(callback: CallbackQuery, db: Session):
         await callback.message.edit_text("❌ Пользователь не найден.")
         return
 
-    role_model = db.query(RoleModel).filter(RoleModel.name == role_str).first()
+    role_model = await db.scalar(select(RoleModel).where(RoleModel.name == role_str).limit(1))
     if not role_model:
         await callback.message.edit_text("❌ Роль не найдена.")
         return
 
-    user_roles = get_user_roles(target_user)
-    if role_str not in user_roles:
+    if not target_user.has_role(role_str):
         await callback.message.edit_text("❌ У пользователя нет этой роли.")
         return
 
@@ -5268,17 +5267,13 @@ async def process_revoke_role(callback: CallbackQuery, db: Session):
 
     if role_str == "DRIVER_TRANSFER":
         target_user.is_on_shift = False
+        target_user.shift_start_time = None
 
-    db.commit()
+    await db.commit()
+    if role_str in ("ADMIN", "OPERATOR"):
+        invalidate_role_rosters_cache()
 
-    role_names = {
-        "OPERATOR": "Оператор",
-        "DRIVER_TRANSFER": "Водитель перегона",
-        "ADMIN": "Администратор",
-        "DEB_EMPLOYEE": "Сотрудник ДЭБ",
-        "DRIVER": "Водитель"
-    }
-    role_name = role_names.get(role_str, role_str)
+    role_name = ROLE_DISPLAY_NAMES.get(role_str, role_str)
 
     try:
         await bot.send_message(
@@ -5287,11 +5282,11 @@ async def process_revoke_role(callback: CallbackQuery, db: Session):
             f"📋 Информация:\n"
             f"👤 Администратор: {admin.first_name} {admin.last_name}\n"
             f"📝 Отозвана роль: {role_name}\n"
-            f"⏰ Время: {get_timezone_aware_now().strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"⏰ Время: {format_dt(get_timezone_aware_now())}\n\n"
             f"Используйте /start для обновления меню."
         )
     except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя: {e}")
+        logger.error("Ошибка уведомления пользователя: %s", e)
 
     await callback.message.edit_text(
         f"✅ Роль '{role_name}' отозвана у пользователя "
@@ -5301,14 +5296,14 @@ async def process_revoke_role(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data == "back_to_role_list")
 @with_db
-async def process_back_to_role_list(callback: CallbackQuery, db: Session):
+async def process_back_to_role_list(callback: CallbackQuery, db: AsyncSession):
     """Возврат к списку ролей"""
     user = await get_user(db, callback.from_user.id)
-    if not user or "ADMIN" not in get_user_roles(user):
+    if not user or not user.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
-    requests = db.query(RoleRequest).filter(RoleRequest.status == "ожидает").all()
+    requests = (await db.scalars(select(RoleRequest).where(RoleRequest.status == "ожидает"))).all()
     if not requests:
         await callback.message.edit_text(f"{Emoji.INFO} Нет запросов на выдачу ролей.")
         return
@@ -5318,17 +5313,11 @@ async def process_back_to_role_list(callback: CallbackQuery, db: Session):
         requests_by_role.setdefault(req.requested_role, []).append(req)
 
     builder = InlineKeyboardBuilder()
-    role_names = {
-        "OPERATOR": f"{Emoji.OPERATOR} Оператор",
-        "DRIVER_TRANSFER": f"{Emoji.DRIVER_TRANSFER} Водитель перегона",
-        "ADMIN": f"{Emoji.ADMIN} Администратор",
-        "DEB_EMPLOYEE": f"{Emoji.DEB} Сотрудник ДЭБ"
-    }
 
     for role, role_requests in requests_by_role.items():
-        if role in role_names:
+        if role in ROLE_DISPLAY_NAMES_WITH_EMOJI:
             builder.button(
-                text=f"{role_names[role]} ({len(role_requests)})",
+                text=f"{ROLE_DISPLAY_NAMES_WITH_EMOJI[role]} ({len(role_requests)})",
                 callback_data=f"show_requests_{role}"
             )
 
@@ -5345,22 +5334,21 @@ async def process_back_to_role_list(callback: CallbackQuery, db: Session):
 
 @router.callback_query(F.data == "back_to_user_list")
 @with_db
-async def process_back_to_user_list(callback: CallbackQuery, db: Session):
+async def process_back_to_user_list(callback: CallbackQuery, db: AsyncSession):
     """Возврат к списку пользователей"""
     user = await get_user(db, callback.from_user.id)
-    if not user or "ADMIN" not in get_user_roles(user):
+    if not user or not user.has_role("ADMIN"):
         await callback.message.edit_text("❌ Доступ запрещен.")
         return
 
-    users_with_roles = db.query(User).filter(User.roles.any()).all()
+    users_with_roles = (await db.scalars(select(User).options(selectinload(User.roles)).where(User.roles.any()))).all()
     if not users_with_roles:
         await callback.message.edit_text(f"{Emoji.INFO} В системе нет пользователей с ролями.")
         return
 
     builder = InlineKeyboardBuilder()
     for user_obj in users_with_roles:
-        user_obj_roles = get_user_roles(user_obj)
-        if "ADMIN" in user_obj_roles and user_obj.telegram_id != user.telegram_id:
+        if user_obj.has_role("ADMIN") and user_obj.telegram_id != user.telegram_id:
             continue
 
         full_name = f"{user_obj.first_name} {user_obj.last_name}".strip()
@@ -5382,16 +5370,16 @@ async def process_back_to_user_list(callback: CallbackQuery, db: Session):
 
 
 # ==================== ОБРАБОТЧИКИ ДЛЯ СОТРУДНИКОВ ДЭБ ====================
-@router.message(F.text == f"{Emoji.DEPARTURE} Зарегистрировать убытие")
+@menu_button(f"{Emoji.DEPARTURE} Зарегистрировать убытие")
 @with_db
-async def process_register_departure_deb(message: Message, state: FSMContext, db: Session):
+async def process_register_departure_deb(message: Message, state: FSMContext, db: AsyncSession):
     """Регистрация убытия ТС сотрудником ДЭБ"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "DEB_EMPLOYEE" not in get_user_roles(user):
+    if not user.has_role("DEB_EMPLOYEE"):
         await message.answer("❌ Доступ запрещен.")
         return
 
@@ -5406,7 +5394,7 @@ async def process_register_departure_deb(message: Message, state: FSMContext, db
 
 @router.message(DEBStates.waiting_for_departure_registration)
 @with_db
-async def process_deb_departure_input(message: Message, state: FSMContext, db: Session):
+async def process_deb_departure_input(message: Message, state: FSMContext, db: AsyncSession):
     """Обработка ввода номера ТС для убытия"""
     if message.text == f"{Emoji.CANCEL} Отмена":
         await state.clear()
@@ -5415,18 +5403,18 @@ async def process_deb_departure_input(message: Message, state: FSMContext, db: S
         return
 
     vehicle_number = message.text.upper().strip()
-    is_valid, error = await validate_vehicle_number_with_explanation(vehicle_number)
+    is_valid, error = validate_vehicle_number_with_explanation(vehicle_number)
 
     if not is_valid:
         await message.answer(f"{error}\n\nПожалуйста, введите правильный номер ТС:")
         return
 
-    normalized = await normalize_vehicle_number(vehicle_number)
+    normalized = normalize_vehicle_number(vehicle_number)
 
-    parking = db.query(Parking).filter(
+    parking = await db.scalar(select(Parking).options(joinedload(Parking.user)).where(
         Parking.vehicle_number.in_([normalized, vehicle_number]),
         Parking.departure_time == None
-    ).first()
+    ).limit(1))
 
     if not parking:
         await message.answer(
@@ -5442,9 +5430,11 @@ async def process_deb_departure_input(message: Message, state: FSMContext, db: S
     parking.departure_time = get_timezone_aware_now()
     duration = parking.departure_time - ensure_timezone_aware(parking.arrival_time)
 
-    db.commit()
+    await db.commit()
 
     driver_name = f"{parking.user.first_name} {parking.user.last_name}".strip() or "Водитель"
+    departure_str = format_hm_dmy(parking.departure_time)
+    duration_str = format_duration(int(duration.total_seconds()))
 
     await message.answer(
         f"✅ Убытие зарегистрировано!\n\n"
@@ -5452,9 +5442,9 @@ async def process_deb_departure_input(message: Message, state: FSMContext, db: S
         f"📍 Место #{parking.spot_number}\n"
         f"🚗 ТС: {parking.vehicle_number}\n"
         f"👤 Водитель: {driver_name}\n"
-        f"⏰ Прибытие: {parking.arrival_time.strftime('%H:%M %d.%m.%Y')}\n"
-        f"⏰ Убытие: {parking.departure_time.strftime('%H:%M %d.%m.%Y')}\n"
-        f"⏱️ Время стоянки: {format_duration(int(duration.total_seconds()))}",
+        f"⏰ Прибытие: {format_hm_dmy(parking.arrival_time)}\n"
+        f"⏰ Убытие: {departure_str}\n"
+        f"⏱️ Время стоянки: {duration_str}",
         reply_markup=get_main_menu_keyboard(user)
     )
 
@@ -5464,31 +5454,33 @@ async def process_deb_departure_input(message: Message, state: FSMContext, db: S
             f"📢 Уведомление от ДЭБ:\n\n"
             f"✅ Ваше ТС {parking.vehicle_number} зарегистрировано как убывшее.\n"
             f"📍 Место #{parking.spot_number} освобождено.\n"
-            f"⏰ Время убытия: {parking.departure_time.strftime('%H:%M %d.%m.%Y')}\n"
-            f"⏱️ Время стоянки: {format_duration(int(duration.total_seconds()))}"
+            f"⏰ Время убытия: {departure_str}\n"
+            f"⏱️ Время стоянки: {duration_str}"
         )
     except Exception as e:
-        logger.error(f"Ошибка уведомления водителя: {e}")
+        logger.error("Ошибка уведомления водителя: %s", e)
 
     await state.clear()
 
 
-@router.message(F.text == f"{Emoji.REPORT} Отчет по парковке")
+@menu_button(f"{Emoji.REPORT} Отчет по парковке")
 @with_db
-async def process_parking_report_deb(message: Message, db: Session):
+async def process_parking_report_deb(message: Message, db: AsyncSession):
     """Отчет по парковке для ДЭБ"""
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.answer("❌ Сначала используйте /start для регистрации.")
         return
 
-    if "DEB_EMPLOYEE" not in get_user_roles(user):
+    if not user.has_role("DEB_EMPLOYEE"):
         await message.answer("❌ Доступ запрещен.")
         return
 
     now = get_timezone_aware_now()
     total_spots = config.PARKING_SPOTS
-    active_parkings = db.query(Parking).filter(Parking.departure_time == None).all()
+    active_parkings = (await db.scalars(select(Parking).options(
+        selectinload(Parking.user)
+    ).where(Parking.departure_time == None))).all()
     occupied_spots = len(active_parkings)
 
     time_stats = {"1h": 0, "2h": 0, "3h": 0, "6h": 0, "12h": 0, "24h": 0}
@@ -5551,9 +5543,9 @@ async def process_parking_report_deb(message: Message, db: Session):
 
 
 # ==================== ОБЩИЕ ОБРАБОТЧИКИ ====================
-@router.message(F.text == f"{Emoji.CANCEL} Отмена")
+@menu_button(f"{Emoji.CANCEL} Отмена")
 @with_db
-async def process_cancel(message: Message, state: FSMContext, db: Session):
+async def process_cancel(message: Message, state: FSMContext, db: AsyncSession):
     """Отмена текущего действия"""
     user = await get_user(db, message.from_user.id) or await get_or_create_user(db, message)
     current_state = await state.get_state()
@@ -5567,7 +5559,7 @@ async def process_cancel(message: Message, state: FSMContext, db: Session):
 
 @router.callback_query(F.data == "menu_main")
 @with_db
-async def process_menu_main(callback: CallbackQuery, db: Session):
+async def process_menu_main(callback: CallbackQuery, db: AsyncSession):
     """Возврат в главное меню"""
     user = await get_user(db, callback.from_user.id)
     await callback.message.edit_text("Возврат в главное меню...")
@@ -5577,10 +5569,10 @@ async def process_menu_main(callback: CallbackQuery, db: Session):
     )
 
 
-@router.message(F.text == f"{Emoji.BACK} Вернуться в меню")
-@router.message(F.text == f"{Emoji.UPDATE} Обновить меню")
+@menu_button(f"{Emoji.BACK} Вернуться в меню")
+@menu_button(f"{Emoji.UPDATE} Обновить меню")
 @with_db
-async def process_refresh_menu(message: Message, db: Session):
+async def process_refresh_menu(message: Message, db: AsyncSession):
     """Обновление главного меню"""
     user = await get_user(db, message.from_user.id)
     await message.answer(
@@ -5656,12 +5648,12 @@ async def check_and_notify_unassigned_tasks():
 
                 # 1. Проверка долго ожидающих задач в пуле
                 threshold_time = now - timedelta(minutes=15)
-                pool_tasks = db.query(Task).join(Parking).filter(
+                pool_tasks = (await db.scalars(select(Task).join(Parking).options(contains_eager(Task.parking)).where(
                     Task.status == "PENDING",
                     Task.is_in_pool == True,
                     Task.created_at <= threshold_time,
                     Parking.departure_time == None
-                ).all()
+                ))).all()
 
                 for task in pool_tasks:
                     task_created = ensure_timezone_aware(task.created_at)
@@ -5681,32 +5673,27 @@ async def check_and_notify_unassigned_tasks():
                                 f"❗️ Ни один водитель не взял задачу."
                             )
                         except Exception as e:
-                            logger.error(f"Ошибка уведомления оператора: {e}")
+                            logger.error("Ошибка уведомления оператора: %s", e)
 
                     # Уведомление активных водителей
-                    active_drivers = await get_active_transfer_drivers(db)
-                    for driver in active_drivers:
-                        try:
-                            await bot.send_message(
-                                driver.telegram_id,
-                                f"⚠️ СРОЧНАЯ ЗАДАЧА! (ожидает {minutes_ago} мин, приоритет {task.priority})\n\n"
-                                f"🆔 Задача: #{task.id}\n"
-                                f"📍 Место: #{task.parking.spot_number}\n"
-                                f"🚗 ТС: {task.parking.vehicle_number}\n"
-                                f"🚪 Ворота: #{task.gate_number}\n\n"
-                                f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
-                            )
-                        except Exception as e:
-                            logger.error(f"Ошибка уведомления водителя: {e}")
+                    await broadcast_message(
+                        await get_active_transfer_driver_ids(db),
+                        f"⚠️ СРОЧНАЯ ЗАДАЧА! (ожидает {minutes_ago} мин, приоритет {task.priority})\n\n"
+                        f"🆔 Задача: #{task.id}\n"
+                        f"📍 Место: #{task.parking.spot_number}\n"
+                        f"🚗 ТС: {task.parking.vehicle_number}\n"
+                        f"🚪 Ворота: #{task.gate_number}\n\n"
+                        f'Используйте кнопку "{Emoji.TASK} Взять задачу".'
+                    )
 
                     await asyncio.sleep(0.5)
 
                 # 2. Проверка зависших задач (в работе > 30 мин)
                 stuck_threshold = now - timedelta(minutes=30)
-                stuck_tasks = db.query(Task).filter(
+                stuck_tasks = (await db.scalars(select(Task).options(joinedload(Task.parking)).where(
                     Task.status == "IN_PROGRESS",
                     Task.started_at <= stuck_threshold
-                ).all()
+                ))).all()
 
                 for task in stuck_tasks:
                     task_started = ensure_timezone_aware(task.started_at)
@@ -5734,7 +5721,7 @@ async def check_and_notify_unassigned_tasks():
                                     f"✅ Задача возвращена в пул."
                                 )
                             except Exception as e:
-                                logger.error(f"Ошибка уведомления водителя: {e}")
+                                logger.error("Ошибка уведомления водителя: %s", e)
 
                     if task.operator_id:
                         try:
@@ -5749,19 +5736,19 @@ async def check_and_notify_unassigned_tasks():
                                 f"Требуется вмешательство оператора."
                             )
                         except Exception as e:
-                            logger.error(f"Ошибка уведомления оператора: {e}")
+                            logger.error("Ошибка уведомления оператора: %s", e)
 
                     await asyncio.sleep(0.5)
 
-                db.commit()
+                await db.commit()
 
             except Exception as e:
-                logger.error(f"Ошибка в проверке задач: {e}", exc_info=True)
+                logger.error("Ошибка в проверке задач: %s", e, exc_info=True)
             finally:
-                db.close()
+                await db.close()
 
         except Exception as e:
-            logger.error(f"Критическая ошибка в фоновой задаче: {e}", exc_info=True)
+            logger.error("Критическая ошибка в фоновой задаче: %s", e, exc_info=True)
             await asyncio.sleep(30)
 
 
@@ -5769,7 +5756,9 @@ async def check_and_notify_unassigned_tasks():
 async def on_startup():
     """Действия при запуске бота"""
     print("✅ Бот запущен!")
-    init_db()
+    await init_db()
+    _load_gate_file_ids()
+    await load_gate_images_index()
 
     if config.ADMIN_IDS:
         db = SessionLocal()
@@ -5777,6 +5766,7 @@ async def on_startup():
             for admin_id in config.ADMIN_IDS:
                 admin = await get_user(db, admin_id)
                 if not admin:
+                    all_roles = (await db.scalars(select(RoleModel))).all()
                     admin_user = User(
                         telegram_id=admin_id,
                         first_name="Администратор",
@@ -5785,21 +5775,14 @@ async def on_startup():
                         created_at=get_timezone_aware_now(),
                         is_on_shift=False,
                         is_on_break=False,
-                        total_break_time=0
+                        total_break_time=0,
+                        roles=list(all_roles)
                     )
                     db.add(admin_user)
-                    db.flush()
-
-                    all_roles = db.query(RoleModel).all()
-                    for role in all_roles:
-                        if role not in admin_user.roles:
-                            admin_user.roles.append(role)
-
-                    admin_user.current_role = "ADMIN"
                     print(f"✅ Создан администратор {admin_id}")
                 else:
-                    admin_roles = get_user_roles(admin)
-                    all_roles = db.query(RoleModel).all()
+                    admin_roles = admin.role_set
+                    all_roles = (await db.scalars(select(RoleModel))).all()
 
                     for role in all_roles:
                         if role.name not in admin_roles:
@@ -5809,14 +5792,14 @@ async def on_startup():
                     if not admin.current_role:
                         admin.current_role = "ADMIN"
 
-            db.commit()
+            await db.commit()
             print("✅ Администраторы настроены")
 
         except Exception as e:
             print(f"❌ Ошибка при создании администраторов: {e}")
-            db.rollback()
+            await db.rollback()
         finally:
-            db.close()
+            await db.close()
 
 
 async def main():
@@ -5825,7 +5808,7 @@ async def main():
         await bot.delete_webhook(drop_pending_updates=True)
         print("✅ Вебхук удален")
     except Exception as e:
-        logger.error(f"Ошибка удаления вебхука: {e}")
+        logger.error("Ошибка удаления вебхука: %s", e)
 
     await on_startup()
     print("🚀 Бот начал работу...")
@@ -5833,7 +5816,14 @@ async def main():
     asyncio.create_task(check_and_notify_unassigned_tasks())
     print("✅ Фоновая задача запущена")
 
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Закрываем соединения пула, иначе потоки aiosqlite не дают процессу завершиться
+        await engine.dispose()
+        await read_engine.dispose()
+        # Дописываем оставшиеся в очереди записи лога
+        log_listener.stop()
 
 
 if __name__ == '__main__':
@@ -1,61 +1,133 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from contextlib import contextmanager
+from sqlalchemy import select, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from contextlib import asynccontextmanager
 from config import config
 from models import Base, Role
 
 
-# Создаем движок для SQLite
-engine = create_engine(
+def _pool_kwargs(url: str, pool_size: int, readonly: bool = False) -> dict:
+    """
+    Параметры пула соединений для движка
+
+    Пул рассчитан на одновременную обработку всплесков сообщений.
+    Значения настраиваются через переменные окружения DB_POOL_* (см. config.py)
+    """
+    pool_kwargs = {
+        "pool_size": pool_size,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+    }
+
+    if url.startswith("sqlite"):
+        # aiosqlite по умолчанию использует NullPool и открывает файл БД заново на каждую сессию
+        pool_kwargs["poolclass"] = AsyncAdaptedQueuePool
+    else:
+        pool_kwargs["pool_recycle"] = config.DB_POOL_RECYCLE
+        pool_kwargs["pool_pre_ping"] = True
+        if "+asyncpg" in url:
+            server_settings = {"jit": "off"}
+            if readonly:
+                # Сервер сам отклонит случайную запись через сессию только для чтения
+                server_settings["default_transaction_read_only"] = "on"
+            pool_kwargs["connect_args"] = {"server_settings": server_settings, "command_timeout": 60}
+    return pool_kwargs
+
+
+# Создаем асинхронный движок (aiosqlite / asyncpg)
+engine = create_async_engine(
     config.DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=False
+    echo=False,
+    **_pool_kwargs(config.DATABASE_URL, config.DB_POOL_SIZE)
+)
+
+# Отдельный движок для чтения: реплика или та же БД со своим пулом,
+# чтобы отчеты и списки не занимали соединения, нужные для записи
+read_url = config.DATABASE_READ_URL or config.DATABASE_URL
+read_engine = create_async_engine(
+    read_url,
+    echo=False,
+    **_pool_kwargs(read_url, config.DB_READ_POOL_SIZE, readonly=True)
+)
+
+# Создаем фабрику асинхронных сессий.
+# expire_on_commit=False: объекты остаются доступными после commit без повторной загрузки
+SessionLocal = async_sessionmaker(
+    bind=engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# SQLite: ожидание блокировки вместо мгновенной ошибки "database is locked",
+# WAL позволяет читать параллельно с записью (в том числе из пула read_engine),
+# synchronous=NORMAL в режиме WAL не выполняет fsync на каждом commit
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройка нового соединения SQLite"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+for _engine in (engine, read_engine):
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+# Сессии только для чтения (обработчики с @with_db(readonly=True))
+ReadOnlySessionLocal = async_sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
 )
 
-# Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_pool_checkedout(readonly: bool = False) -> int:
+    """Количество соединений, выданных из пула в данный момент"""
+    return (read_engine if readonly else engine).pool.checkedout()
 
-def init_db():
+
+async def init_db():
     """Инициализация базы данных и создание ролей"""
     try:
         # Создаем все таблицы
-        Base.metadata.create_all(bind=engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
         print("✅ Таблицы созданы/проверены")
 
-        db = SessionLocal()
-        try:
-            roles_to_create = [
-                ("DRIVER", "Водитель ТС (базовая роль)"),
-                ("DRIVER_TRANSFER", "Водитель перегона"),
-                ("OPERATOR", "Оператор"),
-                ("ADMIN", "Администратор"),
-                ("DEB_EMPLOYEE", "Сотрудник ДЭБ"),
-            ]
-
-            for role_name, description in roles_to_create:
-                existing_role = db.query(Role).filter(Role.name == role_name).first()
-                if not existing_role:
-                    db.add(Role(name=role_name, description=description))
-                    print(f"✅ Добавлена роль: {role_name}")
-
-            db.commit()
-            print("✅ Роли созданы/проверены")
-
-        except Exception as e:
-            print(f"❌ Ошибка при создании ролей: {e}")
-            db.rollback()
-        finally:
-            db.close()
+        async with SessionLocal() as db:
+            try:
+                roles_to_create = [
+                    ("DRIVER", "Водитель ТС (базовая роль)"),
+                    ("DRIVER_TRANSFER", "Водитель перегона"),
+                    ("OPERATOR", "Оператор"),
+                    ("ADMIN", "Администратор"),
+                    ("DEB_EMPLOYEE", "Сотрудник ДЭБ"),
+                ]
+
+                existing_roles = set((await db.scalars(select(Role.name))).all())
+                for role_name, description in roles_to_create:
+                    if role_name not in existing_roles:
+                        db.add(Role(name=role_name, description=description))
+                        print(f"✅ Добавлена роль: {role_name}")
+
+                await db.commit()
+                print("✅ Роли созданы/проверены")
+
+            except Exception as e:
+                print(f"❌ Ошибка при создании ролей: {e}")
+                await db.rollback()
     except Exception as e:
         print(f"❌ Ошибка при создании таблиц: {e}")
 
 
-@contextmanager
-def get_db_context():
-    """Контекстный менеджер для работы с БД"""
-    db = SessionLocal()
-    try:
+@asynccontextmanager
+async def get_db_context():
+    """Асинхронный контекстный менеджер для работы с БД"""
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -5,7 +5,7 @@
 import os
 import random
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +23,65 @@ class ImageService:
         "PARKING": "Парковка"
     }
 
+    # Поддерживаемые расширения в порядке приоритета
+    EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+
+    # Индекс "тип папки -> {номер: путь}", строится один раз при первом обращении
+    _index: Dict[str, Dict[int, Path]] = {}
+
+    @classmethod
+    def _get_folder_index(cls, folder_type: str) -> Optional[Dict[int, Path]]:
+        """
+        Получить (и при необходимости построить) индекс изображений папки
+
+        Набор файлов статичен, поэтому папка сканируется один раз вместо
+        проверки существования каждого варианта имени при каждой отправке.
+
+        Args:
+            folder_type: Тип папки ("ABK1", "ABK2", "PARKING")
+
+        Returns:
+            Словарь {номер: путь} или None, если папка недоступна
+        """
+        if folder_type in cls._index:
+            return cls._index[folder_type]
+
+        folder_name = cls.FOLDER_MAPPING.get(folder_type)
+        if not folder_name:
+            logger.error("Неизвестный тип папки: %s", folder_type)
+            return None
+
+        folder_path = cls.BASE_PATH / folder_name
+
+        if not folder_path.exists():
+            logger.error("Папка не существует: %s", folder_path)
+            return None
+
+        # Ранг совпадает с порядком прежнего перебора:
+        # сначала по расширению, затем "N" раньше "0N"
+        ranked = {}
+        for file_path in folder_path.iterdir():
+            if not file_path.is_file() or file_path.suffix not in cls.EXTENSIONS:
+                continue
+            stem = file_path.stem
+            try:
+                number = int(stem)
+            except ValueError:
+                continue
+            if stem == str(number):
+                variant = 0
+            elif stem == f"{number:02d}":
+                variant = 1
+            else:
+                continue
+            rank = cls.EXTENSIONS.index(file_path.suffix) * 2 + variant
+            if number not in ranked or rank < ranked[number][0]:
+                ranked[number] = (rank, file_path)
+
+        index = {number: path for number, (_, path) in ranked.items()}
+        cls._index[folder_type] = index
+        return index
+
     @classmethod
     def get_image_path(cls, folder_type: str, number: int) -> Optional[Path]:
         """
@@ -36,34 +95,17 @@ class ImageService:
             Path к изображению или None, если не найдено
         """
         try:
-            folder_name = cls.FOLDER_MAPPING.get(folder_type)
-            if not folder_name:
-                logger.error(f"Неизвестный тип папки: {folder_type}")
-                return None
-
-            folder_path = cls.BASE_PATH / folder_name
-
-            if not folder_path.exists():
-                logger.error(f"Папка не существует: {folder_path}")
+            index = cls._get_folder_index(folder_type)
+            if index is None:
                 return None
 
-            # Ищем файл с любым расширением изображения
-            extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
-            for ext in extensions:
-                file_path = folder_path / f"{number}{ext}"
-                if file_path.exists():
-                    return file_path
-
-                # Также пробуем с ведущим нулем
-                file_path = folder_path / f"{number:02d}{ext}"
-                if file_path.exists():
-                    return file_path
-
-            logger.warning(f"Изображение #{number} не найдено в {folder_path}")
-            return None
+            file_path = index.get(number)
+            if file_path is None:
+                logger.warning("Изображение #%s не найдено в %s", number, cls.BASE_PATH / cls.FOLDER_MAPPING[folder_type])
+            return file_path
 
         except Exception as e:
-            logger.error(f"Ошибка при получении изображения: {e}")
+            logger.error("Ошибка при получении изображения: %s", e)
             return None
 
     @classmethod
@@ -98,7 +140,7 @@ class ImageService:
             return random.choice(images)
 
         except Exception as e:
-            logger.error(f"Ошибка при получении случайного изображения: {e}")
+            logger.error("Ошибка при получении случайного изображения: %s", e)
             return None
 
     @classmethod
@@ -137,5 +179,5 @@ class ImageService:
             return sorted(numbers)
 
         except Exception as e:
-            logger.error(f"Ошибка при получении списка номеров: {e}")
+            logger.error("Ошибка при получении списка номеров: %s", e)
             return []
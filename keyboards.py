@@ -2,6 +2,9 @@
 Модуль клавиатур для бота управления парковкой
 """
 
+from functools import lru_cache
+from typing import FrozenSet
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     InlineKeyboardMarkup,
@@ -10,27 +13,141 @@ from aiogram.types import (
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 
-from utils import Emoji
+from utils import Emoji, ROLE_DISPLAY_NAMES_WITH_EMOJI
+
+
+def _build_static_markup(*buttons, width: int = 1) -> InlineKeyboardMarkup:
+    """Сборка неизменяемой inline-клавиатуры из пар (текст, callback_data)"""
+    builder = InlineKeyboardBuilder()
+    for text, callback_data in buttons:
+        builder.button(text=text, callback_data=callback_data)
+    builder.adjust(width)
+    return builder.as_markup()
+
+
+# ==================== СТАТИЧНЫЕ КЛАВИАТУРЫ ====================
+# Создаются один раз при импорте и переиспользуются всеми обработчиками
+
+BACK_TO_SWITCH_ROLE_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад", "back_to_switch_role")
+)
+
+# Подтверждение постановки на ворота (водитель)
+GATE_CONFIRMATION_MARKUP = _build_static_markup(
+    (f"{Emoji.COMPLETED} Задача выполнена, встал на ворота", "gate_completed"),
+    (f"{Emoji.GATE_OCCUPIED} Ворота заняты другим ТС", "gate_occupied"),
+    (f"{Emoji.CANCEL} Отмена", "gate_cancel"),
+)
+
+# Подтверждение после повторной попытки встать на ворота
+GATE_RETRY_CONFIRMATION_MARKUP = _build_static_markup(
+    (f"{Emoji.COMPLETED} Задача выполнена, встал на ворота", "gate_completed"),
+    (f"{Emoji.GATE_OCCUPIED} Ворота все еще заняты", "gate_occupied"),
+    (f"{Emoji.CANCEL} Отмена", "gate_cancel"),
+)
+
+# Варианты действий, когда ворота заняты
+GATE_OCCUPIED_ACTIONS_MARKUP = _build_static_markup(
+    (f"{Emoji.RETRY} Попробовать снова", "retry_gate"),
+    (f"{Emoji.ASSIGN_AGAIN} Запросить новые ворота", "request_new_gate"),
+    (f"{Emoji.CANCEL} Отмена", "gate_cancel"),
+)
+
+# Подтверждение выполнения задачи (водитель перегона)
+TRANSFER_GATE_CONFIRMATION_MARKUP = _build_static_markup(
+    (f"{Emoji.COMPLETED} Задача выполнена, ворота свободны", "transfer_gate_completed"),
+    (f"{Emoji.GATE_OCCUPIED} Ворота заняты другим ТС", "transfer_gate_occupied"),
+    (f"{Emoji.CANCEL} Нет ТС на месте", "transfer_no_vehicle"),
+    ("🔧 Поломка ТС", "transfer_breakdown"),
+)
+
+BACK_TO_BREAK_MENU_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад", "back_to_break_menu")
+)
+
+# Выбор АБК при назначении ворот
+ABK_SELECTION_MARKUP = _build_static_markup(
+    ("🏢 АБК-1 (ворота 1-59, 66-83)", "select_abk1"),
+    ("🏢 АБК-2 (ворота 1-10)", "select_abk2"),
+    (f"{Emoji.CANCEL} Отмена", "menu_main"),
+)
+
+# Очистка пула задач
+CLEAR_POOL_ACTIONS_MARKUP = _build_static_markup(
+    ("🔄 Перезапустить все", "clear_pool_restart"),
+    ("❌ Удалить все", "clear_pool_delete"),
+    ("📋 Показать список", "clear_pool_list"),
+    (f"{Emoji.BACK} Отмена", "menu_main"),
+)
+
+CLEAR_POOL_MARKUP = _build_static_markup(
+    ("🔄 Перезапустить все", "clear_pool_restart"),
+    ("❌ Удалить все", "clear_pool_delete"),
+    (f"{Emoji.BACK} Назад", "menu_main"),
+)
+
+BACK_TO_REPORTS_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад к отчетам", "back_to_reports_menu")
+)
+
+BACK_TO_STATUSES_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад", "back_to_statuses")
+)
+
+# Экраны статусов с кнопкой обновления
+STATUS_TASKS_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад", "back_to_statuses"),
+    (f"{Emoji.UPDATE} Обновить", "status_tasks"),
+    width=2
+)
+STATUS_PARKING_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад", "back_to_statuses"),
+    (f"{Emoji.UPDATE} Обновить", "status_parking"),
+    width=2
+)
+STATUS_QUEUE_MARKUP = _build_static_markup(
+    (f"{Emoji.BACK} Назад", "back_to_statuses"),
+    (f"{Emoji.UPDATE} Обновить", "status_queue"),
+    width=2
+)
+
+# Сводка по зависшим задачам
+STUCK_SUMMARY_MARKUP = _build_static_markup(
+    (f"{Emoji.STUCK} Управление зависшими", "manage_stuck_tasks"),
+    (f"{Emoji.BACK} Назад", "back_to_statuses"),
+)
 
 
 def get_main_menu_keyboard(user) -> ReplyKeyboardMarkup:
     """
     Генерация главного меню в зависимости от роли пользователя
 
+    Меню зависит только от набора ролей, текущей роли и статусов смены/обеда,
+    поэтому одна и та же клавиатура используется для всех пользователей с одинаковым набором.
+
     Args:
         user: Объект пользователя
 
     Returns:
         Клавиатура с кнопками меню
     """
+    return _build_main_menu(
+        user.role_set,
+        user.current_role or "DRIVER",
+        bool(user.is_on_shift),
+        bool(user.is_on_break)
+    )
+
+
+@lru_cache(maxsize=64)
+def _build_main_menu(user_roles: FrozenSet[str], main_role: str,
+                     is_on_shift: bool, is_on_break: bool) -> ReplyKeyboardMarkup:
+    """Построение главного меню (результат кэшируется по набору параметров)"""
     builder = ReplyKeyboardBuilder()
-    user_roles = [role.name for role in user.roles]
 
     # Если нет ролей - даем меню водителя
     if not user_roles:
-        user_roles = ["DRIVER"]
-
-    main_role = user.current_role or "DRIVER"
+        user_roles = frozenset({"DRIVER"})
 
     # МЕНЮ ДЛЯ ВОДИТЕЛЯ
     if main_role == "DRIVER":
@@ -77,7 +194,7 @@ def get_main_menu_keyboard(user) -> ReplyKeyboardMarkup:
     elif main_role == "DRIVER_TRANSFER":
         buttons = []
 
-        if user.is_on_shift:
+        if is_on_shift:
             buttons.extend([
                 KeyboardButton(text=f"{Emoji.SHIFT_END} Закончить смену"),
                 KeyboardButton(text=f"{Emoji.TASK} Взять задачу"),
@@ -85,7 +202,7 @@ def get_main_menu_keyboard(user) -> ReplyKeyboardMarkup:
                 KeyboardButton(text=f"{Emoji.COMPLETED} Завершить задачу")
             ])
 
-            if user.is_on_break:
+            if is_on_break:
                 buttons.append(KeyboardButton(text=f"{Emoji.BREAK_END} Вернуться с обеда"))
             else:
                 buttons.append(KeyboardButton(text=f"{Emoji.BREAK_START} Уйти на обед"))
@@ -124,7 +241,7 @@ def get_main_menu_keyboard(user) -> ReplyKeyboardMarkup:
             ])
 
         if "DRIVER_TRANSFER" in user_roles:
-            if user.is_on_shift:
+            if is_on_shift:
                 buttons.append(KeyboardButton(text=f"{Emoji.SHIFT_END} Закончить смену"))
             else:
                 buttons.append(KeyboardButton(text=f"{Emoji.SHIFT_START} Начать смену"))
@@ -191,26 +308,28 @@ def get_vehicle_type_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# Роли, которые можно запросить у администратора
+REQUESTABLE_ROLES = {
+    "OPERATOR": f"{Emoji.OPERATOR} Оператор",
+    "DRIVER_TRANSFER": f"{Emoji.DRIVER_TRANSFER} Водитель перегона",
+    "ADMIN": f"{Emoji.ADMIN} Администратор",
+    "DEB_EMPLOYEE": f"{Emoji.DEB} Сотрудник ДЭБ"
+}
+
+
 def get_role_selection_keyboard(user_roles) -> InlineKeyboardMarkup:
     """
     Клавиатура выбора роли для запроса
 
     Args:
-        user_roles: Список текущих ролей пользователя
+        user_roles: Текущие роли пользователя (множество User.role_set)
 
     Returns:
         Клавиатура с доступными ролями или None
     """
     builder = InlineKeyboardBuilder()
 
-    all_roles = {
-        "OPERATOR": f"{Emoji.OPERATOR} Оператор",
-        "DRIVER_TRANSFER": f"{Emoji.DRIVER_TRANSFER} Водитель перегона",
-        "ADMIN": f"{Emoji.ADMIN} Администратор",
-        "DEB_EMPLOYEE": f"{Emoji.DEB} Сотрудник ДЭБ"
-    }
-
-    for role_key, role_text in all_roles.items():
+    for role_key, role_text in REQUESTABLE_ROLES.items():
         if role_key not in user_roles:
             builder.button(text=role_text, callback_data=f"request_role_{role_key}")
 
@@ -234,22 +353,14 @@ def get_switch_role_keyboard(user_roles, current_role) -> InlineKeyboardMarkup:
     """
     builder = InlineKeyboardBuilder()
 
-    role_names = {
-        "DRIVER": f"{Emoji.DEPARTURE} Водитель",
-        "DRIVER_TRANSFER": f"{Emoji.DRIVER_TRANSFER} Водитель перегона",
-        "OPERATOR": f"{Emoji.OPERATOR} Оператор",
-        "ADMIN": f"{Emoji.ADMIN} Администратор",
-        "DEB_EMPLOYEE": f"{Emoji.DEB} Сотрудник ДЭБ"
-    }
-
     # Сортируем роли: DRIVER всегда первая
     sorted_roles = sorted(user_roles, key=lambda x: (x != "DRIVER", x))
 
     for role_key in sorted_roles:
-        if role_key in role_names:
+        if role_key in ROLE_DISPLAY_NAMES_WITH_EMOJI:
             check_mark = " ✓" if role_key == current_role else ""
             builder.button(
-                text=f"{role_names[role_key]}{check_mark}",
+                text=f"{ROLE_DISPLAY_NAMES_WITH_EMOJI[role_key]}{check_mark}",
                 callback_data=f"switch_role_{role_key}"
             )
 
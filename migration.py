@@ -14,7 +14,7 @@ def run_full_migration():
     print("🔄 Запуск полной миграции базы данных...")
 
     engine = create_engine(
-        config.DATABASE_URL,
+        config.SYNC_DATABASE_URL,
         connect_args={"check_same_thread": False},
         echo=True
     )
@@ -32,6 +32,11 @@ def run_full_migration():
                 print("➕ Добавляем поле current_role...")
                 conn.execute(text("ALTER TABLE users ADD COLUMN current_role VARCHAR(50)"))
 
+            # Время начала текущей смены
+            if 'shift_start_time' not in columns:
+                print("➕ Добавляем поле shift_start_time...")
+                conn.execute(text("ALTER TABLE users ADD COLUMN shift_start_time TIMESTAMP"))
+
             # Поля для обеда
             if 'is_on_break' not in columns:
                 print("➕ Добавляем поле is_on_break...")
@@ -111,7 +116,103 @@ def run_full_migration():
                 )
             """))
 
-            # ============ 5. ПРОВЕРКА И СОЗДАНИЕ РОЛЕЙ ============
+            # ============ 5. ИНДЕКСЫ ДЛЯ ЧАСТЫХ ЗАПРОСОВ ============
+            print("\n📋 Создание индексов...")
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_parking_user_active ON parkings(user_id, departure_time)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_parking_active ON parkings(spot_number, arrival_time)
+                WHERE departure_time IS NULL
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_queue_user_status ON parking_queue(user_id, status)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_rolereq_user_status ON role_requests(user_id, status)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_task_parking_status ON tasks(parking_id, status)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_task_status_pool_priority ON tasks(status, is_in_pool, priority)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_task_driver_status ON tasks(driver_id, status)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_task_pool_pick ON tasks(priority DESC, created_at)
+                WHERE status = 'PENDING' AND is_in_pool = 1
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_task_status_priority_created
+                ON tasks(status, priority DESC, created_at DESC)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_task_created_at ON tasks(created_at)
+            """))
+
+            # Перед уникальным индексом закрываем лишние незавершенные обеды (оставляем последний)
+            conn.execute(text("""
+                UPDATE breaks
+                SET end_time = start_time, duration = 0
+                WHERE end_time IS NULL AND id NOT IN (
+                    SELECT MAX(id) FROM breaks WHERE end_time IS NULL GROUP BY user_id
+                )
+            """))
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_break_open ON breaks(user_id) WHERE end_time IS NULL
+            """))
+
+            # Перед уникальным индексом у каждого ТС должна остаться одна активная задача
+            print("\n📋 Проверка дублей активных задач по ТС...")
+            duplicates = conn.execute(text("""
+                SELECT parking_id, id, status FROM tasks
+                WHERE status IN ('PENDING', 'IN_PROGRESS') AND parking_id IN (
+                    SELECT parking_id FROM tasks WHERE status IN ('PENDING', 'IN_PROGRESS')
+                    GROUP BY parking_id HAVING COUNT(*) > 1
+                )
+                ORDER BY parking_id, id
+            """)).all()
+
+            tasks_by_parking = {}
+            for parking_id, task_id, status in duplicates:
+                tasks_by_parking.setdefault(parking_id, []).append((task_id, status))
+
+            tasks_to_cancel = []
+            for parking_id, tasks in tasks_by_parking.items():
+                print(f"⚠️ ТС (parking_id={parking_id}): активные задачи "
+                      + ", ".join(f"#{task_id} {status}" for task_id, status in tasks))
+                in_progress = [task_id for task_id, status in tasks if status == 'IN_PROGRESS']
+                if len(in_progress) > 1:
+                    # Водители уже работают по нескольким задачам - автоматически не выбрать
+                    raise RuntimeError(
+                        f"У ТС (parking_id={parking_id}) несколько задач IN_PROGRESS: "
+                        f"{', '.join(f'#{task_id}' for task_id in in_progress)}. "
+                        f"Завершите или отмените лишние вручную и повторите миграцию"
+                    )
+                # Задача в работе важнее более новой ожидающей, иначе оставляем последнюю
+                keep_id = in_progress[0] if in_progress else tasks[-1][0]
+                for task_id, _ in tasks:
+                    if task_id != keep_id:
+                        tasks_to_cancel.append(task_id)
+                        print(f"   ➖ Задача #{task_id} отменена, оставлена #{keep_id}")
+
+            for task_id in tasks_to_cancel:
+                conn.execute(text("""
+                    UPDATE tasks SET status = 'CANCELLED', is_in_pool = 0 WHERE id = :task_id
+                """), {"task_id": task_id})
+            if tasks_to_cancel:
+                print(f"✅ Отменено дублирующих задач: {len(tasks_to_cancel)}")
+            else:
+                print("✓ Дублей активных задач нет")
+
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_task_parking_active ON tasks(parking_id)
+                WHERE status IN ('PENDING', 'IN_PROGRESS')
+            """))
+
+            # ============ 6. ПРОВЕРКА И СОЗДАНИЕ РОЛЕЙ ============
             print("\n📋 Проверка наличия ролей...")
 
             # Создаем сессию для работы с ORM
@@ -146,7 +247,7 @@ def run_full_migration():
             finally:
                 db.close()
 
-            # ============ 6. ФИНАЛЬНЫЙ КОММИТ ============
+            # ============ 7. ФИНАЛЬНЫЙ КОММИТ ============
             conn.commit()
             print("\n✅ ПОЛНАЯ МИГРАЦИЯ УСПЕШНО ЗАВЕРШЕНА!")
             print("   Обновлены таблицы: users, breaks, tasks")
@@ -169,7 +270,7 @@ def check_database():
     print("\n🔍 ПРОВЕРКА СОСТОЯНИЯ БАЗЫ ДАННЫХ...")
 
     engine = create_engine(
-        config.DATABASE_URL,
+        config.SYNC_DATABASE_URL,
         connect_args={"check_same_thread": False},
         echo=False
     )
@@ -198,7 +299,7 @@ def check_database():
             # Проверяем наличие новых полей
             print(f"\n🔧 Проверка полей users:")
             columns = conn.execute(text("PRAGMA table_info(users)")).fetchall()
-            required_fields = ['is_on_break', 'break_start_time', 'total_break_time', 'current_role']
+            required_fields = ['is_on_break', 'break_start_time', 'total_break_time', 'current_role', 'shift_start_time']
             for field in required_fields:
                 exists = any(col[1] == field for col in columns)
                 print(f"   • {field}: {'✅' if exists else '❌'}")
@@ -228,7 +329,7 @@ def check_database():
 def add_parking_queue_table():
     """Добавление таблицы очереди на парковку"""
     engine = create_engine(
-        config.DATABASE_URL,
+        config.SYNC_DATABASE_URL,
         connect_args={"check_same_thread": False},
         echo=True
     )
@@ -1,7 +1,8 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Table
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Table, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy import event, text
 import enum
 from datetime import datetime
 import pytz
@@ -62,6 +63,17 @@ class Break(Base):
     # Связь будет установлена после определения User
     user = relationship("User", back_populates="breaks")
 
+
+# У пользователя не больше одного незавершенного обеда: возврат с обеда
+# закрывает его одним UPDATE по (user_id, end_time IS NULL) без предварительного SELECT
+Index(
+    "ux_break_open",
+    Break.user_id,
+    unique=True,
+    sqlite_where=text("end_time IS NULL"),
+    postgresql_where=text("end_time IS NULL"),
+)
+
 class User(Base):
     """Модель пользователя"""
     __tablename__ = 'users'
@@ -73,6 +85,7 @@ class User(Base):
     last_name = Column(String(100))
     position = Column(String(200), nullable=True)
     is_on_shift = Column(Boolean, default=False)
+    shift_start_time = Column(DateTime, nullable=True)  # Начало текущей смены
     current_role = Column(String(50), nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(moscow_tz))
 
@@ -82,7 +95,10 @@ class User(Base):
     total_break_time = Column(Integer, default=0)
 
     # Связи
-    roles = relationship("Role", secondary=user_roles, back_populates="users")
+    # В асинхронной сессии ленивая подгрузка недоступна: связи, которые читают обработчики,
+    # загружаются явно в запросе (selectinload/joinedload), а lazy="raise" сразу сообщает
+    # об обращении к незагруженной связи
+    roles = relationship("Role", secondary=user_roles, back_populates="users", lazy="raise")
     parkings = relationship("Parking", back_populates="user")
     tasks_assigned = relationship("Task", foreign_keys="Task.driver_id", back_populates="driver")
     tasks_operator = relationship("Task", foreign_keys="Task.operator_id", back_populates="operator")
@@ -90,13 +106,59 @@ class User(Base):
     breaks = relationship("Break", back_populates="user", cascade="all, delete-orphan")
     parking_queue = relationship("ParkingQueue", back_populates="user", cascade="all, delete-orphan")  # Новая связь
 
+    @property
+    def role_names(self) -> tuple:
+        """Названия ролей пользователя (кэшируются на объекте до изменения roles)"""
+        names = self.__dict__.get("_role_names")
+        if names is None:
+            names = tuple(role.name for role in self.roles)
+            self.__dict__["_role_names"] = names
+        return names
+
+    @property
+    def role_set(self) -> frozenset:
+        """Набор ролей пользователя для проверок и ключей кэша"""
+        role_set = self.__dict__.get("_role_set")
+        if role_set is None:
+            role_set = frozenset(self.role_names)
+            self.__dict__["_role_set"] = role_set
+        return role_set
+
     def has_role(self, role_name: str) -> bool:
         """Проверяет, есть ли у пользователя указанная роль"""
-        return any(role.name == role_name for role in self.roles)
+        return role_name in self.role_set
+
+    def has_any_role(self, *role_names: str) -> bool:
+        """Проверяет, есть ли у пользователя хотя бы одна из указанных ролей"""
+        return not self.role_set.isdisjoint(role_names)
+
+
+@event.listens_for(User.roles, "append")
+@event.listens_for(User.roles, "remove")
+@event.listens_for(User.roles, "bulk_replace")
+def _reset_role_names_on_change(target, *args, **kwargs):
+    """Сброс кэша ролей при изменении коллекции roles"""
+    target.__dict__.pop("_role_names", None)
+    target.__dict__.pop("_role_set", None)
+
+
+@event.listens_for(User, "refresh")
+@event.listens_for(User, "expire")
+def _reset_role_names_on_reload(target, *args):
+    """Сброс кэша ролей при перезагрузке или устаревании объекта"""
+    if target is None:
+        # Объект уже удален сборщиком мусора, сбрасывать нечего
+        return
+    target.__dict__.pop("_role_names", None)
+    target.__dict__.pop("_role_set", None)
 
 class RoleRequest(Base):
     """Модель запроса на получение роли"""
     __tablename__ = 'role_requests'
+    __table_args__ = (
+        # Поиск активного запроса пользователя
+        Index("ix_rolereq_user_status", "user_id", "status"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -109,11 +171,15 @@ class RoleRequest(Base):
     processed_at = Column(DateTime, nullable=True)
     processed_by = Column(Integer, nullable=True)
 
-    user = relationship("User", back_populates="role_requests")
+    user = relationship("User", back_populates="role_requests", lazy="raise")
 
 class Parking(Base):
     """Модель парковки транспортного средства"""
     __tablename__ = 'parkings'
+    __table_args__ = (
+        # Поиск активной парковки пользователя (departure_time IS NULL)
+        Index("ix_parking_user_active", "user_id", "departure_time"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -125,12 +191,31 @@ class Parking(Base):
     is_hitch = Column(Boolean, default=False)
     gate_number = Column(Integer, nullable=True)
 
-    user = relationship("User", back_populates="parkings")
+    user = relationship("User", back_populates="parkings", lazy="raise")
     tasks = relationship("Task", back_populates="parking")
 
+
+# Частичный индекс по ТС, находящимся на парковке: занятые места, их число
+# и время стоянки читаются из небольшого индекса, а не из всей истории парковок
+Index(
+    "ix_parking_active",
+    Parking.spot_number,
+    Parking.arrival_time,
+    sqlite_where=text("departure_time IS NULL"),
+    postgresql_where=text("departure_time IS NULL"),
+)
+
 class Task(Base):
     """Модель задачи"""
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Активная задача по парковке (parking_id + статус PENDING/IN_PROGRESS)
+        Index("ix_task_parking_status", "parking_id", "status"),
+        # Выбор задачи из пула по приоритету
+        Index("ix_task_status_pool_priority", "status", "is_in_pool", "priority"),
+        # Активная/зависшая задача водителя (driver_id + статус IN_PROGRESS/STUCK)
+        Index("ix_task_driver_status", "driver_id", "status"),
+    )
 
     id = Column(Integer, primary_key=True)
     parking_id = Column(Integer, ForeignKey('parkings.id'), nullable=False)
@@ -149,14 +234,51 @@ class Task(Base):
     assigned_driver_id = Column(Integer, ForeignKey('users.id'), nullable=True)
     is_in_pool = Column(Boolean, default=True)
 
-    parking = relationship("Parking", back_populates="tasks")
-    driver = relationship("User", foreign_keys=[driver_id], back_populates="tasks_assigned")
+    parking = relationship("Parking", back_populates="tasks", lazy="raise")
+    driver = relationship("User", foreign_keys=[driver_id], back_populates="tasks_assigned", lazy="raise")
     assigned_driver = relationship("User", foreign_keys=[assigned_driver_id])
-    operator = relationship("User", foreign_keys=[operator_id], back_populates="tasks_operator")
+    operator = relationship("User", foreign_keys=[operator_id], back_populates="tasks_operator", lazy="raise")
+
+
+# Частичный индекс для выдачи задачи из пула: ORDER BY priority DESC, created_at ASC
+# только по строкам PENDING в пуле, без сортировки всей таблицы
+Index(
+    "ix_task_pool_pick",
+    Task.priority.desc(),
+    Task.created_at.asc(),
+    sqlite_where=text("status = 'PENDING' AND is_in_pool = 1"),
+    postgresql_where=text("status = 'PENDING' AND is_in_pool"),
+)
+
+# У ТС не больше одной активной задачи: два оператора, одновременно назначающие
+# задачу одному ТС, не создадут дубликат - второй commit отклонит БД
+Index(
+    "ux_task_parking_active",
+    Task.parking_id,
+    unique=True,
+    sqlite_where=text("status IN ('PENDING', 'IN_PROGRESS')"),
+    postgresql_where=text("status IN ('PENDING', 'IN_PROGRESS')"),
+)
+
+# Списки задач по статусу (активные, зависшие): ORDER BY priority DESC, created_at DESC
+# читаются из индекса в нужном порядке, без отдельной сортировки
+Index(
+    "ix_task_status_priority_created",
+    Task.status,
+    Task.priority.desc(),
+    Task.created_at.desc(),
+)
+
+# Отчет по задачам за сегодня (created_at >= начало дня)
+Index("ix_task_created_at", Task.created_at)
 
 class ParkingQueue(Base):
     """Модель очереди на парковку"""
     __tablename__ = 'parking_queue'
+    __table_args__ = (
+        # Поиск записи пользователя в активной очереди
+        Index("ix_queue_user_status", "user_id", "status"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -2,11 +2,15 @@
 Сервисные функции для бота управления парковкой
 """
 
+import time
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict
 from io import BytesIO
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, func, event, inspect, and_, or_, case
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncResult
+from sqlalchemy.orm import Session, contains_eager, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from aiogram.types import Message
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment
@@ -17,14 +21,78 @@ from models import (
 )
 from vehicle_validator import VehicleNumberValidator
 from utils import (
-    ensure_timezone_aware, get_timezone_aware_now, format_duration, get_current_shift_period
+    Emoji, ensure_timezone_aware, get_timezone_aware_now, format_duration, get_current_shift_period
 )
 from config import config
 
 
-async def get_user(db: Session, telegram_id: int) -> Optional[User]:
+# Роль DRIVER выдается каждому новому пользователю; загружается из БД один раз
+_driver_role: Optional[RoleModel] = None
+
+
+async def get_driver_role(db: AsyncSession) -> Optional[RoleModel]:
     """
-    Получение пользователя из базы данных по Telegram ID
+    Получение роли DRIVER без запроса к БД при повторных вызовах
+
+    Роль загружается один раз, затем копия подключается к текущей сессии
+    через merge(load=False), который не выполняет SELECT.
+
+    Args:
+        db: Сессия базы данных
+
+    Returns:
+        Объект Role или None, если роль не создана
+    """
+    global _driver_role
+    if _driver_role is None:
+        role = await db.scalar(select(RoleModel).where(RoleModel.name == "DRIVER"))
+        if role is None:
+            return None
+        _driver_role = role
+        return role
+    return await db.merge(_driver_role, load=False)
+
+
+# Кэш пользователей по Telegram ID: почти каждый обработчик начинается с get_user.
+# Запись сбрасывается при любом flush измененного пользователя (см. _track_user_changes)
+USER_CACHE_TTL = 30  # секунд
+USER_CACHE_MAXSIZE = 4096
+_user_cache: Dict[int, Tuple[float, User]] = {}
+
+
+def invalidate_user_cache(telegram_id: Optional[int] = None):
+    """Сброс кэша пользователя (или всего кэша, если telegram_id не указан)"""
+    if telegram_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(telegram_id, None)
+
+
+@event.listens_for(Session, "before_flush")
+def _track_user_changes(session, flush_context, instances):
+    """Сброс кэша для пользователей, изменяемых в текущей транзакции"""
+    changed = session.info.setdefault("changed_user_ids", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User) and obj.telegram_id is not None:
+            changed.add(obj.telegram_id)
+            _user_cache.pop(obj.telegram_id, None)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _drop_changed_users(session):
+    """Повторный сброс после завершения транзакции: конкурентный запрос мог закэшировать старые данные"""
+    for telegram_id in session.info.pop("changed_user_ids", ()):
+        _user_cache.pop(telegram_id, None)
+
+
+async def get_user(db: AsyncSession, telegram_id: int) -> Optional[User]:
+    """
+    Получение пользователя из базы данных по Telegram ID (с кэшированием на USER_CACHE_TTL)
+
+    Закэшированный объект подключается к текущей сессии через merge(load=False) без SELECT.
+    Повторный вызов в той же сессии возвращает уже полученный объект: merge поверх него
+    затер бы еще не сохраненные изменения.
 
     Args:
         db: Сессия базы данных
@@ -33,10 +101,51 @@ async def get_user(db: Session, telegram_id: int) -> Optional[User]:
     Returns:
         Объект User или None
     """
-    return db.query(User).filter(User.telegram_id == telegram_id).first()
+    session_users = db.info.setdefault("users_by_telegram_id", {})
+    user = session_users.get(telegram_id)
+    if user is not None and user in db:
+        return user
+
+    now = time.monotonic()
+    entry = _user_cache.get(telegram_id)
+    if entry and now - entry[0] < USER_CACHE_TTL:
+        state = inspect(entry[1])
+        # Объект с несохраненными или сброшенными атрибутами повторно не используем
+        if not state.modified and not state.expired_attributes:
+            user = await db.merge(entry[1], load=False)
+            session_users[telegram_id] = user
+            return user
+
+    # Роли нужны почти каждому обработчику (проверка доступа, меню) - загружаются сразу
+    user = await db.scalar(select(User).options(selectinload(User.roles)).where(User.telegram_id == telegram_id))
+    if user is None:
+        _user_cache.pop(telegram_id, None)
+        return None
+
+    if len(_user_cache) >= USER_CACHE_MAXSIZE:
+        _user_cache.clear()
+    _user_cache[telegram_id] = (now, user)
+    session_users[telegram_id] = user
+    return user
+
+
+def get_cached_user(telegram_id: int) -> Optional[User]:
+    """
+    Пользователь из кэша get_user без обращения к БД (None, если записи нет или она устарела)
+
+    Объект не привязан к сессии: годится только для чтения уже загруженных полей
+    (роли, is_on_shift), например для отказа до открытия сессии.
+    """
+    entry = _user_cache.get(telegram_id)
+    if not entry or time.monotonic() - entry[0] >= USER_CACHE_TTL:
+        return None
+    state = inspect(entry[1])
+    if state.modified or state.expired_attributes:
+        return None
+    return entry[1]
 
 
-async def get_or_create_user(db: Session, message: Message) -> User:
+async def get_or_create_user(db: AsyncSession, message: Message) -> User:
     """
     Получение существующего или создание нового пользователя
 
@@ -51,6 +160,7 @@ async def get_or_create_user(db: Session, message: Message) -> User:
 
     if not user:
         # Создание нового пользователя с базовой ролью DRIVER
+        driver_role = await get_driver_role(db)
         user = User(
             telegram_id=message.from_user.id,
             username=message.from_user.username,
@@ -60,28 +170,21 @@ async def get_or_create_user(db: Session, message: Message) -> User:
             created_at=get_timezone_aware_now(),
             is_on_shift=False,
             is_on_break=False,
-            total_break_time=0
+            total_break_time=0,
+            roles=[driver_role] if driver_role else []
         )
         db.add(user)
-        db.flush()
-
-        # Добавление роли DRIVER
-        driver_role = db.query(RoleModel).filter(RoleModel.name == "DRIVER").first()
-        if driver_role:
-            user.roles.append(driver_role)
-
-        db.commit()
-        db.refresh(user)
+        await db.commit()
 
     return user
 
 
-def get_user_roles(user: User) -> List[str]:
-    """Получение списка названий ролей пользователя"""
-    return [role.name for role in user.roles]
+def get_user_roles(user: User) -> Tuple[str, ...]:
+    """Получение названий ролей пользователя (кэшируются на объекте User)"""
+    return user.role_names
 
 
-def get_user_main_role(user: User) -> str:
+def get_user_main_role(user: User, user_roles: Optional[List[str]] = None) -> str:
     """
     Определение основной роли пользователя для отображения меню
 
@@ -93,10 +196,15 @@ def get_user_main_role(user: User) -> str:
     5. DEB_EMPLOYEE
     6. DRIVER (по умолчанию)
 
+    Args:
+        user: Пользователь
+        user_roles: Уже полученный список ролей (чтобы не строить его повторно)
+
     Returns:
         Название роли
     """
-    user_roles = get_user_roles(user)
+    if user_roles is None:
+        user_roles = get_user_roles(user)
 
     # Если нет ролей - даем DRIVER
     if not user_roles:
@@ -115,7 +223,64 @@ def get_user_main_role(user: User) -> str:
     return "DRIVER"
 
 
-async def add_to_parking_queue(db: Session, user_id: int, vehicle_number: str, is_hitch: bool) -> ParkingQueue:
+# Кэш списков сотрудников по ролям: состав меняется только при выдаче/отзыве ролей
+ROLE_ROSTER_CACHE_TTL = 60  # секунд
+_role_roster_cache: Dict[Tuple[str, ...], Tuple[float, List[Tuple[int, int]]]] = {}
+
+
+async def get_users_with_roles(db: AsyncSession, role_names: Tuple[str, ...]) -> List[Tuple[int, int]]:
+    """
+    Получение пользователей с любой из указанных ролей (с кэшированием на ROLE_ROSTER_CACHE_TTL)
+
+    Args:
+        db: Сессия базы данных
+        role_names: Названия ролей
+
+    Returns:
+        Список пар (users.id, Telegram ID)
+    """
+    now = time.monotonic()
+    entry = _role_roster_cache.get(role_names)
+    if entry and now - entry[0] < ROLE_ROSTER_CACHE_TTL:
+        return entry[1]
+
+    rows = [tuple(row) for row in (await db.execute(select(User.id, User.telegram_id).where(
+        User.roles.any(RoleModel.name.in_(role_names))
+    ))).all()]
+    _role_roster_cache[role_names] = (now, rows)
+    return rows
+
+
+async def get_admin_telegram_ids(db: AsyncSession) -> List[int]:
+    """Получение Telegram ID всех администраторов"""
+    return [telegram_id for _, telegram_id in await get_users_with_roles(db, ("ADMIN",))]
+
+
+async def get_operators(db: AsyncSession) -> List[Tuple[int, int]]:
+    """Получение операторов и администраторов: пары (users.id, Telegram ID)"""
+    return await get_users_with_roles(db, ("OPERATOR", "ADMIN"))
+
+
+def invalidate_role_rosters_cache():
+    """Сброс кэша списков сотрудников (после выдачи или отзыва ролей ADMIN/OPERATOR)"""
+    _role_roster_cache.clear()
+
+
+# Кэш состояния очереди: при массовом прибытии пересчет выполняется не чаще раза в QUEUE_CACHE_TTL,
+# очередь меняется только в add_to_parking_queue и process_parking_departure (там кэш сбрасывается)
+QUEUE_CACHE_TTL = 1.0  # секунд
+_queue_stats_cache: Optional[Tuple[float, dict]] = None
+_queue_positions_cache: Optional[Tuple[float, Dict[int, int]]] = None
+
+
+def invalidate_queue_cache():
+    """Сброс кэша статистики и позиций очереди"""
+    global _queue_stats_cache, _queue_positions_cache
+    _queue_stats_cache = None
+    _queue_positions_cache = None
+
+
+async def add_to_parking_queue(db: AsyncSession, user_id: int, vehicle_number: str, is_hitch: bool) -> ParkingQueue:
     """
     Добавление ТС в очередь на парковку
     """
@@ -130,89 +295,110 @@ async def add_to_parking_queue(db: Session, user_id: int, vehicle_number: str, i
         status="waiting"
     )
     db.add(queue_item)
-    db.commit()
-    db.refresh(queue_item)
+    await db.commit()
+    invalidate_queue_cache()
+    await db.refresh(queue_item)
     return queue_item
 
 
-async def get_queue_position(db: Session, user_id: int) -> int:
+async def get_queue_position_snapshot(db: AsyncSession) -> Dict[int, int]:
     """
-    Получение позиции в очереди
+    Снимок позиций очереди одним запросом (с кэшированием на QUEUE_CACHE_TTL)
+
+    Returns:
+        Словарь {user_id: позиция в очереди, начиная с 1}
     """
-    user_item = db.query(ParkingQueue).filter(
-        ParkingQueue.user_id == user_id,
+    global _queue_positions_cache
+    now = time.monotonic()
+    if _queue_positions_cache and now - _queue_positions_cache[0] < QUEUE_CACHE_TTL:
+        return _queue_positions_cache[1]
+
+    user_ids = (await db.scalars(select(ParkingQueue.user_id).where(
         ParkingQueue.status.in_(["waiting", "notified"])
-    ).first()
+    ).order_by(ParkingQueue.created_at.asc()))).all()
 
-    if not user_item:
-        return 0
+    positions: Dict[int, int] = {}
+    for index, queue_user_id in enumerate(user_ids, start=1):
+        positions.setdefault(queue_user_id, index)
+
+    _queue_positions_cache = (now, positions)
+    return positions
 
-    position = db.query(ParkingQueue).filter(
-        ParkingQueue.status.in_(["waiting", "notified"]),
-        ParkingQueue.created_at < user_item.created_at
-    ).count() + 1
 
-    return position
+async def get_queue_position(db: AsyncSession, user_id: int) -> int:
+    """
+    Получение позиции в очереди (0, если пользователя нет в очереди)
+    """
+    positions = await get_queue_position_snapshot(db)
+    return positions.get(user_id, 0)
 
 
-async def get_queue_stats(db: Session) -> dict:
+async def get_queue_stats(db: AsyncSession) -> dict:
     """
-    Получение статистики очереди
+    Получение статистики очереди (с кэшированием на QUEUE_CACHE_TTL)
     """
-    waiting = db.query(ParkingQueue).filter(
+    global _queue_stats_cache
+    now = time.monotonic()
+    if _queue_stats_cache and now - _queue_stats_cache[0] < QUEUE_CACHE_TTL:
+        return dict(_queue_stats_cache[1])
+
+    waiting = await db.scalar(select(func.count()).select_from(ParkingQueue).where(
         ParkingQueue.status == "waiting"
-    ).count()
+    ))
 
-    notified = db.query(ParkingQueue).filter(
+    notified = await db.scalar(select(func.count()).select_from(ParkingQueue).where(
         ParkingQueue.status == "notified"
-    ).count()
+    ))
 
     total = waiting + notified
 
-    hitch_count = db.query(ParkingQueue).filter(
+    hitch_count = await db.scalar(select(func.count()).select_from(ParkingQueue).where(
         ParkingQueue.status.in_(["waiting", "notified"]),
         ParkingQueue.is_hitch == True
-    ).count()
+    ))
 
     non_hitch_count = total - hitch_count
 
-    return {
+    stats = {
         "total": total,
         "waiting": waiting,
         "notified": notified,
         "hitch": hitch_count,
         "non_hitch": non_hitch_count
     }
+    _queue_stats_cache = (now, stats)
+    return dict(stats)
 
 
-async def process_parking_departure(db: Session, spot_number: int, bot):
+async def process_parking_departure(db: AsyncSession, spot_number: int, bot):
     """
     Обработка освобождения парковочного места
     - Отправка уведомления следующему в очереди
     """
     # Находим следующего в очереди
-    next_in_queue = db.query(ParkingQueue).filter(
+    next_in_queue = await db.scalar(select(ParkingQueue).where(
         ParkingQueue.status == "waiting"
-    ).order_by(ParkingQueue.created_at.asc()).first()
+    ).order_by(ParkingQueue.created_at.asc()).limit(1))
 
     if next_in_queue:
         next_in_queue.status = "notified"
-        next_in_queue.notified_at = get_timezone_aware_now()
+        now = get_timezone_aware_now()
+        next_in_queue.notified_at = now
         next_in_queue.spot_number = spot_number
-        db.commit()
+        await db.commit()
+        invalidate_queue_cache()
 
         # Отправляем уведомление
         user = await get_user(db, next_in_queue.user_id)
         if user:
             try:
-                from utils import Emoji
                 await bot.send_message(
                     user.telegram_id,
                     f"{Emoji.NOTIFIED} ОСВОБОДИЛОСЬ ПАРКОВОЧНОЕ МЕСТО!\n\n"
                     f"📍 Место #{spot_number} свободно\n"
                     f"🚗 Ваше ТС: {next_in_queue.vehicle_number}\n"
                     f"📝 Тип: {'Перецепной' if next_in_queue.is_hitch else 'Не перецепной'}\n"
-                    f"⏰ Время ожидания: {format_duration(int((get_timezone_aware_now() - ensure_timezone_aware(next_in_queue.created_at)).total_seconds()))}\n"
+                    f"⏰ Время ожидания: {format_duration(int((now - ensure_timezone_aware(next_in_queue.created_at)).total_seconds()))}\n"
                     f"📊 Позиция в очереди: 1\n\n"
                     f"{Emoji.DRIVE} Проследуйте на парковочное место #{spot_number}\n"
                     f"{Emoji.ARRIVED} После парковки нажмите кнопку 'Прибытие'"
@@ -224,7 +410,92 @@ async def process_parking_departure(db: Session, spot_number: int, bot):
     return None
 
 
-async def get_free_parking_spot(db: Session) -> Optional[int]:
+async def get_active_parking_with_task(db: AsyncSession, user_id: int) -> Tuple[Optional[Parking], Optional[Task]]:
+    """
+    Активная парковка пользователя и ее незавершенная задача одним запросом
+
+    Args:
+        db: Сессия базы данных
+        user_id: ID пользователя (users.id)
+
+    Returns:
+        (парковка, задача в статусе PENDING/IN_PROGRESS); None там, где записи нет
+    """
+    row = (await db.execute(
+        select(Parking, Task).outerjoin(Task, and_(
+            Task.parking_id == Parking.id,
+            Task.status.in_(["PENDING", "IN_PROGRESS"])
+        )).where(
+            Parking.user_id == user_id,
+            Parking.departure_time == None
+        ).limit(1)
+    )).first()
+    return (row[0], row[1]) if row else (None, None)
+
+
+async def get_task_with_active_parking(db: AsyncSession, task_id: int, user_id: int) -> Tuple[Optional[Task], Optional[Parking]]:
+    """
+    Задача по ID и активная парковка пользователя одним запросом
+
+    Args:
+        db: Сессия базы данных
+        task_id: ID задачи
+        user_id: ID пользователя (users.id)
+
+    Returns:
+        (задача, активная парковка); None там, где записи нет
+    """
+    row = (await db.execute(
+        select(Task, Parking).outerjoin(Parking, and_(
+            Parking.user_id == user_id,
+            Parking.departure_time == None
+        )).options(joinedload(Task.parking)).where(Task.id == task_id).limit(1)
+    )).first()
+    return (row[0], row[1]) if row else (None, None)
+
+
+async def claim_task_for_driver(db: AsyncSession, task: Task, user_id: int) -> bool:
+    """
+    Атомарное назначение задачи на водителя (UPDATE ... RETURNING без предварительной блокировки)
+
+    Срабатывает для задачи PENDING (свободной или уже закрепленной за этим водителем)
+    и для IN_PROGRESS без водителя. Если другой водитель успел взять задачу раньше,
+    условие WHERE не выполнится и изменений не будет.
+
+    Args:
+        db: Сессия базы данных
+        task: Загруженная задача (ее атрибуты обновляются по результату UPDATE)
+        user_id: ID водителя (users.id)
+
+    Returns:
+        True, если задача назначена на водителя; коммит выполняет вызывающий код
+    """
+    now = get_timezone_aware_now()
+    row = (await db.execute(
+        update(Task).where(
+            Task.id == task.id,
+            or_(
+                and_(Task.status == "PENDING", or_(Task.driver_id.is_(None), Task.driver_id == user_id)),
+                and_(Task.status == "IN_PROGRESS", Task.driver_id.is_(None))
+            )
+        ).values(
+            driver_id=user_id,
+            status="IN_PROGRESS",
+            started_at=case((Task.status == "PENDING", now), else_=func.coalesce(Task.started_at, now))
+        ).returning(Task.started_at).execution_options(synchronize_session=False)
+    )).first()
+
+    if row is None:
+        return False
+
+    # Синхронизируем объект в сессии с тем, что записано в БД
+    set_committed_value(task, "driver_id", user_id)
+    set_committed_value(task, "status", "IN_PROGRESS")
+    set_committed_value(task, "started_at", row[0])
+    return True
+
+
+async def get_free_parking_spot(db: AsyncSession) -> Optional[int]:
     """
     Поиск свободного парковочного места
 
@@ -235,11 +506,9 @@ async def get_free_parking_spot(db: Session) -> Optional[int]:
         Номер свободного места или None
     """
     total_spots = config.PARKING_SPOTS
-    occupied_spots = db.query(Parking).filter(
+    occupied_numbers = set((await db.scalars(select(Parking.spot_number).where(
         Parking.departure_time == None
-    ).all()
-
-    occupied_numbers = {spot.spot_number for spot in occupied_spots}
+    ))).all())
 
     if len(occupied_numbers) >= total_spots:
         return None
@@ -250,23 +519,31 @@ async def get_free_parking_spot(db: Session) -> Optional[int]:
     return None
 
 
-async def validate_vehicle_number(vehicle_number: str) -> bool:
+def validate_vehicle_number(vehicle_number: str) -> bool:
     """Валидация номера ТС"""
     is_valid, _ = VehicleNumberValidator.validate(vehicle_number)
     return is_valid
 
 
-async def validate_vehicle_number_with_explanation(vehicle_number: str) -> Tuple[bool, str]:
+def validate_vehicle_number_with_explanation(vehicle_number: str) -> Tuple[bool, str]:
     """Валидация номера ТС с пояснением ошибки"""
     return VehicleNumberValidator.validate(vehicle_number)
 
 
-async def normalize_vehicle_number(vehicle_number: str) -> str:
+def normalize_vehicle_number(vehicle_number: str) -> str:
     """Нормализация номера ТС (латиница -> кириллица)"""
     return VehicleNumberValidator.normalize(vehicle_number)
 
 
-async def get_active_transfer_drivers(db: Session) -> List[User]:
+# Водитель перегона на смене и не на обеде
+ACTIVE_TRANSFER_DRIVER_CONDITIONS = (
+    User.is_on_shift == True,
+    User.is_on_break == False,
+    User.roles.any(RoleModel.name == "DRIVER_TRANSFER")
+)
+
+
+async def get_active_transfer_drivers(db: AsyncSession) -> List[User]:
     """
     Получение всех активных водителей перегона на смене
 
@@ -276,14 +553,43 @@ async def get_active_transfer_drivers(db: Session) -> List[User]:
     Returns:
         Список водителей перегона на смене
     """
-    return db.query(User).filter(
-        User.is_on_shift == True,
-        User.is_on_break == False,
-        User.roles.any(RoleModel.name == "DRIVER_TRANSFER")
-    ).all()
+    return (await db.scalars(select(User).where(*ACTIVE_TRANSFER_DRIVER_CONDITIONS))).all()
+
 
+async def get_active_transfer_driver_ids(db: AsyncSession) -> List[int]:
+    """
+    Telegram ID активных водителей перегона на смене (для рассылок)
 
-async def get_task_from_pool(db: Session) -> Optional[Task]:
+    Выбирается только столбец telegram_id, объекты User и их роли не загружаются.
+    """
+    return (await db.scalars(select(User.telegram_id).where(*ACTIVE_TRANSFER_DRIVER_CONDITIONS))).all()
+
+
+# Условия выбора задачи из пула и порядок выдачи (по приоритету, затем по времени создания)
+POOL_TASK_CONDITIONS = (
+    Task.status == "PENDING",
+    Task.is_in_pool == True,
+    Parking.is_hitch == True,
+    Parking.departure_time == None,  # ТС еще на парковке
+    Task.driver_id == None  # Никто не взял
+)
+POOL_TASK_ORDER = (Task.priority.desc(), Task.created_at.asc())
+
+# Загрузка задачи для показа водителю: из места нужны только номер и ТС,
+# связанные пользователи (водитель, оператор, владелец ТС) не загружаются
+TASK_SUMMARY_OPTIONS = (
+    joinedload(Task.parking).load_only(Parking.spot_number, Parking.vehicle_number),
+)
+
+# Загрузка задач для списков оператора: место - тем же JOIN, водители всех задач -
+# одним IN-запросом; роли водителей, владелец ТС и оператор не нужны
+TASK_LIST_OPTIONS = (
+    joinedload(Task.parking),
+    selectinload(Task.driver),
+)
+
+
+async def get_task_from_pool(db: AsyncSession) -> Optional[Task]:
     """
     Получение задачи с максимальным приоритетом из пула
     - Проверяет, что ТС еще на парковке
@@ -291,28 +597,84 @@ async def get_task_from_pool(db: Session) -> Optional[Task]:
     - Проверяет, что задача в пуле
     - Сортирует по приоритету и времени создания
     """
-    return db.query(Task).join(Parking).filter(
-        Task.status == "PENDING",
-        Task.is_in_pool == True,
-        Parking.is_hitch == True,
-        Parking.departure_time == None,  # ТС еще на парковке
-        Task.driver_id == None  # Никто не взял
-    ).order_by(
-        Task.priority.desc(),
-        Task.created_at.asc()
-    ).first()
+    return await db.scalar(select(Task).join(Parking).options(contains_eager(Task.parking)).where(
+        *POOL_TASK_CONDITIONS
+    ).order_by(*POOL_TASK_ORDER).limit(1))
 
 
-async def generate_excel_report(parkings: List[Parking], period: str = None) -> BytesIO:
+async def take_task_from_pool(db: AsyncSession, user_id: int) -> Optional[Task]:
+    """
+    Атомарная выдача водителю задачи из пула: выбор и назначение одним UPDATE ... RETURNING
+
+    Подзапрос блокирует выбранную строку (FOR UPDATE SKIP LOCKED в PostgreSQL),
+    поэтому одновременно берущие задачи водители получают разные задачи и не ждут друг друга.
+
+    Args:
+        db: Сессия базы данных
+        user_id: ID водителя (users.id)
+
+    Returns:
+        Назначенная задача или None, если пул пуст; коммит выполняет вызывающий код
+    """
+    next_task_id = select(Task.id).join(Parking).where(
+        *POOL_TASK_CONDITIONS
+    ).order_by(*POOL_TASK_ORDER).limit(1).with_for_update(of=Task, skip_locked=True).scalar_subquery()
+
+    task_id = await db.scalar(
+        update(Task).where(
+            Task.id == next_task_id,
+            Task.status == "PENDING",
+            Task.driver_id.is_(None)
+        ).values(
+            driver_id=user_id,
+            status="IN_PROGRESS",
+            started_at=get_timezone_aware_now(),
+            is_stuck=False,
+            stuck_reason=None
+        ).returning(Task.id).execution_options(synchronize_session=False)
+    )
+    if task_id is None:
+        return None
+
+    # Задача могла уже быть в сессии (например, только что снятая зависшая) - перечитываем
+    return await db.get(Task, task_id, populate_existing=True, options=TASK_SUMMARY_OPTIONS)
+
+
+# Столбцы парковки, которые попадают в Excel отчет
+REPORT_PARKING_COLUMNS = (
+    Parking.is_hitch,
+    Parking.vehicle_number,
+    Parking.spot_number,
+    Parking.arrival_time,
+    Parking.departure_time,
+)
+# Сколько строк отчета читается из БД за раз
+REPORT_YIELD_PER = 1000
+
+
+async def stream_parking_report_rows(db: AsyncSession, start_date: datetime, end_date: datetime) -> AsyncResult:
+    """
+    Потоковая выборка записей парковки за период для Excel отчета
+
+    Выбираются только нужные столбцы, без ORM-объектов и связанных пользователей,
+    строки читаются из БД порциями по REPORT_YIELD_PER.
+    """
+    return await db.stream(select(*REPORT_PARKING_COLUMNS).where(
+        Parking.arrival_time >= start_date,
+        Parking.arrival_time <= end_date
+    ).order_by(Parking.arrival_time).execution_options(yield_per=REPORT_YIELD_PER))
+
+
+async def generate_excel_report(parkings: AsyncResult, period: str = None) -> Tuple[BytesIO, int]:
     """
     Генерация Excel отчета по парковке
 
     Args:
-        parkings: Список записей парковки
+        parkings: Строки парковки из stream_parking_report_rows
         period: Название периода
 
     Returns:
-        BytesIO объект с Excel файлом
+        BytesIO объект с Excel файлом и количество записей в отчете
     """
     wb = Workbook()
     ws = wb.active
@@ -331,7 +693,9 @@ async def generate_excel_report(parkings: List[Parking], period: str = None) ->
         cell.alignment = Alignment(horizontal="center")
 
     # Данные
-    for idx, parking in enumerate(parkings, 2):
+    idx = 1
+    async for parking in parkings:
+        idx += 1
         ws.cell(row=idx, column=1, value=idx-1)
         ws.cell(row=idx, column=2, value="Перецепной" if parking.is_hitch else "Не перецепной")
         ws.cell(row=idx, column=3, value=parking.vehicle_number)
@@ -350,45 +714,49 @@ async def generate_excel_report(parkings: List[Parking], period: str = None) ->
     excel_file = BytesIO()
     wb.save(excel_file)
     excel_file.seek(0)
-    return excel_file
+    return excel_file, idx - 1
 
 # Добавьте в конец файла services.py
 
-def get_tasks_for_current_shift(db: Session, include_completed: bool = False) -> List[Task]:
+async def get_tasks_for_current_shift(db: AsyncSession, include_completed: bool = False, options: tuple = ()) -> List[Task]:
     """
     Получение задач за текущую смену
+
+    options - загрузка связей, которые читает вызывающий код (например, TASK_LIST_OPTIONS)
     """
     start_time, end_time, _ = get_current_shift_period()
 
-    query = db.query(Task).filter(
+    query = select(Task).options(*options).where(
         Task.created_at >= start_time,
         Task.created_at <= end_time
     )
 
     if not include_completed:
         # Исключаем выполненные задачи, если не запрошены специально
-        query = query.filter(Task.status != "COMPLETED")
+        query = query.where(Task.status != "COMPLETED")
 
-    return query.order_by(Task.created_at.desc()).all()
+    return (await db.scalars(query.order_by(Task.created_at.desc()))).all()
 
 
-def get_parking_for_current_shift(db: Session) -> List[Parking]:
+async def get_parking_for_current_shift(db: AsyncSession, options: tuple = ()) -> List[Parking]:
     """
     Получение записей о парковке за текущую смену
     Включает только активные (без departure_time) и те, что были созданы в эту смену
+
+    options - загрузка связей, которые читает вызывающий код (например, владельца ТС)
     """
     start_time, end_time, _ = get_current_shift_period()
 
     # Активные парковки (ТС еще на месте)
-    active_parkings = db.query(Parking).filter(
+    active_parkings = (await db.scalars(select(Parking).options(*options).where(
         Parking.departure_time == None
-    ).all()
+    ))).all()
 
     # Парковки, созданные в эту смену (даже если уже убыли)
-    shift_parkings = db.query(Parking).filter(
+    shift_parkings = (await db.scalars(select(Parking).options(*options).where(
         Parking.arrival_time >= start_time,
         Parking.arrival_time <= end_time
-    ).all()
+    ))).all()
 
     # Объединяем без дубликатов
     parking_dict = {p.id: p for p in active_parkings}
@@ -398,22 +766,22 @@ def get_parking_for_current_shift(db: Session) -> List[Parking]:
     return list(parking_dict.values())
 
 
-def get_queue_for_current_shift(db: Session) -> List[ParkingQueue]:
+async def get_queue_for_current_shift(db: AsyncSession) -> List[ParkingQueue]:
     """
     Получение записей очереди за текущую смену
     """
     start_time, end_time, _ = get_current_shift_period()
 
     # Активные в очереди
-    active_queue = db.query(ParkingQueue).filter(
+    active_queue = (await db.scalars(select(ParkingQueue).where(
         ParkingQueue.status.in_(["waiting", "notified"])
-    ).all()
+    ))).all()
 
     # Записи, созданные в эту смену
-    shift_queue = db.query(ParkingQueue).filter(
+    shift_queue = (await db.scalars(select(ParkingQueue).where(
         ParkingQueue.created_at >= start_time,
         ParkingQueue.created_at <= end_time
-    ).all()
+    ))).all()
 
     # Объединяем без дубликатов
     queue_dict = {q.id: q for q in active_queue}
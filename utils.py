@@ -3,6 +3,7 @@
 """
 
 from datetime import datetime, timedelta
+from types import MappingProxyType
 from typing import Optional, Tuple
 
 import pytz
@@ -11,6 +12,16 @@ import pytz
 moscow_tz = pytz.timezone('Europe/Moscow')
 
 
+def format_dt(dt: datetime) -> str:
+    """Дата и время в формате дд.мм.гггг чч:мм без вызова strftime"""
+    return f"{dt.day:02}.{dt.month:02}.{dt.year} {dt.hour:02}:{dt.minute:02}"
+
+
+def format_hm_dmy(dt: datetime) -> str:
+    """Время и дата в формате чч:мм дд.мм.гггг без вызова strftime"""
+    return f"{dt.hour:02}:{dt.minute:02} {dt.day:02}.{dt.month:02}.{dt.year}"
+
+
 class Emoji:
     """Константы эмодзи для единообразия интерфейса"""
     # Навигация
@@ -111,6 +122,23 @@ TASK_STATUS_EMOJI = {
     "CANCELLED": "❌"
 }
 
+# Названия ролей для отображения (неизменяемые, общие для всех обработчиков)
+ROLE_DISPLAY_NAMES = MappingProxyType({
+    "DRIVER": "Водитель",
+    "DRIVER_TRANSFER": "Водитель перегона",
+    "OPERATOR": "Оператор",
+    "ADMIN": "Администратор",
+    "DEB_EMPLOYEE": "Сотрудник ДЭБ"
+})
+
+ROLE_DISPLAY_NAMES_WITH_EMOJI = MappingProxyType({
+    "DRIVER": f"{Emoji.DEPARTURE} Водитель",
+    "DRIVER_TRANSFER": f"{Emoji.DRIVER_TRANSFER} Водитель перегона",
+    "OPERATOR": f"{Emoji.OPERATOR} Оператор",
+    "ADMIN": f"{Emoji.ADMIN} Администратор",
+    "DEB_EMPLOYEE": f"{Emoji.DEB} Сотрудник ДЭБ"
+})
+
 TASK_TYPE_NAMES = {
     True: "🔗 Перецепной",
     False: "🚛 Не перецепной"
@@ -20,21 +20,17 @@ class VehicleNumberValidator:
         'Y': 'У', 'X': 'Х'
     }
 
+    # Готовая таблица для str.translate (строится один раз при загрузке модуля)
+    TRANSLIT_TABLE = str.maketrans(TRANSLIT_MAP)
+
     @classmethod
     def normalize(cls, vehicle_number: str) -> str:
         """Нормализация номера ТС: приведение к верхнему регистру и замена латиницы на кириллицу"""
         if not vehicle_number:
             return vehicle_number
 
-        # Приводим к верхнему регистру
-        normalized = vehicle_number.strip().upper()
-
-        # Заменяем латинские буквы на кириллические
-        result = []
-        for char in normalized:
-            result.append(cls.TRANSLIT_MAP.get(char, char))
-
-        return ''.join(result)
+        # Приводим к верхнему регистру и заменяем латинские буквы на кириллические
+        return vehicle_number.strip().upper().translate(cls.TRANSLIT_TABLE)
 
     @classmethod
     def validate(cls, vehicle_number: str) -> tuple[bool, str]: